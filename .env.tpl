@@ -4,8 +4,13 @@
 # Basic
 APP_ENV="DEV"
 APP_SETTINGS_LOG_DIR="/tmp/"
+# APP_SETTINGS_LOG_QUEUE_SIZE=10000  # 0 to write log files synchronously
 APP_SETTINGS_CRYPTO_SECRET="xxx-xxxxxxxxx-xxxxxx"
 APP_SETTINGS_THEME_COFFEE_CDN="https://theme-coffee-staging.vercel.app"
+# APP_SETTINGS_TEMPLATES_CACHE_DIR="/tmp/jinja/"
+# APP_SETTINGS_STATIC_BUILD_DIR="/tmp/static/"
+# APP_SETTINGS_LAZY_MOUNTS=true  # import the routes of each trellis on their first request
+# APP_SETTINGS_LAMBDA_BATCHING=true  # only for workers started with `--pool threads`, see trellis/xlib/lambdas.py
 
 # MongoDB
 APP_SETTINGS_MONGO__PROTOCOL="mongodb+srv"
@@ -15,6 +20,14 @@ APP_SETTINGS_MONGO__USERNAME="somadnachirou"
 APP_SETTINGS_MONGO__PASSWORD="Passw0rde"
 APP_SETTINGS_MONGO__PARAMS="retryWrites=true&w=majority"
 APP_SETTINGS_MONGO__PORT=""
+# APP_SETTINGS_SLOW_QUERY_MS=100  # 0 to disable the slow-query log
+# APP_SETTINGS_QUERY_PROFILE_DIR="/tmp/queries/"
+# APP_SETTINGS_CRON_STATS_TTL=60  # 0 to compute the stats of the crons on each request
+# APP_SETTINGS_WARMUP_MONGO_CONNECTIONS=4
+# APP_SETTINGS_WARMUP_HTTP_URLS='["https://graph.facebook.com/"]'
+
+# Redis (optional), cache shared by all workers
+# APP_SETTINGS_REDIS_URL="redis://localhost:6379/0"
 
 # SSL
 APP_SETTINGS_SSL_KEYFILE="./localhost-key.pem"
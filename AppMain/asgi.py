@@ -7,6 +7,8 @@ It exposes the ASGI callable as a module-level variable named ``app``.
 """
 
 import logging
+import os
+import pathlib
 import typing
 from contextlib import asynccontextmanager
 from importlib import import_module
@@ -16,69 +18,115 @@ from fastapi import APIRouter, FastAPI, Request, Response, status
 from fastapi.exception_handlers import request_validation_exception_handler
 from fastapi.exceptions import RequestValidationError
 from starlette.middleware.sessions import SessionMiddleware
-from starlette.responses import JSONResponse
+from starlette.responses import JSONResponse, PlainTextResponse
 from starlette.routing import Mount
-from starlette.staticfiles import StaticFiles
 
 from sap.beanie.client import BeanieClient
 from sap.fastapi import Flash
-from sap.fastapi.middleware import InitBeanieMiddleware, LogServerErrorMiddleware
+from sap.fastapi.middleware import LogServerErrorMiddleware
+
+from trellis.xlib.assets import PrecompressedStaticFiles, StaticAssets
+from trellis.xlib.database import BeanieGuard, InitBeanieMiddleware
+from trellis.xlib.ingest import IngestQueue
+from trellis.xlib.metrics import Histogram, MetricsMiddleware
+from trellis.xlib.profiler import query_profiler
+from trellis.xlib.readiness import Readiness, pool_listener
+from trellis.xlib.rest import HttpPool
+from trellis.xlib.routing import LazyMount
 
 from .settings import AppSettings, logger, templates
 
 
 @asynccontextmanager
 async def lifespan(current_app: FastAPI) -> typing.AsyncGenerator[None, None]:
-    """Initialize beanie on startup."""
+    """Build static files, compile templates, initialize beanie, open the HTTP pool and start ingest queues on startup.
+
+    Then MongoDB and HTTP connections are warmed up, and the readiness state is refreshed in the background.
+    Ingest queues are drained on shutdown, before the HTTP pool is closed, and query statistics are dumped.
+    """
     assert current_app
+    static_assets.load()
+    precompile_templates()
     await initialize_beanie()
     # await update_uvicorn_logger()
-    yield
+    readiness = Readiness.lifespan(
+        await BeanieClient.get_db_default(),
+        mongo_connections=AppSettings.WARMUP_MONGO_CONNECTIONS,
+        http_urls=AppSettings.WARMUP_HTTP_URLS,
+        http_connections=AppSettings.WARMUP_HTTP_CONNECTIONS,
+        timeout=AppSettings.WARMUP_TIMEOUT,
+    )
+    async with HttpPool.lifespan(), IngestQueue.lifespan(), readiness:
+        yield
+    query_profiler.dump()
 
 
 # Initialize application
-app = FastAPI(docs_url=None, redoc_url=None, routes=[])
+app = FastAPI(docs_url=None, redoc_url=None, routes=[], lifespan=lifespan)
 # Bugs with using starlette path when using Mount
 # curl http://localhost:8000/tokenify/pages/login/
 # expected path=/tokenify/pages/login/
 # output path=/pages/login/
 # https://github.com/encode/starlette/issues/1336
 
-# Mount static folder
-app.routes.append(Mount(path="/static", app=StaticFiles(directory=AppSettings.APP_DIR / "static"), name="static"))
+# Mount static folder, fingerprinted and compressed on startup, not on import, so that crons and lambdas do not
+static_assets = StaticAssets(
+    source=AppSettings.APP_DIR / "static",
+    target=pathlib.Path(AppSettings.STATIC_BUILD_DIR or os.path.join(AppSettings.LOG_DIR, "static")),
+)
+app.routes.append(Mount(path="/static", app=PrecompressedStaticFiles(assets=static_assets), name="static"))
 
 # Load sub-apps routes and documents
+# With `LAZY_MOUNTS`, routes are imported on their first request, documents are needed to initialize beanie
 document_models: list[typing.Type[beanie.Document]] = []
 for trellis_name in AppSettings.TRELLIS_LIST:
     models_module = import_module(f"trellis.{trellis_name}.models")
-    routes_module = import_module(f"trellis.{trellis_name}.routes")
-
-    # initialize router with default routes for each trellis
-    router: APIRouter = getattr(routes_module, "router")
 
     # Mount sub-apps routes
-    app.routes.append(Mount(path=f"/{trellis_name}", app=router, name=trellis_name))
+    if AppSettings.LAZY_MOUNTS:
+        app.routes.append(
+            LazyMount(path=f"/{trellis_name}", target=f"trellis.{trellis_name}.routes:router", name=trellis_name)
+        )
+    else:
+        # initialize router with default routes for each trellis
+        router: APIRouter = getattr(import_module(f"trellis.{trellis_name}.routes"), "router")
+        app.routes.append(Mount(path=f"/{trellis_name}", app=router, name=trellis_name))
 
     # Retrieve the lists of documents for beanie initialization
     for model_name in models_module.__all__:
         document_models.append(getattr(models_module, model_name))
 
 
+# Listeners of the MongoDB clients opened by `BeanieGuard`
+BeanieGuard.listeners.extend([query_profiler, pool_listener])
+
 # Register middleware
 app.add_middleware(InitBeanieMiddleware, mongo_params=AppSettings.MONGO, document_models=document_models)
 app.add_middleware(SessionMiddleware, session_cookie="starlette", secret_key=AppSettings.CRYPTO_SECRET, max_age=None)
 if AppSettings.APP_ENV != "PROD":
     app.add_middleware(LogServerErrorMiddleware)
+app.add_middleware(MetricsMiddleware)  # added last to measure the other middleware
 
 # Templates
 templates.env.globals["get_flashed_messages"] = Flash.get_messages
 templates.env.globals["AppSettings"] = AppSettings
+templates.env.globals["static_url"] = static_assets.url_for
 
 
 # Events to run on startups
 async def initialize_beanie() -> None:
-    """Initialize beanie on startup."""
-    await BeanieClient.init(mongo_params=AppSettings.MONGO, document_models=document_models)
+    """Initialize beanie on startup, once per process."""
+    await BeanieGuard.init(mongo_params=AppSettings.MONGO, document_models=document_models)
+
+
+def precompile_templates() -> None:
+    """Compile the shared templates and those of each trellis, so that first requests do not compile them.
+
+    Templates are loaded from the bytecode cache when they have not changed since the last run.
+    """
+    for name in templates.env.list_templates(extensions=["jinja"]):
+        if "/" not in name or name.split("/")[0] in AppSettings.TRELLIS_LIST:
+            templates.env.get_template(name)
 
 
 # Always log exception
@@ -99,10 +147,28 @@ async def update_uvicorn_logger() -> None:
 
 @app.get("/health/", status_code=status.HTTP_200_OK)
 async def health() -> dict[str, str]:
-    """Health check."""
+    """Health check, the process is alive."""
     return {"message": "OK"}
 
 
+@app.get("/ready/", status_code=status.HTTP_200_OK)
+async def ready() -> Response:
+    """Readiness check, the connections are warmed up and MongoDB is writable.
+
+    The state is refreshed in the background, the probe does not send any command to MongoDB.
+    """
+    state = Readiness.state
+    return JSONResponse(
+        state, status_code=status.HTTP_200_OK if state["ready"] else status.HTTP_503_SERVICE_UNAVAILABLE
+    )
+
+
+@app.get("/metrics/", status_code=status.HTTP_200_OK)
+async def metrics() -> Response:
+    """Latency histograms of this process, in the Prometheus text format."""
+    return PlainTextResponse(Histogram.export(), media_type="text/plain; version=0.0.4")
+
+
 @app.get("/", status_code=status.HTTP_200_OK)
 async def index(request: Request) -> Response:
     """Home page."""
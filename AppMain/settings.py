@@ -22,12 +22,15 @@ import os
 import pathlib
 import typing
 
+import jinja2
 import pydantic
 import pydantic_settings
 from fastapi.templating import Jinja2Templates
 
 from sap.settings import DatabaseParams, IntegrationParams
 
+from trellis.xlib.logs import QueuedFileHandler
+
 
 class TestcasesParams(pydantic.BaseModel):
     """
@@ -67,11 +70,26 @@ class _Settings(pydantic_settings.BaseSettings):
     # Envs
     APP_ENV: str = os.getenv("APP_ENV", "DEV")
     LOG_DIR: str = "/tmp/"
+    LOG_QUEUE_SIZE: int = 10_000  # log records waiting to be written to the files, 0 to write them synchronously
     APP_DIR: pathlib.Path = pathlib.Path(__file__).parent.parent
     THEME_COFFEE_CDN: str = "https://theme-coffee-staging.vercel.app"
+    TEMPLATES_CACHE_DIR: str | None = None  # compiled templates, defaults to a `jinja` folder in LOG_DIR
+    STATIC_BUILD_DIR: str | None = (
+        None  # fingerprinted and compressed static files, defaults to a `static` folder in LOG_DIR
+    )
 
     # Databases
     MONGO: DatabaseParams
+    REDIS_URL: str | None = None  # enable the cache shared by all workers, ex: redis://localhost:6379/0
+    SLOW_QUERY_MS: float = 100  # log MongoDB queries slower than this with their plan, 0 to disable
+    QUERY_PROFILE_DIR: str | None = None  # statistics of the query shapes, defaults to a `queries` folder in LOG_DIR
+    CRON_STATS_TTL: float = 60  # seconds during which the stats of a cron are served from a cache, 0 to disable
+
+    # Connections opened on startup, before accepting requests
+    WARMUP_MONGO_CONNECTIONS: int = 4
+    WARMUP_HTTP_URLS: list[str] = []  # origins of the shared HTTP pool, ex: ["https://graph.facebook.com/"]
+    WARMUP_HTTP_CONNECTIONS: int = 2  # requests sent to each origin
+    WARMUP_TIMEOUT: float = 10  # seconds after which startup goes on with the connections already opened
 
     # Tokens
     TESTCASES: TestcasesParams = TestcasesParams()
@@ -87,6 +105,8 @@ class _Settings(pydantic_settings.BaseSettings):
     SSL_CERTFILE: str | None = None
 
     TRELLIS_LIST: list[str] = ["instagram"]
+    LAZY_MOUNTS: bool = False  # import the routes of each trellis on their first request, for a faster startup
+    LAMBDA_BATCHING: bool = False  # coalesce the signals of lambdas with a `batch_window`, for the `threads` pool
 
     # Instagram
     INSTAGRAM: IntegrationParams
@@ -105,6 +125,13 @@ AppSettings = _Settings()
 # ###################################
 
 
+def get_file_handler(filename: str) -> dict[str, typing.Any]:
+    """Return the config of a handler writing to a file, from a background thread if `LOG_QUEUE_SIZE` is set."""
+    if AppSettings.LOG_QUEUE_SIZE:
+        return {"()": QueuedFileHandler, "filename": filename, "maxsize": AppSettings.LOG_QUEUE_SIZE}
+    return {"class": "logging.FileHandler", "filename": filename}
+
+
 def logging_setter() -> dict[str, typing.Any]:
     """Set the logging config for all apps in `AppSettings.TRELLIS_LIST`."""
     log_dir: str = AppSettings.LOG_DIR
@@ -132,27 +159,23 @@ def logging_setter() -> dict[str, typing.Any]:
             },
             "file_trellis": {
                 "level": "DEBUG",
-                "class": "logging.FileHandler",
-                "filename": os.path.join(log_dir, "trellis.log"),
+                **get_file_handler(os.path.join(log_dir, "trellis.log")),
                 "formatter": "simple",
             },
             "file_celery": {
                 "level": "DEBUG",
-                "class": "logging.FileHandler",
-                "filename": os.path.join(log_dir, "celery.log"),
+                **get_file_handler(os.path.join(log_dir, "celery.log")),
                 "formatter": "simple",
             },
             "file_sap": {
                 "level": "DEBUG",
-                "class": "logging.FileHandler",
-                "filename": os.path.join(log_dir, "sap.log"),
+                **get_file_handler(os.path.join(log_dir, "sap.log")),
                 "formatter": "simple",
             },
             **{
                 f"file_trellis_{app_name}": {
                     "level": "DEBUG",
-                    "class": "logging.FileHandler",
-                    "filename": os.path.join(log_dir, f"trellis_{app_name}.log"),
+                    **get_file_handler(os.path.join(log_dir, f"trellis_{app_name}.log")),
                     "formatter": "simple",
                 }
                 for app_name in app_names
@@ -197,7 +220,12 @@ logger = logging.getLogger("trellis")
 
 
 # ###################################
-# #     Logging       ###############
+# #     Templates     ###############
 # ###################################
 
 templates = Jinja2Templates(directory=AppSettings.APP_DIR / "templates")
+
+# Persist compiled templates, so that restarted workers do not compile them again
+templates_cache_dir = AppSettings.TEMPLATES_CACHE_DIR or os.path.join(AppSettings.LOG_DIR, "jinja")
+os.makedirs(templates_cache_dir, exist_ok=True)
+templates.env.bytecode_cache = jinja2.FileSystemBytecodeCache(templates_cache_dir)
@@ -0,0 +1,58 @@
+"""
+Benchmark: Beanie initialization.
+
+Compare the overhead added to each lambda invocation by the Beanie initialization
+before (`BeanieClient.init` on each invocation) and after (`BeanieGuard`, documents initialized once
+per process and the connection pinged once per event loop).
+As `LambdaTask.run` does, each invocation runs in its own event loop.
+
+Run from the project root against a local MongoDB:
+```shell
+python -m scripts.benchmarks.beanie_init 10000
+```
+"""
+
+import asyncio
+import statistics
+import sys
+import time
+import typing
+
+from sap.beanie.client import BeanieClient
+
+from AppMain.asgi import document_models, initialize_beanie
+from AppMain.settings import AppSettings
+
+
+async def init_before() -> None:
+    """Initialize Beanie as each lambda invocation did before the guard."""
+    await BeanieClient.init(mongo_params=AppSettings.MONGO, document_models=document_models)
+
+
+SCENARIOS: dict[str, typing.Callable[[], typing.Coroutine[typing.Any, typing.Any, None]]] = {
+    "before": init_before,
+    "after": initialize_beanie,
+}
+
+
+def main(invocations: int) -> None:
+    """Run each scenario for the given number of invocations and print the overhead per invocation."""
+    AppSettings.MONGO.db = "trellis_benchmark"
+    asyncio.run(initialize_beanie())
+
+    for name, scenario in SCENARIOS.items():
+        durations = []
+        for _ in range(invocations):
+            start = time.perf_counter()
+            asyncio.run(scenario())
+            durations.append(time.perf_counter() - start)
+        durations.sort()
+        print(
+            f"{invocations:>6} invocations | {name:<6} | total {sum(durations):>8.2f} s"
+            f" | mean {statistics.mean(durations) * 1e6:>8.0f} µs"
+            f" | p95 {durations[int(0.95 * (len(durations) - 1))] * 1e6:>8.0f} µs"
+        )
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10_000)
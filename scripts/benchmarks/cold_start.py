@@ -0,0 +1,57 @@
+"""
+Benchmark: Cold start.
+
+Compare the latency of the first concurrent page loads of a new worker, each of them
+authenticating a merchant with a MongoDB query, before (connections opened by these
+requests) and after (`Readiness.warm_up_mongo()` on startup).
+Each run uses a new client, as a restarted worker does, and the median of the runs is printed.
+
+Run from the project root against a local MongoDB:
+```shell
+python -m scripts.benchmarks.cold_start 20 8
+```
+"""
+
+import asyncio
+import statistics
+import sys
+import time
+
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from AppMain.settings import AppSettings
+from trellis.xlib.readiness import Readiness
+
+
+async def first_requests(concurrency: int, warm_up: bool) -> list[float]:
+    """Return the latency of the first concurrent queries of a new client, in milliseconds."""
+    client: AsyncIOMotorClient = AsyncIOMotorClient(AppSettings.MONGO.get_dns())
+    database = client[AppSettings.MONGO.db]
+    await database.command("ping")  # Beanie initialization, the topology is known and one connection is open
+    if warm_up:
+        await Readiness.warm_up_mongo(database, concurrency)
+
+    async def query() -> float:
+        start = time.perf_counter()
+        await database["instagram_merchant"].find_one({"beans_card_id": "card_benchmark"})
+        return (time.perf_counter() - start) * 1000
+
+    latencies = await asyncio.gather(*[query() for _ in range(concurrency)])
+    client.close()
+    return sorted(latencies)
+
+
+def main(runs: int, concurrency: int) -> None:
+    """Run both scenarios and print the median latencies."""
+    AppSettings.MONGO.db = "trellis_benchmark"
+    for name, warm_up in [("before", False), ("after", True)]:
+        results = [asyncio.run(first_requests(concurrency, warm_up)) for _ in range(runs)]
+        print(
+            f"{runs:>3} runs | {concurrency:>3} requests | {name:<6}"
+            f" | median {statistics.median(statistics.median(x) for x in results):>7.2f} ms"
+            f" | max {statistics.median(x[-1] for x in results):>7.2f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20, int(sys.argv[2]) if len(sys.argv) > 2 else 8)
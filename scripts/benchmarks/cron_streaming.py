@@ -0,0 +1,66 @@
+"""
+Benchmark: Cron streaming.
+
+Compare the peak memory and the duration of a `FetchReviewsCron` batch over new merchants
+before (merchants materialized with `to_list()`) and after (`TrellisCronTask.stream()`).
+The merchants are only read, the worker does nothing.
+
+Run from the project root against a local MongoDB:
+```shell
+python -m scripts.benchmarks.cron_streaming 1000 10000 100000
+```
+"""
+
+import asyncio
+import sys
+import time
+import tracemalloc
+import typing
+
+from sap.worker.crons import FetchStrategy
+
+from AppMain.asgi import initialize_beanie
+from AppMain.settings import AppSettings
+from trellis.instagram.crons import FetchReviewsCron
+from trellis.instagram.models import MerchantDoc
+
+
+async def noop(merchant: MerchantDoc) -> int:  # pylint: disable=unused-argument
+    """Process a merchant without any work."""
+    return 0
+
+
+async def main(sizes: list[int]) -> None:
+    """Run both scenarios for each batch size and print their peak memory and duration."""
+    AppSettings.MONGO.db = "trellis_benchmark"
+    await initialize_beanie()
+    task = FetchReviewsCron(kwargs={"strategy": FetchStrategy.NEW})
+    await MerchantDoc.get_motor_collection().delete_many({})
+    await MerchantDoc.insert_many(
+        [
+            MerchantDoc(
+                website="benchmark.com", beans_card_id=f"card_{i}", beans_card_address=f"card_{i}", is_active=True
+            )
+            for i in range(max(sizes))
+        ]
+    )
+
+    for size in sizes:
+        for name in ["before", "after"]:
+            queryset = task.get_queryset(batch_size=size, strategy=FetchStrategy.NEW)
+            tracemalloc.start()
+            start = time.perf_counter()
+            items: list[MerchantDoc] | typing.AsyncIterator[MerchantDoc]
+            items = await queryset.to_list() if name == "before" else task.stream(queryset)
+            stats = await task.process_concurrently(items, noop)
+            elapsed = time.perf_counter() - start
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print(
+                f"{size:>7} merchants | {name:<6} | {elapsed * 1000:>8.1f} ms"
+                f" | peak {peak / 1024 / 1024:>7.1f} MiB | {stats.processed} processed"
+            )
+
+
+if __name__ == "__main__":
+    asyncio.run(main([int(x) for x in sys.argv[1:]] or [1000, 10_000, 100_000]))
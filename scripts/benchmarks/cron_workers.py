@@ -0,0 +1,124 @@
+"""
+Benchmark: Cron workers.
+
+Run `FetchReviewsCron` batches in several worker processes at the same time, until all merchants are fetched,
+and compare the throughput and the duplicate fetches before (each worker fetches the first merchants of the
+queryset) and after (merchants claimed with a `LeaseClaimer`).
+The Graph API is replaced by a fixed latency, and each fetch is recorded in a `benchmark_fetch` collection.
+
+Run from the project root against a local MongoDB:
+```shell
+python -m scripts.benchmarks.cron_workers 2000 1 2 4 8
+```
+"""
+
+import asyncio
+import multiprocessing
+import sys
+import time
+import typing
+from datetime import UTC, datetime
+
+import pymongo
+import pymongo.database
+
+from sap.worker.crons import FetchStrategy
+
+from AppMain.asgi import initialize_beanie
+from AppMain.settings import AppSettings
+from trellis.instagram.crons import FetchReviewsCron
+from trellis.instagram.models import MerchantDoc
+from trellis.xlib.leases import LeaseClaimer
+
+BATCH_SIZE = 100
+FETCH_LATENCY = 0.05  # seconds of a merchant fetch, mostly spent waiting for the Graph API
+
+
+async def fetch(merchant: MerchantDoc) -> int:
+    """Fetch a merchant, as `fetch_reviews_for_merchant()` without reviews, and record the fetch."""
+    await asyncio.sleep(FETCH_LATENCY)
+    await MerchantDoc.get_motor_collection().database["benchmark_fetch"].insert_one({"merchant": merchant.id})
+    await merchant.set({MerchantDoc.last_review_fetched: datetime.now(UTC)})
+    return 0
+
+
+async def run_batch(task: FetchReviewsCron, leases: bool) -> int:
+    """Fetch a batch of merchants, and return the number of merchants fetched."""
+    queryset = task.get_queryset(batch_size=BATCH_SIZE, strategy=FetchStrategy.NEW)
+    if not leases:
+        return (await task.process_concurrently(await queryset.to_list(), fetch)).processed
+
+    async with LeaseClaimer(queryset) as claimer:
+
+        async def fetch_claimed(merchant: MerchantDoc) -> int:
+            await fetch(merchant)
+            await claimer.release(merchant)
+            return 0
+
+        return (await task.process_concurrently(claimer, fetch_claimed)).processed
+
+
+async def work(leases: bool) -> tuple[float, float]:
+    """Run batches until no merchant is left, and return the start and end times of the worker."""
+    AppSettings.MONGO.db = "trellis_benchmark"
+    await initialize_beanie()
+    task = FetchReviewsCron(kwargs={"strategy": FetchStrategy.NEW})
+    start = time.time()
+    while True:  # pylint: disable=while-used
+        if not await run_batch(task, leases):
+            break
+    return start, time.time()
+
+
+def run_worker(leases: bool) -> tuple[float, float]:
+    """Run a worker in its own process."""
+    return asyncio.run(work(leases))
+
+
+def get_database() -> pymongo.database.Database[typing.Any]:
+    """Return the benchmark database, through a synchronous client used by the main process."""
+    return pymongo.MongoClient(AppSettings.MONGO.get_dns())["trellis_benchmark"]
+
+
+def reset(count: int) -> None:
+    """Create `count` new merchants, and clear the recorded fetches."""
+    database = get_database()
+    database["benchmark_fetch"].delete_many({})
+    database[MerchantDoc.Settings.name].delete_many({})
+    database[MerchantDoc.Settings.name].insert_many(
+        [
+            {
+                "website": "benchmark.com",
+                "beans_card_id": f"card_{i}",
+                "beans_card_address": f"card_{i}",
+                "is_active": True,
+            }
+            for i in range(count)
+        ]
+    )
+
+
+def count_fetches() -> tuple[int, int]:
+    """Return the number of fetches, and of distinct merchants fetched."""
+    collection = get_database()["benchmark_fetch"]
+    return collection.count_documents({}), len(collection.distinct("merchant"))
+
+
+def main(count: int, workers: list[int]) -> None:
+    """Run both scenarios for each number of workers and print the throughput and duplicate fetches."""
+    context = multiprocessing.get_context("spawn")  # Motor clients can not be shared with forked processes
+    for processes in workers:
+        for name, leases in [("before", False), ("after", True)]:
+            reset(count)
+            with context.Pool(processes) as pool:
+                times = pool.map(run_worker, [leases] * processes)
+            elapsed = max(x for _, x in times) - min(x for x, _ in times)
+            fetches, fetched = count_fetches()
+            print(
+                f"{count:>6} merchants | {processes:>2} workers | {name:<6}"
+                f" | {fetched / elapsed:>7.0f} merchants/s | {fetches - fetched:>6} duplicates | {count - fetched} missed"
+            )
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000, [int(x) for x in sys.argv[2:]] or [1, 2, 4, 8])
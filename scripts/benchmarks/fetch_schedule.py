@@ -0,0 +1,88 @@
+"""
+Benchmark: Fetch schedule.
+
+Simulate the hourly runs of `FetchReviewsCron` over synthetic merchants, and compare the Graph API
+calls per hour before (merchants re-fetched `LATENCY_OLD` days after their last fetch) and after
+(next fetch scheduled with `get_fetch_interval()` and `get_next_fetch_at()`).
+Half of the merchants are onboarded on the first day, the others over the first month.
+Merchants post reviews at different rates: 20% are active, 30% occasional and 50% dormant.
+Each fetch counts as one call, the statistics are computed over the last month.
+"Delay" is the average time between the creation of a review and its fetch.
+
+Run from the project root, no database needed:
+```shell
+python -m scripts.benchmarks.fetch_schedule 100000
+```
+"""
+
+import heapq
+import math
+import random
+import statistics
+import sys
+from datetime import UTC, datetime, timedelta
+
+from trellis.instagram.crons import LATENCY_OLD, get_fetch_interval, get_next_fetch_at
+
+DAYS = 60
+START = datetime(2024, 1, 1, tzinfo=UTC)
+REVIEW_RATES = [(0.2, 1), (0.3, 0.1), (0.5, 0.005)]  # share of the merchants, and reviews per day
+
+
+def get_merchants(count: int) -> list[tuple[float, float]]:
+    """Return the onboarding time in hours and the review rate per day of synthetic merchants."""
+    rng = random.Random(0)
+    rates = rng.choices([x for _, x in REVIEW_RATES], weights=[x for x, _ in REVIEW_RATES], k=count)
+    return [(0 if i % 2 else rng.uniform(0, 30 * 24), rate) for i, rate in enumerate(rates)]
+
+
+def schedule(hour: int, interval: float | None, found: bool) -> tuple[float, float]:
+    """Return the hour of the next fetch of a merchant and its interval, as scheduled by the cron."""
+    interval = get_fetch_interval(interval, reviews_count=int(found))
+    next_fetch_at = get_next_fetch_at(START + timedelta(hours=hour), interval)
+    return (next_fetch_at - START) / timedelta(hours=1), interval
+
+
+def simulate(merchants: list[tuple[float, float]], scheduled: bool) -> tuple[list[int], float]:
+    """Return the number of calls of each hourly run, and the average delay of the reviews in hours."""
+    rng = random.Random(1)
+    calls = [0] * (DAYS * 24)
+    delay, reviews = 0.0, 0.0  # hours between the creation and the fetch, weighted by the number of reviews
+    # Next run fetching each merchant: hour, merchant index, hour of the last fetch, fetch interval
+    queue: list[tuple[int, int, float, float | None]] = [
+        (math.ceil(onboarded), i, onboarded, None) for i, (onboarded, _) in enumerate(merchants)
+    ]
+    heapq.heapify(queue)
+    for _ in range(len(queue) * DAYS):
+        hour, index, last, interval = heapq.heappop(queue)
+        if hour >= len(calls):
+            break
+        calls[hour] += 1
+        # Reviews posted since the last fetch, on average at the middle of the period
+        expected = merchants[index][1] * (hour - last) / 24
+        delay, reviews = delay + expected * (hour - last) / 2, reviews + expected
+        if scheduled:
+            next_hour, interval = schedule(hour, interval, found=rng.random() < 1 - math.exp(-expected))
+        else:
+            next_hour = hour + LATENCY_OLD * 24
+        heapq.heappush(queue, (math.ceil(next_hour), index, hour, interval))
+    return calls[-30 * 24 :], delay / reviews
+
+
+def main(count: int) -> None:
+    """Run both scenarios and print the statistics of the calls per hour."""
+    merchants = get_merchants(count)
+    for name, scheduled in [("before", False), ("after", True)]:
+        calls, delay = simulate(merchants, scheduled)
+        print(
+            f"{count:>7} merchants | {name:<6}"
+            f" | calls/h mean {statistics.mean(calls):>6.0f}"
+            f" | p99 {statistics.quantiles(calls, n=100)[-1]:>6.0f}"
+            f" | max {max(calls):>6}"
+            f" | stdev {statistics.stdev(calls):>6.0f}"
+            f" | delay {delay:>5.1f} h"
+        )
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
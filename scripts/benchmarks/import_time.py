@@ -0,0 +1,67 @@
+"""
+Benchmark: Import time.
+
+Compare the time spent importing `AppMain.asgi`, as measured by `python -X importtime`,
+before (routes of each trellis imported eagerly) and after (`APP_SETTINGS_LAZY_MOUNTS`).
+Besides the total, "trellis" is the time spent in the modules imported directly by the app
+from the `trellis` package, including the third-party modules they import first.
+This is the part growing with each integration, the rest is mostly FastAPI and Beanie.
+Its share of the total is the import-time budget enforced by `tests/instagram/test_routing.py`,
+the script also exits with an error when the share measured with lazy mounts exceeds `IMPORT_TIME_BUDGET`.
+Each scenario runs in new processes, the median of the runs is printed.
+
+Run from the project root:
+```shell
+python -m scripts.benchmarks.import_time 10
+```
+"""
+
+import os
+import statistics
+import subprocess
+import sys
+
+# Share of the import time of `AppMain.asgi` spent in the modules it imports from the `trellis` package:
+# 41% before, 25% with lazy mounts
+IMPORT_TIME_BUDGET = 0.33
+
+
+def measure_import_time(lazy: bool) -> dict[str, float]:
+    """Return the cumulative import time of the modules imported directly by `AppMain.asgi`, in milliseconds."""
+    env = {**os.environ, "APP_SETTINGS_LAZY_MOUNTS": "true" if lazy else "false"}
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import AppMain.asgi"], env=env, capture_output=True, check=True
+    )
+    times: dict[str, float] = {}
+    for line in process.stderr.decode().splitlines():
+        # import time: self [us] | cumulative | imported package, indented by depth
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.removeprefix("import time:").split("|")
+        if name.startswith(" AppMain.asgi") or (name.startswith("   ") and not name.startswith("    ")):
+            times[name.strip()] = int(cumulative) / 1000
+    return times
+
+
+def get_trellis_time(times: dict[str, float]) -> float:
+    """Return the time spent in the modules imported from the `trellis` package."""
+    return sum(x for name, x in times.items() if name.startswith("trellis."))
+
+
+def main(runs: int) -> None:
+    """Run both scenarios, print the median import times, and exit with an error when over budget."""
+    share = 0.0
+    for name, lazy in [("before", False), ("after:lazy", True)]:
+        results = [measure_import_time(lazy) for _ in range(runs)]
+        total = statistics.median(x["AppMain.asgi"] for x in results)
+        trellis = statistics.median(get_trellis_time(x) for x in results)
+        share = statistics.median(get_trellis_time(x) / x["AppMain.asgi"] for x in results)
+        print(f"{runs:>3} runs | {name:<10} | AppMain.asgi {total:>6.0f} ms | trellis {trellis:>5.0f} ms {share:>4.0%}")
+    if share > IMPORT_TIME_BUDGET:
+        sys.exit(
+            f"{share:.0%} of the import time is spent in trellis modules, over the {IMPORT_TIME_BUDGET:.0%} budget"
+        )
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10)
@@ -0,0 +1,99 @@
+"""
+Benchmark: Logging latency.
+
+Compare the latency of requests logging an exception, as `validation_exception_handler` does,
+before (`logging.FileHandler` writing from the event loop) and after (`QueuedFileHandler`).
+Requests are sent concurrently, the latency of each request includes the time spent waiting
+for the event loop while other requests write to the disk.
+A slow disk can be simulated by adding a latency, in milliseconds, to each write.
+
+Run from the project root:
+```shell
+python -m scripts.benchmarks.logging_latency 10000
+python -m scripts.benchmarks.logging_latency 10000 1
+```
+"""
+
+import asyncio
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+import typing
+
+import httpx
+from fastapi import FastAPI
+
+from trellis.xlib.logs import QueuedFileHandler
+
+CONCURRENCY = 50  # number of requests sent at the same time
+
+app = FastAPI()
+logger = logging.getLogger("trellis.benchmark")
+logger.propagate = False
+
+
+@app.get("/")
+async def log_exception() -> dict[str, str]:
+    """Log an exception with its traceback."""
+    try:
+        raise ValueError("Invalid request")
+    except ValueError:
+        logger.exception("Unable to handle request")
+    return {"message": "OK"}
+
+
+async def send_requests(count: int) -> list[float]:
+    """Send `count` requests and return the latency of each of them."""
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+    latencies: list[float] = []
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://benchmark") as client:
+
+        async def send() -> None:
+            async with semaphore:
+                start = time.perf_counter()
+                response = await client.get("/")
+                latencies.append(time.perf_counter() - start)
+                response.raise_for_status()
+
+        await asyncio.gather(*[send() for _ in range(count)])
+    return latencies
+
+
+def slow_down(handler: logging.StreamHandler[typing.Any], latency: float) -> None:
+    """Add a latency to each write of a handler, as a slow disk would."""
+    flush = handler.flush
+
+    def slow_flush() -> None:
+        time.sleep(latency)
+        flush()
+
+    handler.flush = slow_flush  # type: ignore[method-assign]
+
+
+def main(count: int, latency: float) -> None:
+    """Run both scenarios and print the latency percentiles."""
+    with tempfile.TemporaryDirectory() as log_dir:
+        before = logging.FileHandler(os.path.join(log_dir, "before.log"))
+        after = QueuedFileHandler(os.path.join(log_dir, "after.log"), maxsize=count)
+        slow_down(before, latency)
+        slow_down(after.target, latency)
+        scenarios: dict[str, logging.Handler] = {"before": before, "after:queue": after}
+        for name, handler in scenarios.items():
+            handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
+            logger.handlers = [handler]
+            latencies = sorted(asyncio.run(send_requests(count)))
+            handler.close()
+            print(
+                f"{count:>6} requests | {name:<11} | disk {latency * 1000:>4.1f} ms/write"
+                f" | p50 {statistics.median(latencies) * 1000:>6.2f} ms"
+                f" | p99 {latencies[int(0.99 * (len(latencies) - 1))] * 1000:>6.2f} ms"
+                f" | max {latencies[-1] * 1000:>6.2f} ms"
+            )
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10_000, float(sys.argv[2]) / 1000 if len(sys.argv) > 2 else 0)
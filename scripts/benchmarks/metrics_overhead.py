@@ -0,0 +1,68 @@
+"""
+Benchmark: Metrics overhead.
+
+Measure the cost of recording a value in a latency histogram, and compare the requests per second
+of an endpoint before (no metrics) and after (`MetricsMiddleware` recording each request).
+
+Run from the project root:
+```shell
+python -m scripts.benchmarks.metrics_overhead 10000
+```
+"""
+
+import asyncio
+import sys
+import time
+
+import httpx
+from fastapi import FastAPI
+from starlette.types import ASGIApp
+
+from trellis.xlib.metrics import Histogram, MetricsMiddleware
+
+
+def create_app(with_metrics: bool) -> FastAPI:
+    """Return an app with a single route, measured or not."""
+    app = FastAPI()
+
+    @app.get("/health/")
+    async def health() -> dict[str, str]:
+        return {"message": "OK"}
+
+    if with_metrics:
+        app.add_middleware(MetricsMiddleware)
+    return app
+
+
+def measure_observe(count: int) -> None:
+    """Print the cost of a single `observe()` call."""
+    histogram = Histogram("benchmark_seconds", "Benchmark.", ("route",))
+    start = time.perf_counter()
+    for i in range(count):
+        histogram.observe(i / count, "/health/")
+    elapsed = time.perf_counter() - start
+    print(f"{count:>6} observations | {elapsed / count * 1e9:>7.0f} ns/observation")
+
+
+async def run_scenario(name: str, app: ASGIApp, count: int) -> None:
+    """Send `count` requests and print the rate."""
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://benchmark") as client:
+        start = time.perf_counter()
+        for _ in range(count):
+            response = await client.get("/health/")
+            response.raise_for_status()
+        elapsed = time.perf_counter() - start
+    print(
+        f"{count:>6} requests | {name:<6} | {count / elapsed:>7.0f} requests/s | {elapsed / count * 1e6:>6.0f} µs/request"
+    )
+
+
+async def main(count: int) -> None:
+    """Run all scenarios."""
+    measure_observe(count * 10)
+    await run_scenario("before", create_app(with_metrics=False), count)
+    await run_scenario("after", create_app(with_metrics=True), count)
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 10_000))
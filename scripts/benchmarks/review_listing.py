@@ -0,0 +1,96 @@
+"""
+Benchmark: Review listing.
+
+Compare latency and peak memory of the review listing endpoint
+before (whole collection loaded) and after (keyset page and NDJSON stream).
+
+Run from the project root against a local MongoDB:
+```shell
+python -m scripts.benchmarks.review_listing 10000 100000 1000000
+```
+"""
+
+import asyncio
+import sys
+import time
+import tracemalloc
+import typing
+
+from beanie import PydanticObjectId
+from bson import DBRef
+
+from AppMain.asgi import initialize_beanie
+from AppMain.settings import AppSettings
+from trellis.instagram.models import ReviewDoc
+from trellis.instagram.serializers import RetrieveReview
+from trellis.instagram.webapi import REVIEW_PAGE_LIMIT, get_review_filters, iter_reviews_ndjson
+
+SEED_CHUNK_SIZE = 10_000
+
+
+async def seed_reviews(count: int) -> PydanticObjectId:
+    """Replace the review collection with `count` reviews and return the merchant id used."""
+    collection = ReviewDoc.get_motor_collection()
+    await collection.delete_many({})
+    merchant_id = PydanticObjectId()
+    for start in range(0, count, SEED_CHUNK_SIZE):
+        await collection.insert_many(
+            [
+                {
+                    "merchant": DBRef("instagram_merchant", merchant_id),
+                    "reviewer_email": f"reviewer-{i}@review.com",
+                    "reviewer_name": f"Reviewer {i}",
+                    "resource_id": i,
+                    "doc_meta": {"version": 0},
+                }
+                for i in range(start, min(start + SEED_CHUNK_SIZE, count))
+            ]
+        )
+    return merchant_id
+
+
+async def list_before(filters: list[typing.Any]) -> int:
+    """Load the whole collection, as the endpoint did before pagination."""
+    del filters  # the endpoint did not support any filter
+    return len(RetrieveReview.from_list(await ReviewDoc.find_all().to_list()))
+
+
+async def list_page(filters: list[typing.Any]) -> int:
+    """Load a single keyset page."""
+    return len(RetrieveReview.from_list(await ReviewDoc.find(*filters, sort="_id", limit=REVIEW_PAGE_LIMIT).to_list()))
+
+
+async def list_stream(filters: list[typing.Any]) -> int:
+    """Consume the whole NDJSON stream."""
+    lines = 0
+    async for _ in iter_reviews_ndjson(filters):
+        lines += 1
+    return lines
+
+
+SCENARIOS = {"before": list_before, "after:page": list_page, "after:stream": list_stream}
+
+
+async def main(sizes: list[int]) -> None:
+    """Run all scenarios for each collection size and print their latency and peak memory."""
+    AppSettings.MONGO.db = "trellis_benchmark"
+    await initialize_beanie()
+
+    for count in sizes:
+        filters = get_review_filters(merchant=await seed_reviews(count))
+        for name, scenario in SCENARIOS.items():
+            tracemalloc.start()
+            start = time.perf_counter()
+            items = await scenario(filters)
+            elapsed = time.perf_counter() - start
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print(
+                f"{count:>9} reviews | {name:<12} | {items:>9} items | {elapsed * 1000:>10.1f} ms | {peak / 2**20:>8.1f} MiB"
+            )
+
+    await ReviewDoc.get_motor_collection().delete_many({})
+
+
+if __name__ == "__main__":
+    asyncio.run(main([int(x) for x in sys.argv[1:]] or [10_000, 100_000, 1_000_000]))
@@ -0,0 +1,62 @@
+"""
+Benchmark: Review read path.
+
+Compare the CPU time and memory needed to serialize reviews
+before (whole `ReviewDoc` documents validated by Beanie) and after (projected raw documents).
+
+Run from the project root against a local MongoDB:
+```shell
+python -m scripts.benchmarks.review_read 100000
+```
+"""
+
+import asyncio
+import sys
+import time
+import tracemalloc
+
+from AppMain.asgi import initialize_beanie
+from AppMain.settings import AppSettings
+from trellis.instagram.models import ReviewDoc
+from trellis.instagram.serializers import RetrieveReview
+
+from .review_listing import seed_reviews
+
+
+async def read_documents() -> list[RetrieveReview]:
+    """Load whole documents, as the listings did before projections."""
+    return RetrieveReview.from_list(await ReviewDoc.find_all(sort="_id").to_list())
+
+
+async def read_projection() -> list[RetrieveReview]:
+    """Load projected raw documents."""
+    return await RetrieveReview.find()
+
+
+SCENARIOS = {"before": read_documents, "after:projection": read_projection}
+
+
+async def main(sizes: list[int]) -> None:
+    """Run all scenarios for each collection size and print CPU time and memory per document."""
+    AppSettings.MONGO.db = "trellis_benchmark"
+    await initialize_beanie()
+
+    for count in sizes:
+        await seed_reviews(count)
+        for name, scenario in SCENARIOS.items():
+            tracemalloc.start()
+            start = time.process_time()
+            reviews = await scenario()
+            cpu = time.process_time() - start
+            retained, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print(
+                f"{count:>7} reviews | {name:<16} | {cpu * 1e6 / len(reviews):>7.1f} µs CPU/review"
+                f" | {retained / len(reviews):>6.0f} B retained/review | {peak / 2**20:>7.1f} MiB peak"
+            )
+
+    await ReviewDoc.get_motor_collection().delete_many({})
+
+
+if __name__ == "__main__":
+    asyncio.run(main([int(x) for x in sys.argv[1:]] or [100_000]))
@@ -0,0 +1,82 @@
+"""
+Benchmark: Review upsert.
+
+Compare the time needed to import fetched reviews
+before (one upsert round trip per review) and after (unordered bulk writes).
+Each scenario imports the reviews twice: first as new reviews, then as updates.
+
+Run from the project root against a local MongoDB:
+```shell
+python -m scripts.benchmarks.review_upsert 1000 10000 100000
+```
+"""
+
+import asyncio
+import sys
+import time
+
+from beanie import PydanticObjectId
+from beanie.odm.operators.update.general import Set
+
+from AppMain.asgi import initialize_beanie
+from AppMain.settings import AppSettings
+from trellis.instagram.crons import REVIEWS_BATCH_SIZE
+from trellis.instagram.models import MerchantDoc, ReviewDoc
+from trellis.xlib.bulk import BulkUpsertWriter
+
+
+def get_reviews(merchant: MerchantDoc, count: int, name: str) -> list[ReviewDoc]:
+    """Build `count` reviews, as they are built from the Graph API pages."""
+    return [
+        ReviewDoc(merchant=merchant, reviewer_email=f"reviewer-{i}@review.com", reviewer_name=name, resource_id=i)
+        for i in range(count)
+    ]
+
+
+async def upsert_before(reviews: list[ReviewDoc]) -> None:
+    """Upsert each review with its own request, as the cron did before bulk writes."""
+    for review in reviews:
+        await ReviewDoc.find_one(ReviewDoc.resource_id == review.resource_id).upsert(
+            Set({ReviewDoc.reviewer_email: review.reviewer_email, ReviewDoc.reviewer_name: review.reviewer_name}),
+            on_insert=review,
+        )
+
+
+async def upsert_bulk(reviews: list[ReviewDoc]) -> None:
+    """Upsert the reviews by batches."""
+    async with BulkUpsertWriter(
+        ReviewDoc, key="resource_id", fields=["reviewer_email", "reviewer_name"], batch_size=REVIEWS_BATCH_SIZE
+    ) as writer:
+        for review in reviews:
+            await writer.add(review)
+
+
+SCENARIOS = {"before": upsert_before, "after:bulk": upsert_bulk}
+
+
+async def main(sizes: list[int]) -> None:
+    """Run all scenarios for each number of reviews and print their duration."""
+    AppSettings.MONGO.db = "trellis_benchmark"
+    await initialize_beanie()
+    merchant = MerchantDoc(
+        id=PydanticObjectId(), website="benchmark.com", beans_card_id="benchmark", beans_card_address="benchmark"
+    )
+
+    for count in sizes:
+        for name, scenario in SCENARIOS.items():
+            await ReviewDoc.get_motor_collection().delete_many({})
+            for step in ("insert", "update"):
+                reviews = get_reviews(merchant, count, name=step)
+                start = time.perf_counter()
+                await scenario(reviews)
+                elapsed = time.perf_counter() - start
+                print(
+                    f"{count:>7} reviews | {name:<10} | {step:<6} | {elapsed * 1000:>10.1f} ms"
+                    f" | {count / elapsed:>9.0f} reviews/s"
+                )
+
+    await ReviewDoc.get_motor_collection().delete_many({})
+
+
+if __name__ == "__main__":
+    asyncio.run(main([int(x) for x in sys.argv[1:]] or [1_000, 10_000, 100_000]))
@@ -0,0 +1,60 @@
+"""
+Benchmark: Static assets.
+
+Compare the bytes transferred and the requests per second of the static mount
+before (`StaticFiles` serving the `static` folder) and after (fingerprinted and precompressed assets).
+Requests are sent as a browser does, accepting brotli and gzip. A browser also revalidates the
+files on each page view, unless they are immutable: "requests/100 views" counts these requests.
+
+Run from the project root:
+```shell
+python -m scripts.benchmarks.static_assets 5000
+```
+"""
+
+import asyncio
+import pathlib
+import sys
+import tempfile
+import time
+
+import httpx
+from starlette.staticfiles import StaticFiles
+from starlette.types import ASGIApp
+
+from AppMain.settings import AppSettings
+from trellis.xlib.assets import PrecompressedStaticFiles, StaticAssets
+
+HEADERS = {"Accept-Encoding": "br, gzip, deflate"}
+
+
+async def run_scenario(name: str, app: ASGIApp, paths: list[str], count: int) -> None:
+    """Request each path `count` times and print the transfer size and the rate."""
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://benchmark") as client:
+        transferred = 0
+        start = time.perf_counter()
+        for i in range(count):
+            # Raw bytes are read, so that decompressing them on the client side is not measured
+            async with client.stream("GET", f"/{paths[i % len(paths)]}", headers=HEADERS) as response:
+                async for chunk in response.aiter_raw():
+                    transferred += len(chunk)
+        elapsed = time.perf_counter() - start
+        revalidations = 1 if "immutable" in response.headers.get("Cache-Control", "") else 100
+        print(
+            f"{count:>6} requests | {name:<6} | {transferred / count:>7.0f} B/request"
+            f" | {count / elapsed:>7.0f} requests/s | {revalidations:>3} requests/100 views"
+        )
+
+
+async def main(count: int) -> None:
+    """Build the assets in a temporary folder and run both scenarios."""
+    source = AppSettings.APP_DIR / "static"
+    with tempfile.TemporaryDirectory() as target:
+        assets = StaticAssets(source=source, target=pathlib.Path(target))
+        assets.build()
+        await run_scenario("before", StaticFiles(directory=source), list(assets.manifest), count)
+        await run_scenario("after", PrecompressedStaticFiles(assets=assets), list(assets.manifest.values()), count)
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 5_000))
@@ -0,0 +1,72 @@
+"""
+Benchmark: Template compilation.
+
+Compare the time spent loading the templates of the pages on the first request of a new worker
+before (compiled on first use), after (loaded from the bytecode cache on first use),
+and after with the precompilation done on startup.
+Each scenario runs in a new process, as a restarted worker does.
+
+Run from the project root:
+```shell
+python -m scripts.benchmarks.template_compile 20
+```
+"""
+
+import json
+import statistics
+import subprocess
+import sys
+import time
+
+from AppMain.asgi import precompile_templates
+from AppMain.settings import templates
+
+PAGES = ["index.jinja", "instagram/home.jinja", "instagram/connect.jinja", "instagram/rules.jinja"]
+
+SCENARIOS = ["before", "after:bytecode", "after:precompiled"]
+
+
+def run_worker(scenario: str) -> None:
+    """Load the templates as a new worker does and print the startup and first request durations."""
+    if scenario == "before":
+        templates.env.bytecode_cache = None
+
+    start = time.perf_counter()
+    if scenario == "after:precompiled":
+        precompile_templates()
+    startup = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for name in PAGES:
+        templates.env.get_template(name)
+    print(json.dumps({"startup": startup, "first_request": time.perf_counter() - start}))
+
+
+def main(workers: int) -> None:
+    """Start new workers for each scenario and print the median durations."""
+    precompile_templates()  # fill the bytecode cache
+
+    for scenario in SCENARIOS:
+        results = [
+            json.loads(
+                subprocess.run(
+                    [sys.executable, "-m", __spec__.name, "--worker", scenario],
+                    capture_output=True,
+                    check=True,
+                    text=True,
+                ).stdout
+            )
+            for _ in range(workers)
+        ]
+        print(
+            f"{workers:>4} workers | {scenario:<17}"
+            f" | startup {statistics.median(x['startup'] for x in results) * 1000:>7.2f} ms"
+            f" | first request {statistics.median(x['first_request'] for x in results) * 1000:>7.2f} ms"
+        )
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["--worker"]:
+        run_worker(sys.argv[2])
+    else:
+        main(int(sys.argv[1]) if len(sys.argv) > 1 else 20)
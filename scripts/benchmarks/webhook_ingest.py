@@ -0,0 +1,78 @@
+"""
+Benchmark: Webhook ingestion.
+
+Compare the sustained rate of `review_created` webhooks
+before (one insert per webhook, before acknowledging) and after (ingest queue).
+The "after" duration includes the time needed to drain the queue.
+
+Run from the project root against a local MongoDB:
+```shell
+python -m scripts.benchmarks.webhook_ingest 10000
+```
+"""
+
+import asyncio
+import sys
+import time
+import typing
+from contextlib import nullcontext
+
+import httpx
+
+from AppMain.asgi import app, initialize_beanie
+from AppMain.settings import AppSettings
+from trellis.instagram.models import ReviewDoc
+from trellis.xlib.ingest import IngestQueue
+
+CONCURRENCY = 50  # number of webhooks sent at the same time
+
+
+async def send_webhooks(count: int) -> float:
+    """Send `count` webhooks and return the duration in seconds until the last one is acknowledged."""
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+    transport = httpx.ASGITransport(app=app)
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+
+        async def send(i: int) -> None:
+            async with semaphore:
+                response = await client.post(
+                    "/instagram/hooks/review_created/",
+                    json={"reviewer_email": f"reviewer-{i}@review.com", "reviewer_name": f"Reviewer {i}"},
+                )
+                response.raise_for_status()
+
+        start = time.perf_counter()
+        await asyncio.gather(*[send(i) for i in range(count)])
+        return time.perf_counter() - start
+
+
+SCENARIOS: dict[str, typing.Callable[[], typing.AsyncContextManager[None]]] = {
+    "before": nullcontext,
+    "after:queue": IngestQueue.lifespan,
+}
+
+
+async def main(sizes: list[int]) -> None:
+    """Run all scenarios for each number of webhooks and print the sustained rate."""
+    AppSettings.MONGO.db = "trellis_benchmark"
+    await initialize_beanie()
+
+    for count in sizes:
+        for name, scenario in SCENARIOS.items():
+            await ReviewDoc.get_motor_collection().delete_many({})
+            start = time.perf_counter()
+            async with scenario():
+                acknowledged = await send_webhooks(count)
+            elapsed = time.perf_counter() - start
+            inserted = await ReviewDoc.count()
+            print(
+                f"{count:>7} webhooks | {name:<11} | ack {acknowledged * 1000 / count:>6.2f} ms/webhook"
+                f" | {count / elapsed:>8.0f} webhooks/s sustained | {inserted:>7} inserted"
+            )
+
+    await ReviewDoc.get_motor_collection().delete_many({})
+
+
+if __name__ == "__main__":
+    asyncio.run(main([int(x) for x in sys.argv[1:]] or [1_000, 10_000]))
@@ -10,6 +10,7 @@ import typing
 from sap.rest import BeansClient, rest_exceptions
 
 from AppMain.settings import AppSettings, TestcasesParams
+from trellis.xlib.metrics import mongodb_command_duration
 
 test_params_default = AppSettings.TESTCASES
 test_params_lydia = TestcasesParams(
@@ -34,6 +35,11 @@ async def setup_beans_rule(rule_uid: str, is_installed: bool) -> dict[str, typin
     return None
 
 
+def count_mongo_commands() -> int:
+    """Return the number of MongoDB commands sent by this process."""
+    return int(sum(sum(values[:-1]) for values in mongodb_command_duration.values.values()))
+
+
 class SampleOAuthTokens(typing.TypedDict, total=True):
     """Define a standard for oauth sample tokens."""
 
@@ -8,10 +8,54 @@ Learn more: https://docs.pytest.org/en/6.2.x/fixture.html
 import typing
 from datetime import UTC, datetime, timedelta
 
+import httpx
 import pytest
 import pytest_asyncio
 
 from trellis.instagram.models import MerchantDoc
+from trellis.xlib.rest import HttpPool
+
+
+class FakeGraphAPI:
+    """Fake Graph API serving the reviews of an account, newest first, with cursor pagination."""
+
+    def __init__(self) -> None:
+        """Initialize an account without reviews."""
+        self.reviews: list[dict[str, str]] = []
+        self.requests: list[httpx.Request] = []
+        self.fail_after: int | None = None  # number of requests after which the API returns server errors
+
+    def add_reviews(self, count: int) -> None:
+        """Publish new reviews on the account."""
+        start = len(self.reviews)
+        created = datetime(2024, 1, 1, tzinfo=UTC) + timedelta(minutes=start)
+        self.reviews[:0] = [
+            {
+                "id": str(10**15 + i),
+                "created_time": (created + timedelta(minutes=i - start)).strftime("%Y-%m-%dT%H:%M:%S%z"),
+                "reviewer_email": f"graph-{i}@review.com",
+                "reviewer_name": f"Graph Reviewer {i}",
+            }
+            for i in reversed(range(start, start + count))
+        ]
+
+    def handle(self, request: httpx.Request) -> httpx.Response:
+        """Serve a page of reviews."""
+        self.requests.append(request)
+        if self.fail_after is not None and len(self.requests) > self.fail_after:
+            return httpx.Response(500, json={"error": {"message": "An unknown error has occurred."}})
+
+        since = int(request.url.params.get("since", 0))
+        limit = int(request.url.params.get("limit", 25))
+        start = int(request.url.params.get("after", 0))
+        reviews = [
+            x for x in self.reviews if datetime.strptime(x["created_time"], "%Y-%m-%dT%H:%M:%S%z").timestamp() >= since
+        ]
+        page = reviews[start : start + limit]
+        paging: dict[str, typing.Any] = {"cursors": {"before": str(start), "after": str(start + len(page))}}
+        if start + limit < len(reviews):
+            paging["next"] = str(request.url.copy_merge_params({"after": start + limit}))
+        return httpx.Response(200, json={"data": page, "paging": paging})
 
 
 @pytest.fixture(scope="package", name="trellis_name")
@@ -38,3 +82,14 @@ async def load_merchant(merchant: MerchantDoc) -> typing.AsyncGenerator[bool, No
         }
     )
     yield True
+
+
+@pytest.fixture(name="graph_api")
+def fixture_graph_api() -> typing.Generator[FakeGraphAPI, None, None]:
+    """Fixture: route all requests of the shared HTTP pool to a fake Graph API."""
+    graph_api = FakeGraphAPI()
+    HttpPool.transport = httpx.MockTransport(graph_api.handle)
+    HttpPool.client = None
+    yield graph_api
+    HttpPool.transport = None
+    HttpPool.client = None
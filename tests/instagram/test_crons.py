@@ -4,27 +4,53 @@ Test Crons.
 Test cron jobs.
 """
 
-from datetime import datetime, timedelta
+import asyncio
+import time
+import typing
+from datetime import UTC, datetime, timedelta
+from unittest import mock
 
 import pytest
+from beanie.odm.operators.find.comparison import In
+from beanie.odm.queries.find import FindMany
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
 
+from sap.rest.rest_exceptions import Rest503Error
 from sap.tests.crons import get_filter_queryset_for_merchant
 from sap.worker.crons import FetchStrategy
 
-from trellis.instagram.crons import FetchReviewsCron
-from trellis.instagram.models import MerchantDoc
+from tests._helpers.utils import count_mongo_commands
+from trellis.instagram.crons import (
+    FETCH_INTERVAL_MAX,
+    FETCH_INTERVAL_MIN,
+    FETCH_JITTER,
+    LATENCY_OLD,
+    FetchReviewsCron,
+    fetch_reviews_for_merchant,
+    get_due_query,
+    get_fetch_interval,
+    get_next_fetch_at,
+)
+from trellis.instagram.models import MerchantDoc, ReviewDoc
+from trellis.instagram.models.merchant import ReviewSyncState
+from trellis.xlib.bulk import BulkUpsertResult, BulkUpsertWriter
+from trellis.xlib.crons import LATENCY_SAMPLES
+from trellis.xlib.leases import LeaseClaimer
+
+from .conftest import FakeGraphAPI
 
 
 @pytest.mark.asyncio
-async def test_cron_fetch_reviews(merchant: MerchantDoc, cron_strategy: FetchStrategy) -> None:
+async def test_cron_fetch_reviews(merchant: MerchantDoc, cron_strategy: FetchStrategy, graph_api: FakeGraphAPI) -> None:
     """Test dummy cron to ensure that CronTask base class is functioning."""
     assert merchant.id
 
     # Reset data before test
     if cron_strategy == FetchStrategy.NEW:
-        await merchant.set({"last_review_fetched": None})
+        await merchant.set({"last_review_fetched": None, "next_fetch_at": None, "fetch_interval": None})
     elif cron_strategy == FetchStrategy.OLD:
-        await merchant.set({"last_review_fetched": datetime.now() - timedelta(10)})
+        await merchant.set({"last_review_fetched": datetime.now() - timedelta(10), "next_fetch_at": datetime.now(UTC)})
 
     # Run cron task
     task = FetchReviewsCron(kwargs={"strategy": cron_strategy, "batch_size": 20})
@@ -35,5 +61,323 @@ async def test_cron_fetch_reviews(merchant: MerchantDoc, cron_strategy: FetchStr
 
     # Check result
     await merchant.refresh_from_db()
+    assert merchant.last_review_fetched is not None
+    assert merchant.next_fetch_at is not None and merchant.next_fetch_at > datetime.now(UTC).replace(tzinfo=None)
+    assert len(graph_api.requests) <= 1
     assert result["reviews_processed"] >= 0
     assert result["merchants_processed"] == 1
+    assert result["reviews_inserted"] + result["reviews_updated"] + result["reviews_unchanged"] >= 0
+    assert result["merchants_failed"] == 0
+    assert result["merchants_timed_out"] == 0
+    assert result["latency_max_ms"] >= result["latency_p50_ms"] >= 0
+
+
+@pytest.mark.asyncio
+async def test_cron_stats(merchant: MerchantDoc) -> None:
+    """Ensure that the stats are computed in a single query, and served from the cache until they expire."""
+    await merchant.set({"last_review_fetched": datetime.now(UTC) - timedelta(10), "next_fetch_at": None})
+    task = FetchReviewsCron(kwargs={"strategy": FetchStrategy.NEW})
+    task.stats_cache.clear()
+
+    commands = count_mongo_commands()
+    stats = {x.name: x.value for x in await task.get_stats()}
+    assert count_mongo_commands() == commands + 1
+
+    active = [MerchantDoc.is_active == True]
+    assert stats["merchants_new"] == await MerchantDoc.find(*active, MerchantDoc.last_review_fetched == None).count()
+    assert stats["merchants_old"] == await MerchantDoc.find(*active, get_due_query(datetime.now(UTC))).count()
+    assert stats["staleness_7_30d"] >= 1
+    staleness = sum(v for k, v in stats.items() if k.startswith("staleness_"))
+    assert staleness + stats["merchants_new"] == await MerchantDoc.find(*active).count()
+
+    # Polling the stats does not query the DB until they expire
+    commands = count_mongo_commands()
+    assert await task.get_stats() == await task.get_stats()
+    assert count_mongo_commands() == commands
+
+    with mock.patch.object(FetchReviewsCron, "stats_ttl", 0):
+        task.stats_cache.clear()
+        await task.get_stats()
+        await task.get_stats()
+    assert count_mongo_commands() == commands + 2
+
+
+def test_cron_fetch_schedule() -> None:
+    """Ensure that the fetch interval adapts to the review activity, and that merchants fetched together are spread."""
+    assert get_fetch_interval(None, reviews_count=3) < LATENCY_OLD < get_fetch_interval(None, reviews_count=0)
+
+    # Intervals are bounded however long a merchant is active or dormant
+    active, dormant = float(LATENCY_OLD), float(LATENCY_OLD)
+    for _ in range(20):
+        active, dormant = get_fetch_interval(active, reviews_count=1), get_fetch_interval(dormant, reviews_count=0)
+    assert (active, dormant) == (FETCH_INTERVAL_MIN, FETCH_INTERVAL_MAX)
+
+    now = datetime.now(UTC)
+    dates = [get_next_fetch_at(now, LATENCY_OLD) for _ in range(1000)]
+    assert now + timedelta(days=LATENCY_OLD * (1 - FETCH_JITTER)) <= min(dates)
+    assert max(dates) <= now + timedelta(days=LATENCY_OLD * (1 + FETCH_JITTER))
+    assert len({x.date() for x in dates}) >= 3
+
+
+@pytest.mark.asyncio
+async def test_cron_leases() -> None:
+    """Ensure that workers claiming merchants at the same time never claim the same one."""
+    card_ids = [f"card_lease_{i}" for i in range(10)]
+    await MerchantDoc.find(In(MerchantDoc.beans_card_id, card_ids)).delete()
+    await MerchantDoc.insert_many(
+        [MerchantDoc(website="", beans_card_id=x, beans_card_address=x, is_active=True) for x in card_ids]
+    )
+
+    def get_queryset() -> FindMany[MerchantDoc]:
+        return MerchantDoc.find(In(MerchantDoc.beans_card_id, card_ids), sort="beans_card_id")
+
+    async def claim_all(claimer: LeaseClaimer[MerchantDoc]) -> list[str]:
+        return [x.beans_card_id async for x in claimer]
+
+    # Scenario A: Concurrent workers share the merchants
+    async with LeaseClaimer(get_queryset()) as worker_a, LeaseClaimer(get_queryset()) as worker_b:
+        claimed_a, claimed_b = await asyncio.gather(claim_all(worker_a), claim_all(worker_b))
+        assert sorted(claimed_a + claimed_b) == card_ids
+        assert await claim_all(LeaseClaimer(get_queryset())) == []
+
+        # Scenario B: A released merchant can be claimed again
+        merchant = await MerchantDoc.find_one(MerchantDoc.beans_card_id == claimed_a[0])
+        assert merchant and merchant.lease and merchant.lease.owner == worker_a.owner
+        expires = merchant.lease.expires - datetime.now(UTC).replace(tzinfo=None)  # set from the clock of MongoDB
+        assert abs(expires - timedelta(seconds=worker_a.duration)) < timedelta(minutes=1)
+        await worker_a.release(merchant)
+        assert await claim_all(LeaseClaimer(get_queryset())) == [claimed_a[0]]
+
+    # Leases are released when leaving the context manager, but not the lease claimed without it
+    assert len(await claim_all(LeaseClaimer(get_queryset()))) == len(card_ids) - 1
+
+    # Scenario C: The lease of a worker that stopped expires, while the heartbeat renews the leases of a running one
+    await get_queryset().update({"$set": {"lease": None}})
+    async with LeaseClaimer(get_queryset().limit(1), duration=0.3) as running:
+        assert await claim_all(running) == [card_ids[0]]
+        assert await claim_all(LeaseClaimer(get_queryset().limit(1), duration=0.3)) == [card_ids[1]]
+        await asyncio.sleep(0.5)
+        assert await claim_all(LeaseClaimer(get_queryset().limit(1))) == [card_ids[1]]
+
+    # Scenario D: Each lease written is reported, so that the cached merchants can be invalidated
+    changed: list[typing.Any] = []
+
+    async def on_change(*ids: typing.Any) -> None:
+        changed.extend(ids)
+
+    await get_queryset().update({"$set": {"lease": None}})
+    async with LeaseClaimer(get_queryset().limit(2), on_change=on_change) as claimer:
+        merchants = [x async for x in claimer]
+        await claimer.release(merchants[0])
+    assert changed == [merchants[0].id, merchants[1].id, merchants[0].id, merchants[1].id]
+
+    await get_queryset().delete()
+
+
+@pytest.mark.asyncio
+async def test_cron_process_concurrently() -> None:
+    """Ensure that slow or failing items do not prevent other items from being processed."""
+
+    async def worker(item: float) -> int:
+        if item == 0:
+            raise ValueError("Failing item")
+        await asyncio.sleep(item)
+        return 1
+
+    task = FetchReviewsCron(kwargs={"strategy": FetchStrategy.NEW})
+    start = time.perf_counter()
+    stats = await task.process_concurrently([0, 10, *[0.1] * 20], worker, concurrency=10, item_timeout=0.5)
+
+    # 20 items of 0.1 second processed 10 at a time, while the slow item is cancelled after 0.5 second
+    assert time.perf_counter() - start < 1
+    assert stats.processed == stats.total == 20
+    assert stats.failed == 1
+    assert stats.timed_out == 1
+    assert stats.get_counters("items")["items_per_minute"] > 0
+
+
+@pytest.mark.asyncio
+async def test_cron_process_pulls_with_slot() -> None:
+    """Ensure that an item is only pulled once a slot is free, so that no claimed merchant waits idle."""
+    pulled, finished = 0, 0
+    in_flight: list[int] = []
+
+    async def items() -> typing.AsyncIterator[int]:
+        nonlocal pulled
+        for item in range(50):
+            pulled += 1
+            in_flight.append(pulled - finished)
+            yield item
+
+    async def worker(item: int) -> int:
+        nonlocal finished
+        await asyncio.sleep(0.001)
+        finished += 1
+        return item
+
+    task = FetchReviewsCron(kwargs={"strategy": FetchStrategy.NEW})
+    stats = await task.process_concurrently(items(), worker, concurrency=3)
+    assert stats.processed == 50
+    assert max(in_flight) == 3
+
+
+@pytest.mark.asyncio
+async def test_cron_process_checkpoints() -> None:
+    """Ensure that items are pulled lazily, and that a run resumes from the checkpoints of an interrupted one."""
+    checkpoints: set[int] = set()
+    processed: list[int] = []
+    pulled = 0
+
+    async def pending_items() -> typing.AsyncIterator[int]:
+        nonlocal pulled
+        for item in range(5000):
+            if item not in checkpoints:
+                pulled += 1
+                yield item
+
+    async def worker(item: int) -> int:
+        processed.append(item)
+        assert pulled - len(processed) <= 10  # items running, the next item is pulled once a slot is free
+        await asyncio.sleep(0.001)
+        return 1
+
+    async def checkpoint(item: int) -> None:
+        checkpoints.add(item)
+
+    task = FetchReviewsCron(kwargs={"strategy": FetchStrategy.NEW})
+    with pytest.raises(asyncio.TimeoutError):
+        await asyncio.wait_for(task.process_concurrently(pending_items(), worker, checkpoint=checkpoint), 0.2)
+    assert 0 < len(checkpoints) < 5000
+    pulled = len(processed)
+
+    # Items interrupted before their checkpoint are processed again
+    stats = await task.process_concurrently(pending_items(), worker, checkpoint=checkpoint)
+    assert len(checkpoints) == 5000
+    assert stats.failed == 0
+    assert len(processed) - len(set(processed)) <= 10
+    assert len(stats.latencies) <= LATENCY_SAMPLES
+    assert stats.get_counters("items")["latency_max_ms"] >= stats.get_counters("items")["latency_p95_ms"]
+
+
+@pytest.mark.asyncio
+async def test_fetch_reviews_not_connected(merchant: MerchantDoc, graph_api: FakeGraphAPI) -> None:
+    """Ensure that the fetch interval of merchants not connected to Instagram is not adapted."""
+    token = merchant.instagram_access_token
+    await merchant.set({"instagram_access_token": None, "fetch_interval": 10})
+    now = datetime.now(UTC).replace(tzinfo=None)
+    for _ in range(3):
+        assert await fetch_reviews_for_merchant(merchant) == 0
+
+    await merchant.refresh_from_db()
+    assert not graph_api.requests
+    assert merchant.fetch_interval == 10
+    assert merchant.next_fetch_at is not None
+    assert now + timedelta(days=10 * (1 - FETCH_JITTER)) <= merchant.next_fetch_at
+    assert merchant.next_fetch_at <= now + timedelta(days=10 * (1 + FETCH_JITTER), minutes=1)
+    await merchant.set({"instagram_access_token": token})
+
+
+@pytest.mark.asyncio
+async def test_fetch_reviews_incremental(merchant: MerchantDoc, graph_api: FakeGraphAPI) -> None:
+    """Ensure that each sync only requests the pages of reviews created since the previous sync."""
+    await merchant.set({"instagram_id": "17841400000000000", "review_sync": ReviewSyncState()})
+    await ReviewDoc.find(ReviewDoc.merchant.id == merchant.id).delete()
+
+    # Scenario A: The first sync fetches all pages
+    graph_api.add_reviews(250)
+    assert await fetch_reviews_for_merchant(merchant) == 250
+    assert len(graph_api.requests) == 3
+    assert merchant.review_sync.cursor is None
+
+    # Scenario B: Without new activity, the next sync makes a single request and no redundant page request
+    graph_api.requests.clear()
+    assert await fetch_reviews_for_merchant(merchant) == 0
+    assert len(graph_api.requests) == 1
+    assert "since" in graph_api.requests[0].url.params
+
+    # Scenario C: Only new reviews are fetched
+    graph_api.requests.clear()
+    graph_api.add_reviews(5)
+    assert await fetch_reviews_for_merchant(merchant) == 5
+    assert len(graph_api.requests) == 1
+
+    # Scenario D: An interrupted sync resumes from the cursor of the last page fetched
+    graph_api.requests.clear()
+    graph_api.add_reviews(150)
+    graph_api.fail_after = 1
+    with pytest.raises(Rest503Error):
+        await fetch_reviews_for_merchant(merchant)
+    await merchant.refresh_from_db()
+    assert merchant.review_sync.cursor == "100"
+
+    graph_api.requests.clear()
+    graph_api.fail_after = None
+    assert await fetch_reviews_for_merchant(merchant) == 50
+    assert len(graph_api.requests) == 1
+    assert graph_api.requests[0].url.params["after"] == "100"
+
+    # Scenario E: An invalid review is skipped and counted as failed, without blocking the sync
+    graph_api.requests.clear()
+    graph_api.add_reviews(3)
+    graph_api.reviews[1]["reviewer_email"] = "not-an-email"
+    writes = BulkUpsertResult()
+    assert await fetch_reviews_for_merchant(merchant, writes) == 2
+    assert writes.failed == 1
+    assert merchant.review_sync.cursor is None
+    assert merchant.review_sync.since == datetime.fromisoformat(graph_api.reviews[0]["created_time"])
+
+    # Ensure that each review has been saved once
+    assert await ReviewDoc.find(ReviewDoc.merchant.id == merchant.id).count() == 407
+
+    await merchant.set({"instagram_id": None, "review_sync": ReviewSyncState()})
+
+
+@pytest.mark.asyncio
+async def test_bulk_upsert_writer(merchant: MerchantDoc) -> None:
+    """Ensure that buffered reviews are written by batches and counted as inserted, updated or unchanged."""
+    await ReviewDoc.find(ReviewDoc.merchant.id == merchant.id).delete()
+
+    def get_review(resource_id: int, name: str) -> ReviewDoc:
+        return ReviewDoc(
+            merchant=merchant, reviewer_email="bulk@review.com", reviewer_name=name, resource_id=resource_id
+        )
+
+    writer = BulkUpsertWriter(ReviewDoc, key="resource_id", fields=["reviewer_name"], batch_size=10)
+    async with writer:
+        for i in range(25):
+            await writer.add(get_review(2 * 10**15 + i, "Reviewer"))
+        assert writer.pending == 5
+    assert writer.pending == 0
+    assert writer.result == BulkUpsertResult(inserted=25)
+
+    writer = BulkUpsertWriter(ReviewDoc, key="resource_id", fields=["reviewer_name"])
+    async with writer:
+        for i in range(25):
+            await writer.add(get_review(2 * 10**15 + i, "Renamed" if i < 5 else "Reviewer"))
+        await writer.add(get_review(2 * 10**15 + 25, "Reviewer"))
+        await writer.add(get_review(2 * 10**15 + 25, "Renamed"))  # Written once, with the latest values
+    assert writer.result == BulkUpsertResult(inserted=1, updated=5, unchanged=20)
+
+    reviews = await ReviewDoc.find(ReviewDoc.merchant.id == merchant.id).to_list()
+    assert len(reviews) == 26
+    assert sum(x.reviewer_name == "Renamed" for x in reviews) == 6
+    assert all(x.doc_meta.created for x in reviews)
+
+    writer = BulkUpsertWriter(ReviewDoc, key="resource_id", fields=["reviewer_name"], flush_interval=0.1)
+    async with writer:
+        # The timer writes the buffer while no document is added
+        await writer.add(get_review(2 * 10**15 + 30, "Reviewer"))
+        await asyncio.sleep(0.3)
+        assert writer.pending == 0
+
+        # Documents that could not be written stay pending, while the others are written
+        conflict = UpdateOne({"resource_id": -1}, {"$set": {"path": 1, "path.conflict": 2}}, upsert=True)
+        writer.operations["conflict"] = conflict
+        with pytest.raises(BulkWriteError):
+            await writer.add(get_review(2 * 10**15 + 31, "Reviewer"))
+            await writer.flush()
+        assert writer.operations == {"conflict": conflict}
+        del writer.operations["conflict"]
+    assert writer.result == BulkUpsertResult(inserted=2)
+
+    await ReviewDoc.find(ReviewDoc.merchant.id == merchant.id).delete()
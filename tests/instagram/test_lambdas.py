@@ -1,7 +1,17 @@
+import asyncio
+import threading
+import typing
+from concurrent.futures import ThreadPoolExecutor
+
 import pytest
 
+from sap.worker import LambdaResponse
+
+from AppMain.settings import AppSettings
+from tests._helpers.utils import count_mongo_commands
 from trellis.instagram.lambdas import DeleteInstagramReviewLambda
-from trellis.instagram.models import MerchantDoc
+from trellis.instagram.models import MerchantDoc, ReviewDoc
+from trellis.xlib.lambdas import Signal, SignalResult
 
 
 @pytest.mark.asyncio
@@ -19,8 +29,97 @@ async def test_lambda_delete_review(merchant: MerchantDoc) -> None:
         "tier_expiring": "2030-01-01",
     }
 
+    review = ReviewDoc(
+        merchant=merchant, reviewer_email=account_data["email"], reviewer_name="Codjo", resource_id=3 * 10**15
+    )
+    await review.create()
+
     # test signal packed receive for existing shop
     await task.test_process(merchant.beans_card_id, account_data=account_data)
+    assert await ReviewDoc.get(review.id) is None
 
     # test signal packed receive for non-existing shop
     await task.test_process("0123456789", account_data=account_data)
+
+
+@pytest.mark.asyncio
+async def test_lambda_delete_review_batch(merchant: MerchantDoc, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Ensure that the signals of a bulk purge are deleted in a single request, with a response for each signal."""
+    monkeypatch.setattr(AppSettings, "LAMBDA_BATCHING", True)
+    task = DeleteInstagramReviewLambda()
+    emails = [f"trellis+purge-{i}@trybeans.com" for i in range(50)]
+    await ReviewDoc.insert_many(
+        [
+            ReviewDoc(merchant=merchant, reviewer_email=x, reviewer_name="Purge", resource_id=4 * 10**15 + i)
+            for i, x in enumerate(emails)
+        ]
+    )
+
+    commands = count_mongo_commands()
+    responses = await asyncio.gather(
+        *[task.test_process(merchant.beans_card_id, account_data={"email": x}) for x in emails],
+        task.test_process("0123456789", account_data={"email": emails[0]}),
+    )
+    # A single lookup of the merchants and a single deletion
+    assert count_mongo_commands() == commands + 2
+    assert responses[:-1] == [{"result": True}] * len(emails)
+    assert responses[-1] == {"result": False, "error": "MERCHANT_NOT_FOUND 0123456789"}
+    assert await ReviewDoc.find(ReviewDoc.merchant.id == merchant.id, ReviewDoc.reviewer_name == "Purge").count() == 0
+
+
+class EchoLambda(DeleteInstagramReviewLambda):
+    """Lambda answering each signal with its identifier, without database."""
+
+    batches: list[list[Signal]] = []
+    threads: set[str] = set()
+
+    async def handle_batch(self, signals: list[Signal]) -> list[SignalResult]:
+        """Record the batch, and answer each signal, or fail for the merchants named `fail`."""
+        self.batches.append(signals)
+        self.threads.add(threading.current_thread().name)
+        if any(identifier == "fail_all" for identifier, _ in signals):
+            raise ValueError("Failing batch")
+        return [
+            ValueError("Failing merchant") if identifier == "fail" else LambdaResponse(result=True, data=identifier)
+            for identifier, _ in signals
+        ]
+
+
+def test_lambda_batcher(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Ensure that the lambdas run at the same time by worker threads are processed together."""
+    monkeypatch.setattr(AppSettings, "LAMBDA_BATCHING", True)
+    task = EchoLambda()
+
+    def run(identifier: str) -> typing.Any:
+        return task.run(identifier, account_data={"email": f"{identifier}@trybeans.com"})
+
+    with ThreadPoolExecutor(20) as executor:
+        responses = list(executor.map(run, [f"card_{i}" for i in range(20)]))
+    assert [x["data"] for x in responses] == [f"card_{i}" for i in range(20)]
+    assert len(task.batches) < 20
+    assert sum(len(x) for x in task.batches) == 20
+    assert task.threads == {"lambda-batcher"}
+
+    # Each signal of a failing batch gets the error
+    with pytest.raises(ValueError, match="Failing batch"):
+        run("fail_all")
+
+    # Only the signals of a failing merchant get its error
+    with ThreadPoolExecutor(2) as executor:
+        failing, passing = executor.submit(run, "fail"), executor.submit(run, "card_0")
+        with pytest.raises(ValueError, match="Failing merchant"):
+            failing.result()
+        assert passing.result()["data"] == "card_0"
+
+
+def test_lambda_batcher_disabled() -> None:
+    """Ensure that without the batching worker mode, each lambda is run alone by `LambdaTask.run()`."""
+    assert not AppSettings.LAMBDA_BATCHING
+    task = EchoLambda()
+    task.batches, task.threads = [], set()
+
+    assert task.run("card_0", account_data={"email": "card_0@trybeans.com"})["data"] == "card_0"
+    assert task.batches == [[("card_0", {"account_data": {"email": "card_0@trybeans.com"}})]]
+    assert task.threads == {threading.current_thread().name}
+    with pytest.raises(ValueError, match="Failing merchant"):
+        task.run("fail", account_data={})
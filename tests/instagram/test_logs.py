@@ -0,0 +1,58 @@
+"""
+Test Logs.
+
+Test that log files are written from a background thread.
+"""
+
+import logging
+import pathlib
+import threading
+
+from AppMain.settings import logger
+from trellis.xlib.logs import QueuedFileHandler
+
+
+def test_logs_queued_file_handler(tmp_path: pathlib.Path) -> None:
+    """Ensure that records are written by the listener thread, and that the queue is bounded."""
+    filename = tmp_path / "trellis.log"
+    handler = QueuedFileHandler(str(filename), maxsize=10)
+    handler.setFormatter(logging.Formatter("%(levelname)s %(message)s"))
+    test_logger = logging.getLogger("trellis.test_logs")
+    test_logger.propagate = False
+    test_logger.addHandler(handler)
+    threads: set[str] = set()
+
+    def get_thread(record: logging.LogRecord) -> bool:
+        threads.add(threading.current_thread().name)
+        return bool(record)
+
+    handler.target.addFilter(get_thread)
+
+    # Scenario A: Records are formatted once, and written by the listener thread
+    try:
+        raise ValueError("Error A")
+    except ValueError:
+        test_logger.exception("Record A")
+    assert handler.listener
+    handler.listener.stop()
+    handler.listener = None
+    content = filename.read_text()
+    assert content.startswith("ERROR Record A\nTraceback")
+    assert "ValueError: Error A" in content
+    assert threading.current_thread().name not in threads
+
+    # Scenario B: When the queue is full, info records are dropped and errors are written directly
+    for i in range(13):
+        test_logger.info("Record B%d", i)
+    test_logger.error("Record B error")
+    assert handler.dropped == 3
+    assert "Record B" not in filename.read_text().replace("Record B error", "")
+    assert "Record B error" in filename.read_text()
+
+    test_logger.removeHandler(handler)
+    handler.close()
+
+
+def test_logs_settings() -> None:
+    """Ensure that the log files of the app are written from a background thread."""
+    assert any(isinstance(x, QueuedFileHandler) for x in logger.handlers)
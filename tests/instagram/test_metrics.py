@@ -0,0 +1,67 @@
+"""
+Test Metrics.
+
+Test the latency histograms exported at `/metrics/`.
+"""
+
+import pytest
+from async_asgi_testclient import TestClient
+from fastapi import status
+
+from AppMain.asgi import app
+from trellis.instagram.lambdas import DeleteInstagramReviewLambda
+from trellis.instagram.models import MerchantDoc
+from trellis.xlib.metrics import Histogram, MetricsMiddleware
+
+
+def test_metrics_histogram() -> None:
+    """Ensure that values are counted in their bucket, and exported with cumulated counts."""
+    histogram = Histogram("test_duration_seconds", "Test.", ("name", "outcome"), buckets=(0.1, 1))
+    Histogram.instances.remove(histogram)
+    histogram.observe(0.05, 'a"b', "success")
+    histogram.observe(0.1, 'a"b', "success")
+    histogram.observe(5, 'a"b', "success")
+    with histogram.time("c"):
+        pass
+    with pytest.raises(ValueError), histogram.time("c"):
+        raise ValueError
+
+    lines = list(histogram.collect())
+    assert lines[:2] == ["# HELP test_duration_seconds Test.", "# TYPE test_duration_seconds histogram"]
+    assert 'test_duration_seconds_bucket{name="a\\"b",outcome="success",le="0.1"} 2' in lines
+    assert 'test_duration_seconds_bucket{name="a\\"b",outcome="success",le="1.0"} 2' in lines
+    assert 'test_duration_seconds_bucket{name="a\\"b",outcome="success",le="+Inf"} 3' in lines
+    assert 'test_duration_seconds_sum{name="a\\"b",outcome="success"} 5.15' in lines
+    assert 'test_duration_seconds_count{name="c",outcome="success"} 1' in lines
+    assert 'test_duration_seconds_count{name="c",outcome="error"} 1' in lines
+
+
+def test_metrics_route() -> None:
+    """Ensure that requests are labelled by route template, including the prefix of their mounts."""
+    route = app.router.routes[-1]
+    assert MetricsMiddleware.get_route({"route": route}) == route.path  # type: ignore[attr-defined]
+    assert MetricsMiddleware.get_route({"root_path": "/static", "app_root_path": ""}) == "/static/{path}"
+    assert MetricsMiddleware.get_route({}) == "unmatched"
+
+
+@pytest.mark.asyncio
+async def test_metrics_endpoint(merchant: MerchantDoc) -> None:
+    """Ensure that requests, MongoDB commands and tasks are measured, and exported at `/metrics/`."""
+    await DeleteInstagramReviewLambda().test_process("0123456789", account_data={})
+
+    async with TestClient(app) as client:
+        await client.get("/health/")
+        await client.get("/instagram/pages/status/")
+        await client.get("/instagram/not-found/")
+        await MerchantDoc.find_one(MerchantDoc.id == merchant.id)
+
+        response = await client.get("/metrics/")
+        assert response.status_code == status.HTTP_200_OK
+        assert response.headers["Content-Type"].startswith("text/plain; version=0.0.4")
+
+    assert 'http_request_duration_seconds_count{method="GET",route="/health/",status="200"}' in response.text
+    assert 'http_request_duration_seconds_count{method="GET",route="/instagram/pages/status/"' in response.text
+    assert 'http_request_duration_seconds_count{method="GET",route="/instagram/{path}",status="404"}' in response.text
+    assert 'mongodb_command_duration_seconds_count{command="find",outcome="success"}' in response.text
+    task_name = DeleteInstagramReviewLambda().name
+    assert f'trellis_task_duration_seconds_count{{task="{task_name}",outcome="success"}}' in response.text
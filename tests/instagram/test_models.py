@@ -0,0 +1,98 @@
+"""
+Test Models.
+
+Test the indexes declared on the models and the initialization of Beanie.
+"""
+
+import os
+import typing
+import weakref
+
+import beanie
+import pytest
+from beanie.odm.operators.find.comparison import In
+from beanie.odm.queries.find import FindMany
+
+from sap.beanie.client import BeanieClient
+from sap.worker.crons import FetchStrategy
+
+from AppMain.asgi import document_models, initialize_beanie
+from AppMain.settings import AppSettings
+from trellis.instagram.crons import FetchReviewsCron
+from trellis.instagram.models import MerchantDoc, ReviewDoc
+from trellis.xlib.database import BeanieGuard
+from trellis.xlib.profiler import query_profiler
+
+
+async def get_winning_plan(query: FindMany[typing.Any]) -> str:
+    """Explain a query and return a string representation of the plan selected by MongoDB."""
+    cursor = query.document_model.get_motor_collection().find(
+        query.get_filter_query(), sort=query.sort_expressions or None, limit=query.limit_number
+    )
+    explain: dict[str, typing.Any] = await cursor.explain()
+    return str(explain["queryPlanner"]["winningPlan"])
+
+
+@pytest.mark.asyncio
+async def test_models_hot_queries_use_indexes(merchant: MerchantDoc) -> None:
+    """Ensure that none of the queries run on each cron, lambda or API call scans a whole collection."""
+    queries: dict[str, FindMany[typing.Any]] = {
+        "cron_fetch_reviews_new": FetchReviewsCron().get_queryset(batch_size=20, strategy=FetchStrategy.NEW),
+        "cron_fetch_reviews_old": FetchReviewsCron().get_queryset(batch_size=20, strategy=FetchStrategy.OLD),
+        "lambda_merchant": MerchantDoc.find(
+            MerchantDoc.beans_card_id == merchant.beans_card_id, MerchantDoc.is_active == True
+        ),
+        "lambda_delete_review": ReviewDoc.find(
+            ReviewDoc.merchant.id == merchant.id, In(ReviewDoc.reviewer_email, ["trellis@review.com", "x@review.com"])
+        ),
+        "webapi_list_reviews": ReviewDoc.find(ReviewDoc.merchant.id == merchant.id, sort="_id", limit=100),
+    }
+
+    for name, query in queries.items():
+        plan = await get_winning_plan(query)
+        assert "IXSCAN" in plan, name
+        assert "COLLSCAN" not in plan, name
+
+
+@pytest.mark.asyncio
+async def test_models_initialize_beanie_once(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Ensure that Beanie is initialized once per process, and that forked processes do not re-create indexes."""
+    calls: list[dict[str, typing.Any]] = []
+
+    async def init(*args: typing.Any, **kwargs: typing.Any) -> None:
+        calls.append(kwargs)
+
+    monkeypatch.setattr(beanie, "init_beanie", init)
+
+    # Already initialized in this process
+    await initialize_beanie()
+    assert not calls
+
+    # A forked process opens its own connection, without initializing the documents again
+    monkeypatch.setattr(BeanieGuard, "pid", os.getpid() + 1)
+    database = await BeanieClient.get_db_default()
+    await initialize_beanie()
+    assert not calls
+    assert BeanieGuard.pid == os.getpid()
+    assert await BeanieClient.get_db_default() is not database
+    assert ReviewDoc.get_motor_collection().database is await BeanieClient.get_db_default()
+    assert await ReviewDoc.find(ReviewDoc.resource_id == 0).count() == 0
+
+    # The connection is checked once per event loop, and a new one is opened when it is lost
+    async def ping() -> bool:
+        return False
+
+    monkeypatch.setattr(BeanieGuard, "ping", ping)
+    database = await BeanieClient.get_db_default()
+    await initialize_beanie()
+    assert await BeanieClient.get_db_default() is database
+    monkeypatch.setattr(BeanieGuard, "checked", weakref.WeakSet())
+    await initialize_beanie()
+    assert not calls
+    assert await BeanieClient.get_db_default() is not database
+    assert ReviewDoc.get_motor_collection().database is await BeanieClient.get_db_default()
+
+    # A forced initialization re-creates the indexes
+    await BeanieGuard.init(mongo_params=AppSettings.MONGO, document_models=document_models, force=True)
+    assert len(calls) == 1
+    assert query_profiler in BeanieClient.connections["default"].client.options.event_listeners
@@ -0,0 +1,105 @@
+"""
+Test Profiler.
+
+Test the aggregation of MongoDB commands by query shape.
+"""
+
+import atexit
+import os
+import pathlib
+import typing
+from unittest import mock
+
+import pytest
+
+from trellis.instagram.models import MerchantDoc
+from trellis.xlib.profiler import QueryProfiler, QueryStats, get_shape, query_profiler, summarize_explain
+
+
+def test_profiler_shape() -> None:
+    """Ensure that values are replaced in filters, but not in sorts and projections."""
+    command = {
+        "find": "reviews",
+        "filter": {"merchant.$id": "abc", "created": {"$gt": 1}, "$or": [{"a": 1}, {"b": {"$in": [1, 2]}}]},
+        "sort": {"created": -1},
+        "limit": 20,
+        "lsid": {"id": "session"},
+    }
+    assert get_shape(command) == (
+        'find reviews {"filter": {"merchant.$id": "?", "created": {"$gt": "?"}, "$or": [{"a": "?"}, {"b": {"$in": "?"}}]}'
+        ', "sort": {"created": -1}, "limit": "?"}'
+    )
+    deletes = [{"q": {"_id": x}, "limit": 1} for x in range(3)]
+    assert get_shape({"delete": "reviews", "deletes": deletes}) == 'delete reviews {"deletes": {"q": {"_id": "?"}}}'
+    pipeline = [{"$match": {"merchant.$id": "abc"}}, {"$sort": {"created": -1}}, {"$limit": 10}]
+    assert get_shape({"aggregate": "reviews", "pipeline": pipeline}) == (
+        'aggregate reviews {"pipeline": [{"$match": {"merchant.$id": "?"}}, {"$sort": {"created": -1}}, {"$limit": "?"}]}'
+    )
+    # Cursors of the same collection share their shape
+    shapes = {get_shape({"getMore": x, "collection": "reviews", "batchSize": 100}) for x in [1234, 5678]}
+    assert shapes == {"getMore reviews {}"}
+
+
+def test_profiler_explain() -> None:
+    """Ensure that the plans of queries and aggregations are summarized."""
+    result = {
+        "queryPlanner": {"winningPlan": {"stage": "FETCH", "inputStage": {"stage": "IXSCAN", "indexName": "id_1"}}},
+        "executionStats": {"totalKeysExamined": 1, "totalDocsExamined": 1, "nReturned": 1},
+    }
+    expected = "IXSCAN(id_1) > FETCH, keys examined 1, docs examined 1, returned 1"
+    assert summarize_explain(result) == expected
+    assert summarize_explain({"stages": [{"$cursor": result}, {"$limit": 1}]}) == expected
+    assert summarize_explain({}) == "?, keys examined ?, docs examined ?, returned ?"
+
+
+def test_profiler_reset(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Ensure that the statistics are reset by the first command of a forked process, with a new executor."""
+    profiler = QueryProfiler(dns="mongodb://localhost")
+    event = mock.Mock(command_name="find", command={"find": "reviews", "filter": {}}, connection_id=1, request_id=1)
+    registered: list[typing.Callable[[], typing.Any]] = []
+    monkeypatch.setattr(atexit, "register", registered.append)
+
+    profiler.started(event)
+    assert profiler.pid == os.getpid()
+    assert registered == [profiler.dump]
+
+    executor = profiler.executor
+    profiler.pid = os.getpid() + 1  # forked process
+    profiler.started(event)
+    assert profiler.pid == os.getpid()
+    assert profiler.executor is not executor
+    assert executor._shutdown  # pylint: disable=protected-access
+    assert registered == [profiler.dump]
+
+
+def test_profiler_report(tmp_path: pathlib.Path) -> None:
+    """Ensure that the dumps of all processes are merged in the report."""
+    profiler = QueryProfiler(dns="mongodb://localhost", dump_dir=tmp_path)
+    profiler.stats = {"find a {}": QueryStats(count=2, total_ms=10, max_ms=8), "find b {}": QueryStats(1, 30, 30, 1)}
+    path = profiler.dump()
+    assert path and path.exists()
+    (tmp_path / "queries-1.json").write_text('{"find a {}": {"count": 1, "total_ms": 50, "max_ms": 50}}')
+
+    stats = QueryProfiler.load(tmp_path)
+    assert stats["find a {}"] == QueryStats(count=3, total_ms=60, max_ms=50)
+    lines = QueryProfiler.report(stats, sort="total").splitlines()
+    assert lines[1].endswith("find a {}") and lines[2].endswith("find b {}")
+    lines = QueryProfiler.report(stats, sort="count", top=1).splitlines()
+    assert len(lines) == 2 and lines[1].split()[:2] == ["3", "60.0"]
+
+
+@pytest.mark.asyncio
+async def test_profiler_queries(merchant: MerchantDoc) -> None:
+    """Ensure that queries sent by Beanie are profiled, and that slow queries are explained."""
+    shape = f'find {MerchantDoc.get_collection_name()} {{"filter": {{"_id": "?"}}, "limit": "?"}}'
+    count = query_profiler.stats[shape].count if shape in query_profiler.stats else 0
+
+    with mock.patch.object(query_profiler, "slow_ms", 1e-6):
+        await MerchantDoc.find_one(MerchantDoc.id == merchant.id)
+        await MerchantDoc.find_one(MerchantDoc.id == merchant.id)
+        query_profiler.executor.submit(lambda: None).result()
+
+    stats = query_profiler.stats[shape]
+    assert stats.count == count + 2
+    assert stats.max_ms > 0
+    assert "docs examined" in stats.explain
@@ -0,0 +1,68 @@
+"""
+Test Readiness.
+
+Test the connection warm-up and the `/ready/` probe.
+"""
+
+from unittest import mock
+
+import httpx
+import pytest
+from async_asgi_testclient import TestClient
+from fastapi import status
+from pymongo import monitoring
+
+from sap.beanie.client import BeanieClient
+
+from AppMain.asgi import app
+from AppMain.settings import AppSettings
+from tests._helpers.utils import count_mongo_commands
+from trellis.xlib.readiness import Readiness, pool_listener
+from trellis.xlib.rest import HttpPool
+
+
+@pytest.mark.asyncio
+async def test_readiness_probe() -> None:
+    """Ensure that connections are warmed up on startup, and that the probe does not query MongoDB."""
+    assert Readiness.state == {"ready": False}
+
+    async with TestClient(app) as client:
+        # Only the connections of the app client are counted
+        assert pool_listener in BeanieClient.connections["default"].client.options.event_listeners
+        assert pool_listener not in monitoring._LISTENERS.cmap_listeners  # pylint: disable=protected-access
+        assert pool_listener.connections >= AppSettings.WARMUP_MONGO_CONNECTIONS
+
+        commands = count_mongo_commands()
+        for _ in range(20):
+            response = await client.get("/ready/")
+            assert response.status_code == status.HTTP_200_OK
+        assert count_mongo_commands() == commands
+
+        state = response.json()
+        assert state["ready"] and state["warmed_up"]
+        assert state["mongo"]["writable"]
+        assert state["mongo"]["connections"] >= AppSettings.WARMUP_MONGO_CONNECTIONS
+        assert state["http"]["open"]
+
+    assert Readiness.state == {"ready": False}
+    assert Readiness.refresher is None
+
+
+@pytest.mark.asyncio
+async def test_readiness_warm_up_http() -> None:
+    """Ensure that each origin receives the warm-up requests, and that unreachable origins are reported."""
+    requests: list[httpx.Request] = []
+
+    def handle(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        if request.url.host == "down.example.com":
+            raise httpx.ConnectError("Connection refused", request=request)
+        return httpx.Response(200)
+
+    with mock.patch.object(HttpPool, "transport", httpx.MockTransport(handle)), mock.patch.object(HttpPool, "client"):
+        HttpPool.client = None
+        async with HttpPool.lifespan():
+            await Readiness.warm_up_http(["https://graph.facebook.com/", "https://down.example.com/"], connections=2)
+
+    assert [(x.method, x.url.host) for x in requests].count(("HEAD", "graph.facebook.com")) == 2
+    assert Readiness.http_warmed == 1
@@ -4,11 +4,41 @@ Test Rest Client.
 Test That the Rest Client is well setup
 """
 
+import asyncio
+import time
+
 import pytest
 
+from sap.rest import RestClient
 from sap.rest.rest_exceptions import Rest401Error
 
 from trellis.instagram.rest import InstagramClient
+from trellis.xlib.rest import HttpPool
+from trellis.xlib.throttle import RequestBudget
+
+
+class LocalServer:
+    """Minimal HTTP/1.1 server with keep-alive that counts TCP connections, i.e. handshakes."""
+
+    def __init__(self) -> None:
+        """Initialize counters."""
+        self.connections = 0
+        self.authorizations: list[str] = []
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """Answer all requests sent on a connection."""
+        self.connections += 1
+        for _ in range(1000):
+            try:
+                head = await reader.readuntil(b"\r\n\r\n")
+            except asyncio.IncompleteReadError:
+                break
+            for line in head.decode().split("\r\n"):
+                if line.lower().startswith("authorization:"):
+                    self.authorizations.append(line.split(":", 1)[1].strip())
+            writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nContent-Length: 11\r\n\r\n{"ok":true}')
+            await writer.drain()
+        writer.close()
 
 
 @pytest.mark.asyncio
@@ -18,3 +48,67 @@ async def test_instagram_rest_client() -> None:
 
     with pytest.raises(Rest401Error):
         await client.get("shops/info")
+
+
+@pytest.mark.asyncio
+async def test_request_budget() -> None:
+    """Test that requests wait for both the token budget and the global budget."""
+    budget = RequestBudget(global_rate=100, global_burst=2, key_rate=10, key_burst=1)
+
+    # The first request of each token is allowed immediately within the global burst
+    start = time.perf_counter()
+    await budget.acquire("token-a")
+    await budget.acquire("token-b")
+    assert time.perf_counter() - start < 0.05
+
+    # Next request of a token has to wait for its own budget to refill
+    start = time.perf_counter()
+    await budget.acquire("token-a")
+    assert time.perf_counter() - start >= 0.09
+
+    # A cancelled request gives its token back
+    with pytest.raises(asyncio.TimeoutError):
+        await asyncio.wait_for(budget.acquire("token-a"), timeout=0.01)
+    assert budget.key_limiters["token-a"].refill() > -0.5
+    start = time.perf_counter()
+    await budget.acquire("token-a")
+    assert time.perf_counter() - start < 0.15
+
+    # The limiters of the tokens that have refilled their budget are dropped
+    budget.sweep_size = 2
+    await asyncio.sleep(0.2)
+    await budget.acquire("token-a")
+    await budget.acquire("token-c")
+    assert set(budget.key_limiters) == {"token-a", "token-c"}
+
+
+@pytest.mark.asyncio
+async def test_instagram_rest_client_pool() -> None:
+    """Test that all clients share pooled connections and still send their own token."""
+    server = LocalServer()
+    requests_count = 40
+
+    async with await asyncio.start_server(server.handle, "127.0.0.1", 0) as tcp_server:
+        url = f"http://127.0.0.1:{tcp_server.sockets[0].getsockname()[1]}/me"
+
+        # Scenario A: a new client for each request pays a new handshake for each request
+        for _ in range(requests_count):
+            await RestClient().get(url)
+        assert server.connections == requests_count
+
+        # Scenario B: Instagram clients reuse the connection kept alive by the pool
+        server.connections = 0
+        async with HttpPool.lifespan():
+            for i in range(requests_count):
+                await InstagramClient(f"token-{i}").get(url)
+        assert server.connections == 1
+        assert server.authorizations[-requests_count:] == [f"Bearer token-{i}" for i in range(requests_count)]
+
+        # Outside of a lifespan, requests use a client scoped to the request
+        server.connections = 0
+        await InstagramClient("token").get(url)
+        assert server.connections == 1
+
+    assert HttpPool.client is None
+    with pytest.raises(RuntimeError):
+        HttpPool.get_client()
@@ -0,0 +1,64 @@
+"""
+Test Routing.
+
+Test that trellis routes are mounted lazily, and the import-time budget of the app.
+"""
+
+import os
+import statistics
+import subprocess
+import sys
+
+import httpx
+import pytest
+from fastapi import FastAPI, status
+
+from scripts.benchmarks.import_time import IMPORT_TIME_BUDGET, get_trellis_time, measure_import_time
+from trellis.xlib.routing import LazyMount
+
+# Modules imported on first use, with `APP_SETTINGS_LAZY_MOUNTS`
+LAZY_MODULES = ("trellis.instagram.views", "trellis.instagram.webapi", "pyfacebook", "oauthlib", "redis")
+
+
+def get_imported_modules() -> set[str]:
+    """Return the modules imported by `AppMain.asgi`, in a new process."""
+    env = {**os.environ, "APP_SETTINGS_LAZY_MOUNTS": "true"}
+    process = subprocess.run(
+        [sys.executable, "-c", "import sys, AppMain.asgi; print(*sys.modules, sep='\\n')"],
+        env=env,
+        capture_output=True,
+        check=True,
+    )
+    return set(process.stdout.decode().splitlines())
+
+
+@pytest.mark.asyncio
+async def test_routing_lazy_mount() -> None:
+    """Ensure that the router is imported by its first request, or to build a URL."""
+    for use in ["request", "url"]:
+        mount = LazyMount(path="/instagram", target="trellis.instagram.routes:router", name="instagram")
+        app = FastAPI(routes=[mount])
+        assert mount.loaded is None
+
+        if use == "url":
+            assert app.url_path_for("instagram:home") == "/instagram/pages/"
+        else:
+            async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+                response = await client.get("/instagram/")
+            assert response.status_code == status.HTTP_307_TEMPORARY_REDIRECT
+            assert response.headers["Location"] == "http://test/instagram/pages/"
+        assert mount.loaded is not None
+
+
+def test_routing_lazy_modules() -> None:
+    """Ensure that heavy modules are not imported on startup."""
+    modules = get_imported_modules()
+    for module in LAZY_MODULES:
+        assert module not in modules, module
+
+
+def test_routing_import_time() -> None:
+    """Ensure that the share of the import time spent in trellis modules stays within budget, with lazy mounts."""
+    results = [measure_import_time(lazy=True) for _ in range(3)]
+    share = statistics.median(get_trellis_time(x) / x["AppMain.asgi"] for x in results)
+    assert share <= IMPORT_TIME_BUDGET, f"{share:.0%} of the import time is spent in trellis modules"
@@ -10,16 +10,24 @@ Using async_asgi_testclient.TestClient fix the issue while waiting for an offici
 https://github.com/tiangolo/fastapi/issues/806
 """
 
+import asyncio
+import gzip
+import pathlib
+import time
 import typing
+from datetime import UTC, datetime, timedelta
 from http.cookies import SimpleCookie
 from unittest import mock
 
+import brotli
+import jwt
 import pyfacebook
 import pytest
 from async_asgi_testclient import TestClient
 from fastapi import status
 
-from AppMain.asgi import app
+from AppMain.asgi import app, static_assets
+from AppMain.settings import AppSettings, templates, templates_cache_dir
 from tests._helpers.utils import test_params_default
 from tests._helpers.views import (
     _test_view_base,
@@ -29,6 +37,10 @@ from tests._helpers.views import (
     _test_views_accessibility,
 )
 from trellis.instagram.models import MerchantDoc
+from trellis.xlib.assets import StaticAssets
+from trellis.xlib.auth import TrellisJWTAuth
+from trellis.xlib.cache import merchant_cache
+from trellis.xlib.pages import page_cache
 
 from .samples import instagram_tokens
 
@@ -110,6 +122,9 @@ async def test_view_instagram_callback(
             "instagram_username": None,
             "instagram_access_token": None,
             "instagram_authorized": None,
+            "last_review_fetched": datetime.now(UTC),
+            "next_fetch_at": datetime.now(UTC) + timedelta(days=30),
+            "fetch_interval": 30,
         },
     )
 
@@ -190,6 +205,10 @@ async def test_view_instagram_callback(
         assert merchant.instagram_access_token is not None
         assert merchant.instagram_username is not None
         assert merchant.instagram_id is not None
+        # The reviews of the merchant are fetched by the next run of the cron
+        assert merchant.last_review_fetched is None
+        assert merchant.next_fetch_at is None
+        assert merchant.fetch_interval is None
     else:
         assert response.headers["location"].endswith("/instagram/pages/connect/")
         await merchant.refresh_from_db()
@@ -198,3 +217,190 @@ async def test_view_instagram_callback(
         assert merchant.instagram_id is None
         assert merchant.instagram_username is None
         assert merchant.get_is_connected() is False
+
+
+@pytest.mark.asyncio
+async def test_view_merchant_cache(jwt_cookie: SimpleCookie, merchant: MerchantDoc) -> None:
+    """Ensure that the authenticated merchant is read from the cache, until it is changed."""
+    await merchant.set({"instagram_username": None})
+    hits, misses = merchant_cache.stats.hits, merchant_cache.stats.misses
+
+    # Scenario A: Only the first page fetches the merchant from the DB
+    for page_name in ["status", "rules", "logs"]:
+        async with TestClient(app) as client:
+            await client.get(f"/instagram/pages/{page_name}/", allow_redirects=False, cookies=jwt_cookie)
+    assert merchant_cache.stats.misses == misses + 1
+    assert merchant_cache.stats.hits == hits + 2
+
+    # Scenario B: The next page fetches the merchant again after it has been updated
+    await merchant.set({"instagram_username": "cached_merchant"})
+    async with TestClient(app) as client:
+        await client.get("/instagram/pages/status/", allow_redirects=False, cookies=jwt_cookie)
+    assert merchant_cache.stats.misses == misses + 2
+    token_hash = TrellisJWTAuth.get_token_hash(next(iter(jwt_cookie.values())).value)
+    cached = await merchant_cache.get(MerchantDoc, merchant.id, token_hash)
+    assert cached is not None and cached is not merchant
+    assert cached.instagram_username == "cached_merchant"
+
+    # Scenario C: A token with the same merchant id is verified before its own entry is cached
+    forged = jwt.encode({"exp": int(time.time()) + 60, "user_id": str(merchant.id)}, key="wrong", algorithm="HS256")
+    with pytest.raises(jwt.exceptions.InvalidSignatureError):
+        await TrellisJWTAuth(user_model=MerchantDoc).find_user(forged)
+    assert await merchant_cache.get(MerchantDoc, merchant.id, TrellisJWTAuth.get_token_hash(forged)) is None
+
+    await merchant.set({"instagram_username": None})
+
+
+@pytest.mark.asyncio
+async def test_view_instagram_callback_non_blocking(jwt_cookie: SimpleCookie, merchant: MerchantDoc) -> None:
+    """Ensure that concurrent requests keep their latency while OAuth callbacks wait for the Graph API."""
+    graph_api_latency = 0.3
+
+    def stub_graph_api(*args: typing.Any, **kwargs: typing.Any) -> dict[str, typing.Any]:
+        time.sleep(graph_api_latency)  # pyfacebook performs blocking requests
+        return {"access_token": "IGQ_STUB", "id": "17841400000000001", "username": "stub_account"}
+
+    async def get_health_latency(client: TestClient) -> float:
+        await asyncio.sleep(0.05)  # let the callbacks start first
+        start = time.perf_counter()
+        await client.get("/health/")
+        return time.perf_counter() - start
+
+    with (
+        mock.patch.object(pyfacebook.GraphAPI, "exchange_user_access_token", side_effect=stub_graph_api),
+        mock.patch.object(pyfacebook.GraphAPI, "exchange_long_lived_user_access_token", side_effect=stub_graph_api),
+        mock.patch.object(pyfacebook.GraphAPI, "get_object", side_effect=stub_graph_api),
+    ):
+        async with TestClient(app) as client:
+            callbacks = [
+                client.get(
+                    "/instagram/pages/instagram-callback/",
+                    query_string={"code": "CODE_STUB", "state": "PyFacebook"},
+                    allow_redirects=False,
+                    cookies=jwt_cookie,
+                )
+                for _ in range(4)
+            ]
+            results = await asyncio.gather(*callbacks, *[get_health_latency(client) for _ in range(20)])
+
+    # Each callback waits for 3 Graph API requests, while the other requests are served meanwhile
+    latencies = typing.cast(list[float], results[4:])
+    assert all(x.status_code == status.HTTP_307_TEMPORARY_REDIRECT for x in results[:4])
+    assert max(latencies) < graph_api_latency
+
+    await merchant.refresh_from_db()
+    assert merchant.instagram_username == "stub_account"
+    await merchant.set(
+        {"instagram_id": None, "instagram_username": None, "instagram_access_token": None, "instagram_authorized": None}
+    )
+
+
+@pytest.mark.asyncio
+async def test_view_templates_precompiled() -> None:
+    """Ensure that templates are compiled on startup and persisted in the bytecode cache."""
+    assert templates.env.cache is not None
+    templates.env.cache.clear()
+    for file in pathlib.Path(templates_cache_dir).glob("__jinja2_*.cache"):
+        file.unlink()
+
+    async with TestClient(app):
+        compiled = {x.name for x in templates.env.cache.values()}
+
+    assert {"base.jinja", "index.jinja", "instagram/home.jinja", "instagram/connect.jinja"} <= compiled
+    assert len(list(pathlib.Path(templates_cache_dir).glob("__jinja2_*.cache"))) == len(compiled)
+
+
+@pytest.mark.asyncio
+async def test_view_page_cache(jwt_cookie: SimpleCookie, merchant: MerchantDoc) -> None:
+    """Ensure that pages are rendered once, revalidated with their ETag, and rendered again after a change."""
+    await merchant.set({"instagram_username": "page_cache_a"})
+    stats = page_cache.get_stats()
+
+    async with TestClient(app) as client:
+        # Scenario A: The page is rendered on the first request
+        response_a = await client.get("/instagram/pages/", allow_redirects=False, cookies=jwt_cookie)
+        assert response_a.status_code == status.HTTP_200_OK, response_a.content
+        assert "page_cache_a" in response_a.text
+        assert static_assets.manifest["instagram/logo.svg"] in response_a.text  # fingerprinted static file
+        etag = response_a.headers["ETag"]
+
+        # Scenario B: The browser already has the page
+        headers = {"If-None-Match": etag}
+        response_b = await client.get("/instagram/pages/", headers=headers, cookies=jwt_cookie)
+        assert response_b.status_code == status.HTTP_304_NOT_MODIFIED
+        assert response_b.content == b""
+        assert response_b.headers["ETag"] == etag
+
+        # Scenario C: The page is rendered again after the merchant has been updated
+        await merchant.set({"instagram_username": "page_cache_c"})
+        response_c = await client.get("/instagram/pages/", headers=headers, cookies=jwt_cookie)
+        assert response_c.status_code == status.HTTP_200_OK, response_c.content
+        assert "page_cache_c" in response_c.text
+        assert response_c.headers["ETag"] != etag
+
+    assert page_cache.stats.misses == stats["misses"] + 2
+    assert page_cache.stats.hits == stats["hits"] + 1
+    assert page_cache.stats.not_modified == stats["not_modified"] + 1
+
+    await merchant.set({"instagram_username": None})
+
+
+@pytest.mark.asyncio
+async def test_view_static_assets() -> None:
+    """Ensure that fingerprinted static files are served compressed, with long-lived cache headers."""
+    original = (AppSettings.APP_DIR / "static/instagram/logo.svg").read_bytes()
+    decompress: dict[str, typing.Callable[[bytes], bytes]] = {
+        "br": brotli.decompress,
+        "gzip": gzip.decompress,
+        "identity": lambda x: x,
+    }
+
+    async with TestClient(app) as client:
+        path = static_assets.manifest["instagram/logo.svg"]  # built on startup
+        for encoding, expected in [("br, gzip", "br"), ("gzip", "gzip"), ("br;q=0, gzip", "gzip"), ("", "identity")]:
+            response = await client.get(f"/static/{path}", headers={"Accept-Encoding": encoding})
+            assert response.status_code == status.HTTP_200_OK
+            assert response.headers.get("Content-Encoding", "identity") == expected
+            assert response.headers["Content-Type"] == "image/svg+xml"
+            assert response.headers["Cache-Control"] == "public, max-age=31536000, immutable"
+            assert response.headers["Vary"] == "Accept-Encoding"
+            assert decompress[expected](response.content) == original
+
+            headers = {"Accept-Encoding": encoding, "If-None-Match": response.headers["ETag"]}
+            response = await client.get(f"/static/{path}", headers=headers)
+            assert response.status_code == status.HTTP_304_NOT_MODIFIED
+
+        # The original name is still served, but revalidated by browsers
+        response = await client.get("/static/instagram/logo.svg")
+        assert response.status_code == status.HTTP_200_OK
+        assert "Cache-Control" not in response.headers
+
+
+def test_view_static_assets_manifest(tmp_path: pathlib.Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Ensure that static files are built once, and built again only when they change."""
+    source = tmp_path / "static"
+    (source / "instagram").mkdir(parents=True)
+    (source / "instagram/app.css").write_text("body { color: black; }" * 10)
+    assert not StaticAssets(source=source, target=tmp_path / "build").read_manifest()
+
+    assets = StaticAssets(source=source, target=tmp_path / "build")
+    assets.load()
+    assert set(assets.manifest) == {"instagram/app.css"}
+
+    # Scenario A: The next startup loads the manifest without building anything
+    def build() -> None:
+        raise AssertionError("Static files built again")
+
+    loaded = StaticAssets(source=source, target=tmp_path / "build")
+    with monkeypatch.context() as patch:
+        patch.setattr(loaded, "build", build)
+        loaded.load()
+    assert loaded.manifest == assets.manifest
+    assert loaded.variants == assets.variants
+
+    # Scenario B: A changed static file is built again
+    (source / "instagram/app.css").write_text("body { color: white; }" * 10)
+    assert not StaticAssets(source=source, target=tmp_path / "build").read_manifest()
+    changed = StaticAssets(source=source, target=tmp_path / "build")
+    changed.load()
+    assert changed.manifest["instagram/app.css"] != assets.manifest["instagram/app.css"]
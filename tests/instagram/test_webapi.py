@@ -4,11 +4,18 @@ Test WebAPI.
 Test API endpoints.
 """
 
+import json
+import time
+
 import pytest
 from async_asgi_testclient import TestClient
-from fastapi import status
+from fastapi import APIRouter, FastAPI, Response, status
+from fastapi.routing import APIRoute
 
 from AppMain.asgi import app
+from trellis.instagram.models import MerchantDoc, ReviewDoc
+from trellis.instagram.serializers import RetrieveReview
+from trellis.xlib.responses import FastJSONRoute
 
 BASE_URL = "/instagram/api"
 
@@ -53,3 +60,115 @@ async def test_webapi_list_reviews() -> None:
     response_data = response.json()
 
     assert len(response_data) >= 1
+
+
+@pytest.mark.asyncio
+async def test_webapi_list_reviews_paginated() -> None:
+    """Fetch reviews page by page using the cursor header."""
+    async with TestClient(app) as client:
+        for i in range(3):
+            data = {"reviewer_email": f"page-{i}@review.com", "reviewer_name": f"Page {i}"}
+            await client.post(f"{BASE_URL}/review/", json=data)
+
+        response_all = await client.get(f"{BASE_URL}/review/", query_string={"limit": 1000})
+        response_first = await client.get(f"{BASE_URL}/review/", query_string={"limit": 2})
+        cursor = response_first.headers["X-Next-Cursor"]
+        response_next = await client.get(f"{BASE_URL}/review/", query_string={"limit": 2, "after": cursor})
+
+    # Ensure that pages follow each other without overlapping
+    assert response_first.status_code == status.HTTP_200_OK, response_first.content
+    assert response_next.status_code == status.HTTP_200_OK, response_next.content
+    ids_all = [x["id"] for x in response_all.json()]
+    ids_paginated = [x["id"] for x in response_first.json() + response_next.json()]
+    assert len(response_first.json()) == 2
+    assert ids_paginated == ids_all[: len(ids_paginated)]
+
+
+@pytest.mark.asyncio
+async def test_webapi_stream_reviews() -> None:
+    """Stream all reviews as NDJSON."""
+    async with TestClient(app) as client:
+        response_list = await client.get(f"{BASE_URL}/review/", query_string={"limit": 1000})
+        response = await client.get(f"{BASE_URL}/review/stream/")
+
+    # Ensure that the request is successful
+    assert response.status_code == status.HTTP_200_OK, response.content
+    assert response.headers["content-type"] == "application/x-ndjson"
+
+    # Ensure that the stream contains the same reviews as the list
+    lines = [json.loads(x) for x in response.content.splitlines()]
+    assert [x["id"] for x in lines][:1000] == [x["id"] for x in response_list.json()]
+
+
+@pytest.mark.asyncio
+async def test_webapi_list_reviews_merchant(merchant: MerchantDoc) -> None:
+    """Fetch reviews of a single merchant."""
+    async with TestClient(app) as client:
+        response = await client.get(f"{BASE_URL}/review/", query_string={"merchant": str(merchant.id)})
+        response_stream = await client.get(f"{BASE_URL}/review/stream/", query_string={"merchant": str(merchant.id)})
+
+    # Reviews created through the API are not linked to any merchant
+    assert response.status_code == status.HTTP_200_OK, response.content
+    assert response.json() == []
+    assert "X-Next-Cursor" not in response.headers
+    assert response_stream.content == b""
+
+
+@pytest.mark.asyncio
+async def test_webapi_retrieve_review_projection(merchant: MerchantDoc) -> None:
+    """Ensure that reviews read with a projection are serialized as the whole documents."""
+    await ReviewDoc.insert_many(
+        [
+            ReviewDoc(
+                merchant=merchant,
+                reviewer_email=f"projection-{i}@review.com",
+                reviewer_name="P",
+                resource_id=4 * 10**15 + i,
+            )
+            for i in range(3)
+        ]
+    )
+    filters = [ReviewDoc.merchant.id == merchant.id, ReviewDoc.reviewer_name == "P"]
+
+    documents = await ReviewDoc.find(*filters, sort="_id").to_list()
+    reviews = await RetrieveReview.find(*filters)
+    assert len(reviews) == 3
+    assert reviews == RetrieveReview.from_list(documents)
+    assert not hasattr(reviews[0], "__dict__")
+
+    await ReviewDoc.find(*filters).delete()
+
+
+@pytest.mark.asyncio
+async def test_webapi_fast_json_responses() -> None:
+    """Compare the default and the fast JSON responses of the same endpoint."""
+    reviews = [
+        RetrieveReview(id=f"{i:024x}", reviewer_email=f"reviewer-{i}@review.com", reviewer_name=f'Zoë "{i}" ✓')
+        for i in range(10_000)
+    ]
+
+    async def list_reviews(response: Response) -> list[RetrieveReview]:
+        response.headers["X-Next-Cursor"] = reviews[-1].id
+        return reviews
+
+    test_app = FastAPI()
+    for prefix, route_class in [("/default", APIRoute), ("/fast", FastJSONRoute)]:
+        router = APIRouter(route_class=route_class)
+        router.add_api_route("/review/", list_reviews)
+        test_app.include_router(router, prefix=prefix)
+
+    durations, contents = {}, {}
+    async with TestClient(test_app) as client:
+        for prefix in ["/default", "/fast"]:
+            start = time.perf_counter()
+            for _ in range(10):
+                response = await client.get(f"{prefix}/review/")
+            durations[prefix] = time.perf_counter() - start
+            assert response.status_code == status.HTTP_200_OK, response.content
+            assert response.headers["X-Next-Cursor"] == reviews[-1].id
+            assert response.headers["content-type"] == "application/json"
+            contents[prefix] = response.content
+
+    # Ensure that both responses have the same bytes, and that the fast one is faster
+    assert contents["/fast"] == contents["/default"]
+    assert durations["/fast"] < durations["/default"], durations
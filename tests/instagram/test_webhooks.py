@@ -4,11 +4,17 @@ Test Webhooks.
 Test webhooks endpoints.
 """
 
+import asyncio
+import typing
+
 import pytest
 from async_asgi_testclient import TestClient
 from fastapi import status
+from pymongo.errors import AutoReconnect
 
 from AppMain.asgi import app
+from trellis.instagram.models import ReviewDoc
+from trellis.instagram.webhooks import review_queue
 
 BASE_URL = "/instagram/hooks"
 
@@ -27,3 +33,94 @@ async def test_hooks_review_created() -> None:
     # Ensure that the output data matches the input
     response_data = response.json()
     assert response_data["message"] == "OK"
+
+
+@pytest.mark.asyncio
+async def test_hooks_review_created_burst() -> None:
+    """Ensure that a burst of webhooks is acknowledged first, and inserted by batches until the app shuts down."""
+    email = "burst@review.com"
+    await ReviewDoc.find(ReviewDoc.reviewer_email == email).delete()
+    inserted = review_queue.inserted
+
+    async with TestClient(app) as client:
+        responses = await asyncio.gather(
+            *[
+                client.post(
+                    f"{BASE_URL}/review_created/", json={"reviewer_email": email, "reviewer_name": f"Burst {i}"}
+                )
+                for i in range(200)
+            ]
+        )
+        assert all(x.status_code == status.HTTP_200_OK for x in responses)
+
+    # The queue is drained on shutdown
+    assert review_queue.inserted == inserted + 200
+    assert await ReviewDoc.find(ReviewDoc.reviewer_email == email).count() == 200
+    await ReviewDoc.find(ReviewDoc.reviewer_email == email).delete()
+
+
+@pytest.mark.asyncio
+async def test_hooks_review_created_backpressure(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Ensure that webhooks are rejected with 503 when the queue stays full."""
+    email = "backpressure@review.com"
+    insert = review_queue.insert
+
+    async def slow_insert(batch: list[ReviewDoc]) -> None:
+        await asyncio.sleep(0.2)
+        await insert(batch)
+
+    monkeypatch.setattr(review_queue, "maxsize", 5)
+    monkeypatch.setattr(review_queue, "put_timeout", 0.05)
+    monkeypatch.setattr(review_queue, "insert", slow_insert)
+
+    async with TestClient(app) as client:
+        responses = await asyncio.gather(
+            *[
+                client.post(f"{BASE_URL}/review_created/", json={"reviewer_email": email, "reviewer_name": "Pressure"})
+                for _ in range(20)
+            ]
+        )
+    accepted = [x for x in responses if x.status_code == status.HTTP_200_OK]
+    rejected = [x for x in responses if x.status_code == status.HTTP_503_SERVICE_UNAVAILABLE]
+    assert accepted and rejected
+    assert len(accepted) + len(rejected) == 20
+    assert rejected[0].headers["Retry-After"]
+
+    assert await ReviewDoc.find(ReviewDoc.reviewer_email == email).count() == len(accepted)
+    await ReviewDoc.find(ReviewDoc.reviewer_email == email).delete()
+
+
+@pytest.mark.asyncio
+async def test_hooks_review_created_retry(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Ensure that acknowledged webhooks are inserted once, after the DB failures of previous attempts."""
+    email = "retry@review.com"
+    inserted = review_queue.inserted
+    insert_many = ReviewDoc.insert_many
+    attempts = 0
+
+    async def flaky_insert_many(documents: list[ReviewDoc], **kwargs: typing.Any) -> typing.Any:
+        nonlocal attempts
+        attempts += 1
+        if attempts == 1:
+            # The documents are inserted, but the acknowledgement is lost
+            await insert_many(documents, **kwargs)
+        if attempts <= 2:
+            raise AutoReconnect("Connection lost")
+        return await insert_many(documents, **kwargs)
+
+    monkeypatch.setattr(ReviewDoc, "insert_many", flaky_insert_many)
+    monkeypatch.setattr(review_queue, "retry_delay", 0.01)
+
+    async with TestClient(app) as client:
+        responses = await asyncio.gather(
+            *[
+                client.post(f"{BASE_URL}/review_created/", json={"reviewer_email": email, "reviewer_name": "Retry"})
+                for _ in range(10)
+            ]
+        )
+        assert all(x.status_code == status.HTTP_200_OK for x in responses)
+
+    assert attempts >= 3
+    assert review_queue.inserted == inserted + 10
+    assert await ReviewDoc.find(ReviewDoc.reviewer_email == email).count() == 10
+    await ReviewDoc.find(ReviewDoc.reviewer_email == email).delete()
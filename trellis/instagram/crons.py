@@ -14,65 +14,221 @@ This is useful for:
 
 """
 
+import functools
+import random
 import typing
 from datetime import UTC, datetime, timedelta
 
+import pydantic
+from beanie.odm.enums import SortDirection
 from beanie.odm.operators.find import logical
 from beanie.odm.queries.find import FindMany
 
 from sap.worker.crons import CronStat, FetchStrategy
 
+from AppMain.settings import logger
+from trellis.xlib.bulk import BulkUpsertResult, BulkUpsertWriter
+from trellis.xlib.cache import merchant_cache
 from trellis.xlib.crons import TrellisCronTask
+from trellis.xlib.leases import LeaseClaimer
 
-from .models import MerchantDoc
+from .models import MerchantDoc, ReviewDoc
+from .rest import InstagramClient
+from .serializers import ImportReview
 
-LATENCY_OLD = 7  # number of days after which a merchant data should re-fetched
+LATENCY_OLD = 7  # number of days after which a merchant data should re-fetched, before its interval is adapted
+FETCH_INTERVAL_MIN = 3  # minimum number of days between two fetches, for merchants with new reviews on each fetch
+FETCH_INTERVAL_MAX = 30  # maximum number of days between two fetches, for dormant merchants
+FETCH_INTERVAL_ACTIVE = 0.5  # factor applied to the interval when a fetch finds new reviews
+FETCH_INTERVAL_DORMANT = 1.5  # factor applied to the interval when a fetch finds no new reviews
+FETCH_JITTER = 0.2  # the next fetch is scheduled at the interval +/- 20%, to spread merchants onboarded together
+REVIEWS_BATCH_SIZE = 500  # number of reviews written to the DB in a single bulk request
+REVIEWS_FLUSH_INTERVAL = 5  # maximum number of seconds reviews are buffered before being written to the DB
+STALENESS_BUCKETS = [0, 1, LATENCY_OLD, 30, 90]  # lower bounds in days of the buckets of the staleness stats
 
 
 class FetchReviewsCron(TrellisCronTask):
-    """Fetch reviews for all merchants periodically."""
+    """Fetch reviews for all merchants periodically.
+
+    Each fetch schedules the next one of the merchant, see `get_fetch_interval()` and `get_next_fetch_at()`.
+    Merchants are claimed with a lease before being fetched, so that several workers can run the cron
+    at the same time without fetching the same merchant twice. When a single worker runs the cron,
+    the `claim=False` kwarg streams the merchants from a cursor instead.
+    Each merchant fetched is stamped with its next fetch, so an interrupted run is resumed by the next one.
+    Merchants are processed concurrently, while `InstagramClient.budget` keeps
+    the Graph API requests under the global and per-token rate limits.
+    The concurrency and timeout can be overridden through the cron kwargs:
+    `concurrency` and `merchant_timeout`.
+    """
 
     def get_queryset(self, *, batch_size: typing.Optional[int] = None, **kwargs: typing.Any) -> FindMany[MerchantDoc]:
         """Use strategy to define the list of merchants to fetch review.
 
-        - new: Fetch review for new merchants
-        - old: Fetch review for old merchants
+        - new: Fetch review for new merchants, in their order of creation
+        - old: Fetch review for merchants whose next fetch is due, new merchants first
         """
+        if kwargs.get("strategy") == FetchStrategy.NEW:
+            return MerchantDoc.find_many(
+                MerchantDoc.is_active == True, MerchantDoc.last_review_fetched == None, limit=batch_size, sort="_id"
+            )
+        # Merchants without a scheduled fetch are sorted first
         return MerchantDoc.find_many(
             MerchantDoc.is_active == True,
-            logical.Or(
-                MerchantDoc.last_review_fetched == None,
-                MerchantDoc.last_review_fetched <= datetime.now(UTC) - timedelta(days=LATENCY_OLD),
-            ),
+            logical.Or(MerchantDoc.last_review_fetched == None, get_due_query(datetime.now(UTC))),
             limit=batch_size,
-            sort="last_review_fetched",
+            sort=[("next_fetch_at", SortDirection.ASCENDING), ("last_review_fetched", SortDirection.ASCENDING)],
         )
 
     async def process(self, *, batch_size: int = 100, **kwargs: typing.Any) -> dict[str, int]:
         """Fetch reviews for merchants using strategy and limiting to batch_size."""
         strategy: FetchStrategy = kwargs["strategy"]
-        merchant_list = await self.get_queryset(batch_size=batch_size, strategy=strategy).to_list()
-        reviews_processed_count = 0
-        merchants_processed_count = 0
-
-        for merchant in merchant_list:
-            reviews_processed_count += await fetch_reviews_for_merchant(merchant)
-            merchants_processed_count += 1
-
-        return {"reviews_processed": reviews_processed_count, "merchants_processed": merchants_processed_count}
-
-    async def get_stats(self) -> list[CronStat]:
-        """Stats.
-
-        merchant_new: count how many new merchants are waiting for review fetching.
-        merchant_old: count how many old merchants are waiting for review fetching.
+        queryset = self.get_queryset(batch_size=batch_size, strategy=strategy)
+        writes = BulkUpsertResult()
+        fetch = functools.partial(fetch_reviews_for_merchant, writes=writes)
+        options = {"concurrency": kwargs.get("concurrency"), "item_timeout": kwargs.get("merchant_timeout")}
+
+        if not kwargs.get("claim", True):
+            stats = await self.process_concurrently(self.stream(queryset), fetch, **options)
+        else:
+            async with LeaseClaimer(
+                queryset, duration=self.lease_duration, on_change=merchant_cache.invalidate
+            ) as claimer:
+                # Failed merchants are released when their lease expires, not retried by this run
+                stats = await self.process_concurrently(claimer, fetch, checkpoint=claimer.release, **options)
+        return {
+            "reviews_processed": stats.total,
+            "merchants_processed": stats.processed,
+            "reviews_inserted": writes.inserted,
+            "reviews_updated": writes.updated,
+            "reviews_unchanged": writes.unchanged,
+            "reviews_failed": writes.failed,
+            **stats.get_counters("merchants"),
+        }
+
+    async def compute_stats(self) -> list[CronStat]:
+        """Stats, computed in a single aggregation over the active merchants.
+
+        merchants_new: count how many merchants have never been fetched.
+        merchants_old: count how many merchants have a fetch due.
+        staleness_*: count the merchants by number of days since their reviews were last fetched.
         """
-        return [
-            CronStat(name="merchants_new", value=await self.get_queryset(strategy=FetchStrategy.NEW).count()),
-            CronStat(name="merchants_old", value=await self.get_queryset(strategy=FetchStrategy.OLD).count()),
-        ]
+        return await self.aggregate_stats(
+            MerchantDoc.find(MerchantDoc.is_active == True),
+            counts={
+                "merchants_new": MerchantDoc.last_review_fetched == None,
+                "merchants_old": get_due_query(datetime.now(UTC)),
+            },
+            ages={"staleness": ("last_review_fetched", STALENESS_BUCKETS)},
+        )
 
 
-async def fetch_reviews_for_merchant(merchant: MerchantDoc) -> int:
-    """Fetch all reviews for a merchant."""
-    return 0 if merchant else -1
+def get_due_query(now: datetime) -> logical.Or:
+    """Return the query of the merchants already fetched whose next fetch is due.
+
+    Merchants fetched before the fetches were scheduled are due `LATENCY_OLD` days after their last fetch.
+    """
+    return logical.Or(
+        MerchantDoc.next_fetch_at <= now,
+        logical.And(
+            MerchantDoc.next_fetch_at == None, MerchantDoc.last_review_fetched <= now - timedelta(days=LATENCY_OLD)
+        ),
+    )
+
+
+def get_fetch_interval(previous: float | None, reviews_count: int) -> float:
+    """Return the number of days until the next fetch of a merchant, adapted to its review activity.
+
+    The interval is shortened when the fetch found new reviews and lengthened otherwise,
+    between `FETCH_INTERVAL_MIN` and `FETCH_INTERVAL_MAX` days.
+    """
+    factor = FETCH_INTERVAL_ACTIVE if reviews_count else FETCH_INTERVAL_DORMANT
+    return min(max((previous or LATENCY_OLD) * factor, FETCH_INTERVAL_MIN), FETCH_INTERVAL_MAX)
+
+
+def get_next_fetch_at(now: datetime, interval: float) -> datetime:
+    """Return the date of the next fetch, randomly spread around the interval by `FETCH_JITTER`."""
+    return now + timedelta(days=interval * random.uniform(1 - FETCH_JITTER, 1 + FETCH_JITTER))
+
+
+def schedule_next_fetch(merchant: MerchantDoc, reviews_count: int | None) -> dict[typing.Any, typing.Any]:
+    """Return the fields of a merchant to update once its reviews have been fetched.
+
+    When no reviews could be fetched, ex: the merchant is not connected to Instagram yet,
+    `reviews_count` is None and the interval is kept, as the review activity is unknown.
+    """
+    now = datetime.now(UTC)
+    if reviews_count is None:
+        interval = merchant.fetch_interval or LATENCY_OLD
+        return {MerchantDoc.last_review_fetched: now, MerchantDoc.next_fetch_at: get_next_fetch_at(now, interval)}
+    interval = get_fetch_interval(merchant.fetch_interval, reviews_count)
+    return {
+        MerchantDoc.last_review_fetched: now,
+        MerchantDoc.fetch_interval: interval,
+        MerchantDoc.next_fetch_at: get_next_fetch_at(now, interval),
+    }
+
+
+async def fetch_reviews_for_merchant(merchant: MerchantDoc, writes: BulkUpsertResult | None = None) -> int:
+    """Fetch the reviews created since the last sync of a merchant, and return the number of new reviews.
+
+    Reviews are written to the DB by batches, and the number of reviews inserted,
+    updated, unchanged and failed is added to `writes`.
+
+    The cursor of the next page is saved once all reviews of the previous pages are written,
+    so that an interrupted sync resumes where it stopped. The watermark used to request
+    only new reviews is moved forward once all pages have been fetched. Reviews created
+    in the same second as the watermark are fetched again, the upsert leaves them unchanged.
+    """
+    if not merchant.instagram_access_token or not merchant.instagram_id:
+        await merchant.set(schedule_next_fetch(merchant, reviews_count=None))
+        return 0
+
+    sync = merchant.review_sync
+    writer = BulkUpsertWriter(
+        ReviewDoc,
+        key="resource_id",
+        fields=["reviewer_email", "reviewer_name"],
+        batch_size=REVIEWS_BATCH_SIZE,
+        flush_interval=REVIEWS_FLUSH_INTERVAL,
+    )
+    try:
+        await import_review_pages(merchant, writer)
+    except Exception:
+        # Reviews buffered before the failure are written when leaving the writer,
+        # the cursor can be saved if they all have been.
+        if not writer.pending:
+            await merchant.set({MerchantDoc.review_sync: sync})
+        raise
+
+    reviews_count = writer.result.inserted
+    sync.since, sync.latest, sync.cursor = sync.latest or sync.since, None, None
+    await merchant.set({MerchantDoc.review_sync: sync, **schedule_next_fetch(merchant, reviews_count)})
+    if writes is not None:
+        writes.merge(writer.result)
+    return reviews_count
+
+
+async def import_review_pages(merchant: MerchantDoc, writer: BulkUpsertWriter) -> None:
+    """Write the reviews of each page fetched from the merchant sync state, and checkpoint its cursor.
+
+    Invalid reviews are skipped and counted as failed, so that they do not block the sync at their page.
+    """
+    assert merchant.instagram_access_token and merchant.instagram_id
+    client = InstagramClient(merchant.instagram_access_token)
+    sync = merchant.review_sync
+
+    async with writer:
+        async for page in client.iter_review_pages(merchant.instagram_id, since=sync.since, after=sync.cursor):
+            for item in page["data"]:
+                try:
+                    review = ImportReview(**item)
+                except pydantic.ValidationError as exc:
+                    logger.warning("Skipping invalid review %s of merchant %s: %s", item.get("id"), merchant.id, exc)
+                    writer.result.failed += 1
+                    continue
+                await writer.add(review.to_document(merchant))
+                sync.latest = max(sync.latest or review.created_time, review.created_time)
+            paging = page.get("paging", {})
+            sync.cursor = paging.get("cursors", {}).get("after") if "next" in paging else None
+            if not writer.pending:
+                await merchant.set({MerchantDoc.review_sync: sync})
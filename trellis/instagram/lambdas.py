@@ -6,7 +6,9 @@ Lambdas are background tasks that run remotely on a worker.
 
 import typing
 
-from sap.worker import SignalPacket
+from beanie.odm.operators.find.comparison import In
+
+from sap.worker import LambdaResponse, SignalPacket
 
 from trellis.instagram.models import MerchantDoc, ReviewDoc
 from trellis.xlib.lambdas import TrellisLambdaTask
@@ -17,11 +19,16 @@ class DeleteInstagramReviewLambda(TrellisLambdaTask[MerchantDoc]):
 
     packet = SignalPacket("stem.liana.*.account.delete", providing_args=["identifier", "account_data"])
     merchant_model = MerchantDoc
+    batch_window = 0.05  # accounts of a bulk purge are deleted together
 
-    async def process(self, merchant: MerchantDoc, **kwargs: typing.Any) -> typing.Any:
+    async def process(self, merchant: MerchantDoc, **kwargs: typing.Any) -> LambdaResponse:
         """Delete review data associated to member account."""
-        account_data = kwargs["account_data"]
-        await ReviewDoc.find(
-            ReviewDoc.merchant == merchant.id, ReviewDoc.reviewer_email == account_data["email"]
-        ).delete()
-        return True
+        return (await self.process_batch(merchant, [kwargs]))[0]
+
+    async def process_batch(
+        self, merchant: MerchantDoc, kwargs_list: list[dict[str, typing.Any]]
+    ) -> list[LambdaResponse]:
+        """Delete review data associated to the member accounts, in a single request."""
+        emails = list({kwargs["account_data"]["email"] for kwargs in kwargs_list})
+        await ReviewDoc.find(ReviewDoc.merchant.id == merchant.id, In(ReviewDoc.reviewer_email, emails)).delete()
+        return [LambdaResponse(result=True) for _ in kwargs_list]
@@ -7,13 +7,31 @@ to an online store.
 """
 
 import typing
-from datetime import datetime
+from datetime import UTC, datetime
 
+import pydantic
 import pymongo
 
+from trellis.xlib.leases import Lease
 from trellis.xlib.models import BaseMerchantDoc
 
 
+class ReviewSyncState(pydantic.BaseModel):
+    """Progress of the incremental review synchronization with the Graph API."""
+
+    since: typing.Optional[datetime] = None  # creation time of the most recent review of the last completed sync
+    cursor: typing.Optional[str] = None  # cursor of the next page to fetch, set while a sync is in progress
+    latest: typing.Optional[datetime] = None  # creation time of the most recent review of the sync in progress
+
+    @pydantic.field_validator("since", "latest")
+    @classmethod
+    def validate_timezone(cls, value: typing.Optional[datetime]) -> typing.Optional[datetime]:
+        """Ensure that dates read from MongoDB, which are stored without timezone, are in UTC."""
+        if value and value.tzinfo is None:
+            return value.replace(tzinfo=UTC)
+        return value
+
+
 class MerchantDoc(BaseMerchantDoc):
     """Merchant object."""
 
@@ -23,6 +41,10 @@ class MerchantDoc(BaseMerchantDoc):
     instagram_access_token: typing.Optional[str] = None  # Access token used to perform query on Instagram API
     instagram_authorized: typing.Optional[datetime] = None  # Last access_token update
     last_review_fetched: typing.Optional[datetime] = None
+    next_fetch_at: typing.Optional[datetime] = None  # scheduled fetch of the reviews, None until the first fetch
+    fetch_interval: typing.Optional[float] = None  # days between two fetches, adapted to the review activity
+    review_sync: ReviewSyncState = ReviewSyncState()
+    lease: typing.Optional[Lease] = None  # set while the reviews are fetched by a worker of `FetchReviewsCron`
 
     trellis_name: typing.ClassVar[str] = "instagram"
 
@@ -39,5 +61,15 @@ class MerchantDoc(BaseMerchantDoc):
 
         name = "instagram_merchant"
         indexes = [
+            # Also serves the lookup of active merchants by `TrellisLambdaTask`
             pymongo.IndexModel("beans_card_id", unique=True),
+            # Merchants waiting for their reviews to be fetched by `FetchReviewsCron`
+            pymongo.IndexModel([("is_active", pymongo.ASCENDING), ("last_review_fetched", pymongo.ASCENDING)]),
+            pymongo.IndexModel(
+                [
+                    ("is_active", pymongo.ASCENDING),
+                    ("next_fetch_at", pymongo.ASCENDING),
+                    ("last_review_fetched", pymongo.ASCENDING),
+                ]
+            ),
         ]
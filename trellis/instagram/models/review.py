@@ -36,4 +36,6 @@ class ReviewDoc(Document):
         name = "instagram_review"
         indexes = [
             pymongo.IndexModel("resource_id", unique=True),
+            pymongo.IndexModel([("merchant.$id", pymongo.ASCENDING), ("_id", pymongo.ASCENDING)]),
+            pymongo.IndexModel([("merchant.$id", pymongo.ASCENDING), ("reviewer_email", pymongo.ASCENDING)]),
         ]
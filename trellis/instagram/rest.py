@@ -4,9 +4,14 @@ Rest.
 Rest client for instagram API.
 """
 
-import httpx
+import typing
+import urllib.parse
+from datetime import datetime
 
-from sap.rest import RestClient
+from sap.rest import RestClient, RestData
+
+from trellis.xlib.rest import HttpPool
+from trellis.xlib.throttle import RequestBudget
 
 
 class InstagramClient(RestClient):
@@ -14,17 +19,54 @@ class InstagramClient(RestClient):
 
     An async wrapper around the Instagram API.
     Common errors are handled by the wrapper.
+    Requests are sent through the connections of the shared `HttpPool` when it is open.
     """
 
     base_url: str = "https://graph.facebook.com/v18.0/"
     access_token: str
     scopes: list[str] = ["read_shops", "read_reviewers", "read_reviews", "read_settings"]
+    page_limit: int = 100  # number of items requested per page
+    page_max: int = 1000  # safety limit on the number of pages followed in a single iteration
+
+    # Requests budget shared by all clients of the process.
+    # Graph API allows 200 calls per hour per user token.
+    budget: typing.ClassVar[RequestBudget] = RequestBudget(
+        global_rate=50, global_burst=50, key_rate=200 / 3600, key_burst=50
+    )
 
     def __init__(self, access_token: str) -> None:
         """Initialize the API client."""
         super().__init__()
         self.access_token = access_token
 
-    def _get_client(self) -> httpx.AsyncClient:
-        headers = {"Authorization": f"Bearer {self.access_token}"}
-        return httpx.AsyncClient(headers=headers)
+    async def request(self, method: str, path: str, **kwargs: typing.Any) -> RestData:
+        """Wait for the requests budget to allow the request and perform it on the shared pool."""
+        await self.budget.acquire(self.access_token)
+        url: str = path if "://" in path else urllib.parse.urljoin(self.base_url, path)
+        headers = {"Authorization": f"Bearer {self.access_token}", **(kwargs.pop("headers", None) or {})}
+        async with HttpPool.connect() as client:
+            response = await client.request(method, url, headers=headers, **kwargs)
+        self.response_cache = response
+        return await self.get_response_data(response)
+
+    async def iter_review_pages(
+        self, instagram_id: str, *, since: datetime | None = None, after: str | None = None
+    ) -> typing.AsyncGenerator[RestData, None]:
+        """Fetch the pages of reviews created from the second of `since`, following the `paging.cursors`.
+
+        Iteration starts from the page designated by the `after` cursor when provided.
+        """
+        params: dict[str, str | int] = {
+            "fields": "id,created_time,reviewer_email,reviewer_name",
+            "limit": self.page_limit,
+        }
+        if since:
+            params["since"] = int(since.timestamp())
+
+        for _ in range(self.page_max):
+            page = await self.get(f"{instagram_id}/reviews", params={**params, "after": after} if after else params)
+            yield page
+            paging = page.get("paging", {})
+            after = paging.get("cursors", {}).get("after")
+            if not after or "next" not in paging:
+                return
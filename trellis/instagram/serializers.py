@@ -7,30 +7,59 @@ Handle data validation.
 import random
 import typing
 from dataclasses import dataclass
+from datetime import datetime
 
 import pydantic
 
-from .models import ReviewDoc
+from .models import MerchantDoc, ReviewDoc
 
 
-@dataclass
+@dataclass(slots=True)
 class RetrieveReview:
-    """Serialize an object."""
+    """Serialize an object.
+
+    Listings build it straight from the raw documents returned by MongoDB, reading only
+    the projected fields, without validating a whole `ReviewDoc` for each review.
+    """
 
     id: str
-    reviewer_email: pydantic.EmailStr
+    reviewer_email: str
     reviewer_name: str
 
-    def __init__(self, instance: ReviewDoc) -> None:
+    projection: typing.ClassVar[dict[str, bool]] = {"reviewer_email": True, "reviewer_name": True}
+
+    @classmethod
+    def from_document(cls, instance: ReviewDoc) -> typing.Self:
         """Serialize a single object instance."""
-        self.id = str(instance.id)
-        self.reviewer_email = instance.reviewer_email
-        self.reviewer_name = instance.reviewer_name
+        return cls(id=str(instance.id), reviewer_email=instance.reviewer_email, reviewer_name=instance.reviewer_name)
+
+    @classmethod
+    def from_raw(cls, raw: typing.Mapping[str, typing.Any]) -> typing.Self:
+        """Serialize a raw document read from MongoDB with `projection`."""
+        return cls(id=str(raw["_id"]), reviewer_email=raw["reviewer_email"], reviewer_name=raw["reviewer_name"])
 
     @classmethod
     def from_list(cls, data_list: list[ReviewDoc]) -> list[typing.Self]:
         """Serialize a list of objects."""
-        return [cls(x) for x in data_list]
+        return [cls.from_document(x) for x in data_list]
+
+    @staticmethod
+    def get_cursor(
+        *filters: typing.Any, limit: int = 0, batch_size: int = 0
+    ) -> typing.AsyncIterable[dict[str, typing.Any]]:
+        """Open a cursor on the projected reviews matching the beanie `filters`, ordered by id."""
+        return ReviewDoc.get_motor_collection().find(
+            ReviewDoc.find(*filters).get_filter_query(),
+            projection=RetrieveReview.projection,
+            sort=[("_id", 1)],
+            limit=limit,
+            batch_size=batch_size,
+        )
+
+    @classmethod
+    async def find(cls, *filters: typing.Any, limit: int = 0) -> list[typing.Self]:
+        """Serialize the reviews matching the beanie `filters`, ordered by id."""
+        return [cls.from_raw(raw) async for raw in cls.get_cursor(*filters, limit=limit)]
 
 
 class CreateReview(pydantic.BaseModel):
@@ -47,12 +76,33 @@ class CreateReview(pydantic.BaseModel):
             raise ValueError("example.com emails are not allowed")
         return value
 
+    def to_document(self) -> ReviewDoc:
+        """Build the object to insert in the DB."""
+        return ReviewDoc(
+            reviewer_email=self.reviewer_email,
+            reviewer_name=self.reviewer_name,
+            resource_id=random.randint(0, 2**62),  # large enough to avoid collisions in a burst of webhooks
+            merchant=None,
+        )
+
     async def create(self) -> ReviewDoc:
         """Insert the object in the DB."""
-        review = ReviewDoc(
+        return await self.to_document().create()
+
+
+class ImportReview(pydantic.BaseModel):
+    """Validate a review fetched from the Graph API."""
+
+    resource_id: int = pydantic.Field(alias="id")
+    created_time: datetime
+    reviewer_email: pydantic.EmailStr
+    reviewer_name: str
+
+    def to_document(self, merchant: MerchantDoc) -> ReviewDoc:
+        """Build the review document to insert or update in the DB."""
+        return ReviewDoc(
+            merchant=merchant,
             reviewer_email=self.reviewer_email,
             reviewer_name=self.reviewer_name,
-            resource_id=random.randint(0, 1000),
-            merchant=None,
+            resource_id=self.resource_id,
         )
-        return await review.create()
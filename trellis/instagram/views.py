@@ -10,16 +10,18 @@ The templating engine used is Jinja2:
 https://jinja.palletsprojects.com/
 
 It should accept Forms and returns an HTML response.
+Merchant pages are cached and answer conditional requests with `304 Not Modified`.
 https://en.wikipedia.org/wiki/Web_page
 https://en.wikipedia.org/wiki/Form_(HTML)
 """
 
+import asyncio
+import functools
 import typing
 import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
-import oauthlib.oauth2.rfc6749.errors
-import pyfacebook
 from fastapi import APIRouter, Depends, Request
 from fastapi.responses import RedirectResponse, Response
 
@@ -28,23 +30,34 @@ from sap.rest import BeansClient
 
 from AppMain.settings import AppSettings, logger, templates
 from trellis.xlib.auth import TrellisJWTAuth
+from trellis.xlib.pages import page_cache
 
-from .models import MerchantDoc, ReviewDoc
+from .models import MerchantDoc
 from .serializers import CreateReview, RetrieveReview
 
 router = APIRouter()
 jwt_auth = TrellisJWTAuth(user_model=MerchantDoc)
 DependsMerchant = typing.Annotated[MerchantDoc, Depends(jwt_auth.authenticate)]
 
+# pyfacebook only performs blocking requests, they run in a bounded pool of threads
+# It is imported by the views using it, so that importing the routes does not import it
+OAUTH_MAX_THREADS = 4
+oauth_executor = ThreadPoolExecutor(max_workers=OAUTH_MAX_THREADS, thread_name_prefix="instagram_oauth")
+ResultT = typing.TypeVar("ResultT")
+
+
+async def run_oauth(func: typing.Callable[..., ResultT], *args: typing.Any, **kwargs: typing.Any) -> ResultT:
+    """Run a blocking pyfacebook call in the OAuth threads, so that it does not block the event loop."""
+    return await asyncio.get_running_loop().run_in_executor(oauth_executor, functools.partial(func, *args, **kwargs))
+
 
 @router.get("/example/")
 async def example_page(request: Request) -> Response:
     """Display the app example page."""
-    reviews = await ReviewDoc.find_all().to_list()
     return templates.TemplateResponse(
         "example.jinja",
         context={
-            "reviews": RetrieveReview.from_list(reviews),
+            "reviews": await RetrieveReview.find(),
             "request": request,
             "form": {},
         },
@@ -57,11 +70,10 @@ async def example_page_post(request: Request) -> Response:
     form_data = await request.form()
     serializer = CreateReview(**form_data)
     await serializer.create()
-    reviews = await ReviewDoc.find_all().to_list()
     return templates.TemplateResponse(
         "example.jinja",
         context={
-            "reviews": RetrieveReview.from_list(reviews),
+            "reviews": await RetrieveReview.find(),
             "request": request,
             "form": serializer,
         },
@@ -73,18 +85,14 @@ async def home(request: Request, merchant: DependsMerchant) -> Response:
     """Homepage and main navigation."""
     if not merchant.get_is_connected():
         return RedirectResponse(request.url_for("instagram:connect"))
-    return templates.TemplateResponse(
-        "instagram/home.jinja",
-        context={
-            "request": request,
-            "merchant": merchant,
-        },
-    )
+    return page_cache.render(request, "instagram/home.jinja", merchant)
 
 
 @router.get("/connect/")
 async def connect(request: Request, merchant: DependsMerchant) -> Response:
     """Prompt the merchant connect the integration's account."""
+    import pyfacebook  # pylint: disable=import-outside-toplevel
+
     params = {
         "client_id": AppSettings.INSTAGRAM.third_party_public,
         "redirect_uri": request.url_for("instagram:instagram_callback"),
@@ -93,62 +101,31 @@ async def connect(request: Request, merchant: DependsMerchant) -> Response:
         "state": pyfacebook.GraphAPI.STATE,
     }
     redirect_url = "https://www.instagram.com/oauth/authorize/?" + urllib.parse.urlencode(params)
-    return templates.TemplateResponse(
-        "instagram/connect.jinja",
-        context={
-            "request": request,
-            "merchant": merchant,
-            "redirect_url": redirect_url,
-        },
-    )
+    return page_cache.render(request, "instagram/connect.jinja", merchant, redirect_url=redirect_url)
 
 
 @router.get("/status/")
 async def status(request: Request, merchant: DependsMerchant) -> Response:
     """When the account is already connected."""
-    return templates.TemplateResponse(
-        "instagram/status.jinja",
-        context={
-            "request": request,
-            "merchant": merchant,
-        },
-    )
+    return page_cache.render(request, "instagram/status.jinja", merchant)
 
 
 @router.get("/credentials/")
 async def credentials(request: Request, merchant: DependsMerchant) -> Response:
     """Force the merchant to authenticate through Instagram."""
-    return templates.TemplateResponse(
-        "instagram/credentials.jinja",
-        context={
-            "request": request,
-            "merchant": merchant,
-        },
-    )
+    return page_cache.render(request, "instagram/credentials.jinja", merchant)
 
 
 @router.get("/logs/")
 async def logs(request: Request, merchant: DependsMerchant) -> Response:
     """List of merchant."""
-    return templates.TemplateResponse(
-        "instagram/logs.jinja",
-        context={
-            "request": request,
-            "merchant": merchant,
-        },
-    )
+    return page_cache.render(request, "instagram/logs.jinja", merchant)
 
 
 @router.get("/rules/")
 async def rules(request: Request, merchant: DependsMerchant) -> Response:
     """When the merchant want activate the rules."""
-    return templates.TemplateResponse(
-        "instagram/rules.jinja",
-        context={
-            "request": request,
-            "merchant": merchant,
-        },
-    )
+    return page_cache.render(request, "instagram/rules.jinja", merchant)
 
 
 @router.get("/login/")
@@ -197,6 +174,9 @@ async def beans_callback(request: Request, code: str) -> Response:
 @router.get("/instagram-callback/")
 async def instagram_callback(request: Request, merchant: DependsMerchant) -> Response:
     """Exchange oauth code to retrieve access token and identify the merchant."""
+    import oauthlib.oauth2.rfc6749.errors  # pylint: disable=import-outside-toplevel
+    import pyfacebook  # pylint: disable=import-outside-toplevel
+
     # A- Exchange code with access token
     api = pyfacebook.GraphAPI(
         app_id=AppSettings.INSTAGRAM.third_party_public,
@@ -204,7 +184,8 @@ async def instagram_callback(request: Request, merchant: DependsMerchant) -> Res
         oauth_flow=True,
     )
     try:
-        api.exchange_user_access_token(
+        await run_oauth(
+            api.exchange_user_access_token,
             response=str(request.url),
             redirect_uri=request.url_for("instagram:instagram_callback"),
         )
@@ -215,16 +196,24 @@ async def instagram_callback(request: Request, merchant: DependsMerchant) -> Res
         return RedirectResponse(request.url_for("instagram:connect"))
 
     # B- Extend access token validity
-    token_data = api.exchange_long_lived_user_access_token()
+    token_data = await run_oauth(api.exchange_long_lived_user_access_token)
     api.access_token = token_data["access_token"]
 
     # C- Retrieve Instagram user information
-    info = api.get_object("me", fields="id,username")
+    info = await run_oauth(api.get_object, "me", fields="id,username")
 
     # D- Save info to database
-    merchant.instagram_id = info["id"]
-    merchant.instagram_username = info["username"]
-    merchant.instagram_access_token = token_data["access_token"]
-    merchant.instagram_authorized = datetime.utcnow()
-    await merchant.save()
+    # Only the instagram attributes are updated, the authenticated merchant may come from the cache
+    # The fetch schedule is cleared, so that the reviews are fetched by the next run of the cron
+    await merchant.set(
+        {
+            MerchantDoc.instagram_id: info["id"],
+            MerchantDoc.instagram_username: info["username"],
+            MerchantDoc.instagram_access_token: token_data["access_token"],
+            MerchantDoc.instagram_authorized: datetime.utcnow(),
+            MerchantDoc.last_review_fetched: None,
+            MerchantDoc.next_fetch_at: None,
+            MerchantDoc.fetch_interval: None,
+        }
+    )
     return RedirectResponse(request.url_for("instagram:home"))
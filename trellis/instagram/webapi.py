@@ -12,23 +12,79 @@ The API is structured with  Representational state transfer architecture:
 https://en.wikipedia.org/wiki/Representational_state_transfer
 """
 
-from fastapi import APIRouter, status
+import json
+import typing
+
+from beanie import PydanticObjectId
+from fastapi import APIRouter, Query, Response, status
+from fastapi.responses import StreamingResponse
+
+from trellis.xlib.responses import FastJSONRoute
 
 from .models import ReviewDoc
 from .serializers import CreateReview, RetrieveReview
 
-router = APIRouter()
+router = APIRouter(route_class=FastJSONRoute)
+
+REVIEW_PAGE_LIMIT = 100  # default number of reviews returned per page
+REVIEW_PAGE_LIMIT_MAX = 1000  # maximum number of reviews that can be requested per page
+REVIEW_STREAM_BATCH_SIZE = 500  # number of documents pulled from MongoDB per cursor batch when streaming
+
+
+def get_review_filters(
+    after: PydanticObjectId | None = None, merchant: PydanticObjectId | None = None
+) -> list[typing.Any]:
+    """Build the query filters shared by the list and stream endpoints."""
+    filters: list[typing.Any] = []
+    if after:
+        filters.append(ReviewDoc.id > after)
+    if merchant:
+        filters.append(ReviewDoc.merchant.id == merchant)
+    return filters
+
+
+async def iter_reviews_ndjson(filters: list[typing.Any]) -> typing.AsyncGenerator[bytes, None]:
+    """Read reviews from a raw Motor cursor and yield them as NDJSON lines.
+
+    Documents are pulled by batches and released as soon as they are written,
+    so memory usage does not depend on the number of reviews.
+    """
+    async for raw in RetrieveReview.get_cursor(*filters, batch_size=REVIEW_STREAM_BATCH_SIZE):
+        review = RetrieveReview.from_raw(raw)
+        line = {"id": review.id, "reviewer_email": review.reviewer_email, "reviewer_name": review.reviewer_name}
+        yield json.dumps(line).encode() + b"\n"
 
 
 @router.get("/review/", status_code=status.HTTP_200_OK)
-async def api_list_reviews() -> list[RetrieveReview]:
-    """Return a list of reviews in the DB."""
-    review_list = await ReviewDoc.find_all().to_list()
-    return RetrieveReview.from_list(review_list)
+async def api_list_reviews(
+    response: Response,
+    limit: typing.Annotated[int, Query(ge=1, le=REVIEW_PAGE_LIMIT_MAX)] = REVIEW_PAGE_LIMIT,
+    after: PydanticObjectId | None = None,
+    merchant: PydanticObjectId | None = None,
+) -> list[RetrieveReview]:
+    """Return a page of reviews in the DB ordered by id.
+
+    When more reviews are available, the `X-Next-Cursor` header contains the value
+    to send as the `after` parameter to retrieve the next page.
+    """
+    review_list = await RetrieveReview.find(*get_review_filters(after, merchant), limit=limit)
+    if len(review_list) == limit:
+        response.headers["X-Next-Cursor"] = review_list[-1].id
+    return review_list
+
+
+@router.get("/review/stream/", status_code=status.HTTP_200_OK)
+async def api_stream_reviews(
+    after: PydanticObjectId | None = None, merchant: PydanticObjectId | None = None
+) -> StreamingResponse:
+    """Stream all reviews in the DB as newline delimited JSON."""
+    return StreamingResponse(
+        iter_reviews_ndjson(get_review_filters(after, merchant)), media_type="application/x-ndjson"
+    )
 
 
 @router.post("/review/", status_code=status.HTTP_201_CREATED)
 async def api_create_review(serializer: CreateReview) -> RetrieveReview:
     """Create a review and insert in the DB."""
     review: ReviewDoc = await serializer.create()
-    return RetrieveReview(review)
+    return RetrieveReview.from_document(review)
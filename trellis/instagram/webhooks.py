@@ -17,11 +17,16 @@ To receive webhook on your local machine, use a reverse proxy
 https://ngrok.com/
 """
 
-from fastapi import APIRouter, status
+from fastapi import APIRouter, HTTPException, status
 
+from trellis.xlib.ingest import IngestQueue, IngestQueueFull
+from trellis.xlib.responses import FastJSONRoute
+
+from .models import ReviewDoc
 from .serializers import CreateReview
 
-router = APIRouter()
+router = APIRouter(route_class=FastJSONRoute)
+review_queue = IngestQueue(ReviewDoc)
 
 
 @router.post("/review_created/", status_code=status.HTTP_200_OK)
@@ -30,6 +35,11 @@ async def review_created(serializer: CreateReview) -> dict[str, str]:
     Receive webhook data.
 
     Note that event if it is a POST request the webhook always return 200 on success.
+    The review is acknowledged once validated, and inserted in the background by `review_queue`.
+    When the queue is full, the webhook returns 503 so that the sender retries later.
     """
-    await serializer.create()
+    try:
+        await review_queue.put(serializer.to_document())
+    except IngestQueueFull as exc:
+        raise HTTPException(status.HTTP_503_SERVICE_UNAVAILABLE, headers={"Retry-After": "5"}) from exc
     return {"message": "OK"}
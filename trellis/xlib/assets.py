@@ -0,0 +1,194 @@
+"""
+Assets.
+
+Serve the static files with long-lived cache headers, and compressed ahead of time.
+
+On startup of the app, each file of the `static` folder is copied to a build folder twice: under its own name,
+and under a name containing a hash of its content, for example `instagram/logo.3f2a9c4e1b7d6a08.svg`.
+Text files also get brotli and gzip variants. The build is described by a manifest file, so that the next
+startups only read it, unless the static files have changed since. Templates link to the fingerprinted names with
+`static_url()`: as their content never changes, they are served with `Cache-Control: immutable`,
+so that browsers do not revalidate them. `PrecompressedStaticFiles` serves the compressed variant
+accepted by the browser, without compressing anything per request.
+"""
+
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import pathlib
+import re
+import typing
+
+import brotli
+import jinja2
+from starlette.datastructures import URL, Headers
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import NotModifiedResponse, PathLike, StaticFiles
+from starlette.types import Scope
+
+
+class StaticAssets:
+    """Fingerprinted and precompressed copies of the static files."""
+
+    source: pathlib.Path  # folder of the static files
+    target: pathlib.Path  # folder served by `PrecompressedStaticFiles`
+    manifest: dict[str, str]  # fingerprinted path of each static file
+    variants: dict[str, dict[str, tuple[str, os.stat_result]]]  # compressed files of each path, by encoding
+
+    compressed_suffixes: typing.ClassVar[set[str]] = {".css", ".html", ".js", ".json", ".map", ".svg", ".txt", ".xml"}
+    encodings: typing.ClassVar[dict[str, str]] = {"br": ".br", "gzip": ".gz"}  # preferred encodings first
+    manifest_name: typing.ClassVar[str] = ".manifest.json"  # manifest of the last build, in the build folder
+
+    def __init__(self, source: pathlib.Path, target: pathlib.Path) -> None:
+        """Initialize the assets, that are not built yet."""
+        self.source = source
+        self.target = target.resolve()
+        self.manifest = {}
+        self.variants = {}
+
+    def load(self) -> None:
+        """Load the assets of the last build, or build them if the static files have changed since."""
+        if not self.read_manifest():
+            self.build()
+
+    def get_sources(self) -> dict[str, list[int]]:
+        """Return the size and modification time of each static file, to detect changes since the last build."""
+        return {
+            x.relative_to(self.source).as_posix(): [x.stat().st_size, x.stat().st_mtime_ns]
+            for x in sorted(self.source.rglob("*"))
+            if x.is_file()
+        }
+
+    def read_manifest(self) -> bool:
+        """Read the manifest of the last build, and return False if it is missing or outdated."""
+        try:
+            cached = json.loads((self.target / self.manifest_name).read_bytes())
+        except (OSError, ValueError):
+            return False
+        if cached.get("sources") != self.get_sources():
+            return False
+        try:
+            variants = {
+                name: {encoding: self.stat(file) for encoding, file in files.items()}
+                for name, files in cached["variants"].items()
+            }
+        except FileNotFoundError:  # the build folder has been partially cleaned
+            return False
+        self.manifest, self.variants = cached["manifest"], variants
+        return True
+
+    def stat(self, name: str) -> tuple[str, os.stat_result]:
+        """Return the path and the stat of a file of the build folder."""
+        file = self.target / name
+        return str(file), file.stat()
+
+    def build(self) -> None:
+        """Copy, fingerprint and compress all the static files, and write the manifest of the build.
+
+        Files that already exist with the same content are kept, so that workers
+        started at the same time, or restarted, share the same files.
+        """
+        sources = self.get_sources()
+        names: dict[str, dict[str, str]] = {}  # name of the compressed files of each path, by encoding
+        for path in sources:
+            file = self.source / path
+            data = file.read_bytes()
+            digest = hashlib.blake2b(data, digest_size=8).hexdigest()
+            self.manifest[path] = f"{path.removesuffix(file.suffix)}.{digest}{file.suffix}"
+
+            compressed = {}
+            if file.suffix in self.compressed_suffixes:
+                for encoding, suffix in self.encodings.items():
+                    if len(content := self.compress(encoding, data)) < len(data):
+                        compressed[encoding] = (suffix, content)
+
+            for name in [path, self.manifest[path]]:
+                self.write(name, data)
+                names[name] = {}
+                for encoding, (suffix, content) in compressed.items():
+                    self.write(name + suffix, content)
+                    names[name][encoding] = name + suffix
+                self.variants[name] = {x: self.stat(y) for x, y in names[name].items()}
+
+        manifest = {"sources": sources, "manifest": self.manifest, "variants": names}
+        self.write(self.manifest_name, json.dumps(manifest, indent=1, sort_keys=True).encode())
+
+    @staticmethod
+    def compress(encoding: str, data: bytes) -> bytes:
+        """Compress data with the best compression level, as it is done once."""
+        if encoding == "br":
+            content: bytes = brotli.compress(data, quality=11)
+            return content
+        return gzip.compress(data, compresslevel=9, mtime=0)
+
+    def write(self, name: str, data: bytes) -> pathlib.Path:
+        """Write a file to the build folder, unless it already has the same content."""
+        file = self.target / name
+        if file.is_file() and file.read_bytes() == data:
+            return file
+        file.parent.mkdir(parents=True, exist_ok=True)
+        temporary = file.with_name(f"{file.name}.{os.getpid()}.tmp")
+        temporary.write_bytes(data)
+        temporary.replace(file)  # atomic, concurrent readers never see a partial file
+        return file
+
+    def is_fingerprinted(self, path: str) -> bool:
+        """Return True if the path is the fingerprinted name of a static file."""
+        return path in self.variants and path not in self.manifest
+
+    @jinja2.pass_context
+    def url_for(self, context: dict[str, typing.Any], path: str) -> URL:
+        """Return the URL of the fingerprinted static file, to use in templates as `static_url()`."""
+        return context["request"].url_for("static", path=self.manifest.get(path, path))  # type: ignore[no-any-return]
+
+
+class PrecompressedStaticFiles(StaticFiles):
+    """Static files served with their compressed variants and long-lived cache headers."""
+
+    assets: StaticAssets
+
+    immutable: typing.ClassVar[str] = "public, max-age=31536000, immutable"
+
+    def __init__(self, *, assets: StaticAssets, **kwargs: typing.Any) -> None:
+        """Serve the build folder of the assets, that may be built after the app is created."""
+        super().__init__(directory=assets.target, check_dir=False, **kwargs)
+        self.assets = assets
+
+    @staticmethod
+    def get_accepted_encodings(scope: Scope) -> set[str]:
+        """Return the encodings accepted by the client."""
+        accepted = set()
+        for item in Headers(scope=scope).get("accept-encoding", "").split(","):
+            encoding, _, params = item.partition(";")
+            if not re.fullmatch(r"q=0(\.0*)?", params.strip()):
+                accepted.add(encoding.strip().lower())
+        return accepted
+
+    def file_response(
+        self, full_path: PathLike, stat_result: os.stat_result, scope: Scope, status_code: int = 200
+    ) -> Response:
+        """Return the file, or its compressed variant accepted by the client."""
+        path = pathlib.Path(full_path).relative_to(self.assets.target).as_posix()
+        headers = {}
+        if self.assets.is_fingerprinted(path):
+            headers["Cache-Control"] = self.immutable
+        if variants := self.assets.variants.get(path):
+            headers["Vary"] = "Accept-Encoding"
+            accepted = self.get_accepted_encodings(scope)
+            encoding = next((x for x in self.assets.encodings if x in variants and x in accepted), None)
+            if encoding:
+                full_path, stat_result = variants[encoding]
+                headers["Content-Encoding"] = encoding
+
+        response = FileResponse(
+            full_path,
+            status_code=status_code,
+            headers=headers,
+            media_type=mimetypes.guess_type(path)[0],
+            stat_result=stat_result,
+        )
+        if self.is_not_modified(response.headers, Headers(scope=scope)):
+            return NotModifiedResponse(response.headers)
+        return response
@@ -4,13 +4,17 @@ Auth.
 Authenticate the user before they access secure views.
 """
 
+import hashlib
+import time
 import typing
 
+import jwt
 from fastapi import Request
 
 from sap.beanie.exceptions import Object404Error
 from sap.fastapi.auth import JWTAuth
 
+from .cache import merchant_cache
 from .models import BaseMerchantDoc
 
 
@@ -35,9 +39,29 @@ class TrellisJWTAuth(JWTAuth):
         card_address = "xxx"
         return f"trellis_session_{self.user_model.trellis_name}__${card_address}"
 
+    @staticmethod
+    def get_token_hash(jwt_token: str) -> str:
+        """Return the hash of a token, under which the merchant it authenticates is cached."""
+        return hashlib.blake2b(jwt_token.encode(), digest_size=16).hexdigest()
+
     async def find_user(self, jwt_token: str) -> BaseMerchantDoc:
-        """Ensure the authenticated user is active."""
-        merchant: BaseMerchantDoc = await super().find_user(jwt_token=jwt_token)
+        """Ensure the authenticated user is active.
+
+        A token is verified by `JWTAuth.find_user()` the first time it is seen, then the merchant is
+        read from `merchant_cache`, under its id and the hash of the token, until the token expires.
+        """
+        # Not verified, the claims are only used to look up a token verified before it was cached
+        # Raises: jwt.exceptions.DecodeError => Token is malformed
+        claims = jwt.decode(jwt_token, options={"verify_signature": False})
+        token_hash = self.get_token_hash(jwt_token)
+        merchant = None
+        if "user_id" in claims and claims.get("exp", 0) > time.time():
+            merchant = await merchant_cache.get(self.user_model, claims["user_id"], token_hash)
+        if merchant is None:
+            # Raises: jwt.exceptions.InvalidTokenError => Token has expired or is invalid
+            # Raises: Object404Error => User cannot be found
+            merchant = typing.cast(BaseMerchantDoc, await super().find_user(jwt_token=jwt_token))
+            await merchant_cache.set(merchant, token_hash)
         try:
             assert merchant.beans_access_token
         except AssertionError as exc:
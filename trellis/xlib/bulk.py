@@ -0,0 +1,159 @@
+"""
+Bulk.
+
+Write documents to MongoDB by batches instead of one round trip per document.
+"""
+
+import asyncio
+import time
+import typing
+from dataclasses import dataclass
+
+import beanie
+from beanie.odm.utils.dump import get_dict
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, PyMongoError
+
+from AppMain.settings import logger
+
+
+@dataclass
+class BulkUpsertResult:
+    """Count the documents written by a `BulkUpsertWriter`."""
+
+    inserted: int = 0  # documents that did not exist yet
+    updated: int = 0  # documents that existed and have been modified
+    unchanged: int = 0  # documents that existed with the same values
+    failed: int = 0  # documents skipped by the writer's caller, ex: invalid data
+
+    def merge(self, other: "BulkUpsertResult") -> None:
+        """Add the counts of another result to this one."""
+        self.inserted += other.inserted
+        self.updated += other.updated
+        self.unchanged += other.unchanged
+        self.failed += other.failed
+
+
+class BulkUpsertWriter:  # pylint: disable=too-many-instance-attributes
+    """Buffer document upserts and send them as unordered `bulk_write` requests.
+
+    Documents are matched on the `key` field. When a document already exists, only
+    the `fields` are updated, otherwise the whole document is inserted.
+    The buffer is flushed when it reaches `batch_size` documents, by a timer every `flush_interval`
+    seconds while the context manager is active, and when leaving the context manager.
+    Documents that could not be written stay pending, and `flush()` raises, so that the caller
+    does not checkpoint past them.
+    """
+
+    document_model: type[beanie.Document]
+    key: str
+    fields: list[str]
+    batch_size: int
+    flush_interval: float
+    result: BulkUpsertResult
+    operations: dict[typing.Any, UpdateOne]
+    flushed_at: float
+    lock: asyncio.Lock  # a single bulk request at a time
+    timer: asyncio.Task[None] | None
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        document_model: type[beanie.Document],
+        *,
+        key: str,
+        fields: list[str],
+        batch_size: int = 500,
+        flush_interval: float = 5,
+    ) -> None:
+        """Initialize an empty buffer."""
+        self.document_model = document_model
+        self.key = key
+        self.fields = fields
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.result = BulkUpsertResult()
+        self.operations = {}
+        self.flushed_at = time.monotonic()
+        self.lock = asyncio.Lock()
+        self.timer = None
+
+    async def __aenter__(self) -> typing.Self:
+        """Start buffering, and flushing the buffer periodically."""
+        self.timer = asyncio.create_task(self.run_timer())
+        return self
+
+    async def __aexit__(self, *args: typing.Any) -> None:
+        """Stop the timer, and write the remaining documents."""
+        if self.timer is not None:
+            self.timer.cancel()
+            await asyncio.gather(self.timer, return_exceptions=True)
+            self.timer = None
+        await self.flush()
+
+    async def run_timer(self) -> None:
+        """Flush the buffer once it is older than `flush_interval`, even when no document is added, until cancelled."""
+        while True:  # pylint: disable=while-used
+            await asyncio.sleep(max(self.flushed_at + self.flush_interval - time.monotonic(), 0))
+            if time.monotonic() - self.flushed_at < self.flush_interval:
+                continue
+            try:
+                await self.flush()
+            except PyMongoError:
+                # Documents stay pending, the error is raised again by the next flush of the caller
+                logger.warning("Periodic flush of %d documents failed", self.pending)
+
+    @property
+    def pending(self) -> int:
+        """Return the number of documents waiting to be written."""
+        return len(self.operations)
+
+    async def add(self, document: beanie.Document) -> None:
+        """Buffer the upsert of a document, and flush the buffer if it is full or too old."""
+        data = get_dict(document, to_db=True)
+        values = {x: data.pop(x) for x in self.fields}
+        # A document added twice before a flush is only written once, with its latest values
+        self.operations[data[self.key]] = UpdateOne(
+            {self.key: data.pop(self.key)}, {"$set": values, "$setOnInsert": data}, upsert=True
+        )
+        if self.pending >= self.batch_size or time.monotonic() - self.flushed_at >= self.flush_interval:
+            await self.flush()
+
+    async def flush(self) -> None:
+        """Write all buffered documents in a single unordered bulk request.
+
+        Documents added while the request is sent are kept for the next flush.
+        Documents that failed are kept pending and the `BulkWriteError` is raised.
+        """
+        async with self.lock:
+            self.flushed_at = time.monotonic()
+            if not self.operations:
+                return
+            operations = list(self.operations.items())
+            await self.write(operations)
+
+    async def write(self, operations: list[tuple[typing.Any, UpdateOne]]) -> None:
+        """Send a bulk request, and remove the operations written from the buffer."""
+        collection = self.document_model.get_motor_collection()
+        failed: set[int] = set()  # indexes of the operations that failed
+        error: BulkWriteError | None = None
+        try:
+            response = await collection.bulk_write([x for _, x in operations], ordered=False)
+        except BulkWriteError as exc:
+            # Other operations of an unordered bulk are still applied when one of them fails,
+            # for example when a concurrent writer inserts the same key first.
+            logger.warning("Bulk upsert failed for %d documents, kept pending", len(exc.details["writeErrors"]))
+            failed, error = {x["index"] for x in exc.details["writeErrors"]}, exc
+            details = exc.details
+        else:
+            details = response.bulk_api_result
+
+        # Only removed once written, documents stay pending when the request could not be sent,
+        # and documents replaced by a newer version during the request are kept
+        for index, (key, operation) in enumerate(operations):
+            if index not in failed and self.operations.get(key) is operation:
+                del self.operations[key]
+        self.result.inserted += details["nUpserted"]
+        self.result.updated += details["nModified"]
+        self.result.unchanged += details["nMatched"] - details["nModified"]
+        if error is not None:
+            raise error
@@ -0,0 +1,185 @@
+"""
+Cache.
+
+Cache the merchants authenticated by `TrellisJWTAuth`, so that navigating between
+pages does not cost a MongoDB round trip per page.
+
+Entries are keyed by document id and by a variant, ex: the hash of the token the merchant
+was authenticated with. Entries are invalidated by `BaseMerchantDoc` each time a merchant
+is saved, updated or deleted, which removes all the variants of the merchant.
+
+Merchants are kept in a TTL-bounded LRU of the process. When `REDIS_URL` is set, Redis is used
+instead, shared by all workers, so that an invalidation applies to all of them at once.
+Without Redis, the other workers keep serving their entries until they expire, so `REDIS_URL`
+should be set when the app runs several workers. The Redis client is imported on first use.
+
+Documents written without beanie events, ex: raw collection updates, are invalidated by their writer.
+"""
+
+import asyncio
+import collections
+import time
+import typing
+import weakref
+from dataclasses import asdict, dataclass
+
+import beanie
+import bson
+from beanie.odm.utils.dump import get_dict
+
+from AppMain.settings import AppSettings, logger
+
+if typing.TYPE_CHECKING:
+    import redis.asyncio
+
+DocT = typing.TypeVar("DocT", bound=beanie.Document)
+
+
+@dataclass
+class CacheStats:
+    """Hit and miss counters of a `DocumentCache`."""
+
+    hits: int = 0  # documents found in the process tier
+    redis_hits: int = 0  # documents found in the Redis tier
+    misses: int = 0  # documents that had to be fetched from the DB
+
+
+class DocumentCache:  # pylint: disable=too-many-instance-attributes
+    """TTL-bounded LRU of documents, or Redis hashes of documents when Redis is configured.
+
+    Documents are stored as BSON, so that each hit returns a new instance
+    that can be modified without altering the cache.
+    """
+
+    name: str
+    maxsize: int
+    ttl: float  # seconds after which an entry of the process tier expires
+    redis_ttl: int  # seconds after which the entries of a document in Redis expire
+    redis_url: str | None
+    entries: collections.OrderedDict[tuple[str, str], tuple[float, bytes]]  # (key, variant): (expires, data)
+    variants: dict[str, typing.MutableSet[str]]  # variants of each key in the process tier
+    redis_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, redis.asyncio.Redis[bytes]]"
+    stats: CacheStats
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self, name: str, *, maxsize: int = 1024, ttl: float = 30, redis_ttl: int = 300, redis_url: str | None = None
+    ) -> None:
+        """Initialize an empty cache."""
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.redis_ttl = redis_ttl
+        self.redis_url = redis_url
+        self.entries = collections.OrderedDict()
+        self.variants = {}
+        self.redis_clients = weakref.WeakKeyDictionary()
+        self.stats = CacheStats()
+
+    def get_key(self, document_id: typing.Any) -> str:
+        """Return the key of a document."""
+        return f"{AppSettings.PROJ_NAME}:{self.name}:{document_id}"
+
+    def get_redis(self) -> "redis.asyncio.Redis[bytes] | None":
+        """Return the Redis client of the running loop, if a Redis tier is configured."""
+        if not self.redis_url:
+            return None
+        loop = asyncio.get_running_loop()
+        if loop not in self.redis_clients:
+            import redis.asyncio  # pylint: disable=import-outside-toplevel
+
+            self.redis_clients[loop] = redis.asyncio.Redis.from_url(self.redis_url)
+        return self.redis_clients[loop]
+
+    @property
+    def redis_error(self) -> type[Exception]:
+        """Return the base error of the Redis client, only evaluated by `except` clauses when an error is raised."""
+        import redis.exceptions  # pylint: disable=import-outside-toplevel
+
+        return redis.exceptions.RedisError
+
+    def get_stats(self) -> dict[str, int]:
+        """Return the number of entries of the process tier, and the hit and miss counters."""
+        return {"size": len(self.entries), **asdict(self.stats)}
+
+    async def get(self, document_model: type[DocT], document_id: typing.Any, variant: str = "") -> DocT | None:
+        """Return a cached document, or None when it has to be fetched from the DB."""
+        key = self.get_key(document_id)
+        client = self.get_redis()
+        data = await self.get_redis_entry(client, key, variant) if client else self.get_entry(key, variant)
+        if data is None:
+            self.stats.misses += 1
+            return None
+        return self.load(document_model, data)
+
+    def get_entry(self, key: str, variant: str) -> bytes | None:
+        """Return an entry of the process tier, unless it has expired."""
+        if (key, variant) not in self.entries:
+            return None
+        expires, data = self.entries[(key, variant)]
+        if expires <= time.monotonic():
+            self.discard(key, variant)
+            return None
+        self.entries.move_to_end((key, variant))
+        self.stats.hits += 1
+        return data
+
+    async def get_redis_entry(self, client: "redis.asyncio.Redis[bytes]", key: str, variant: str) -> bytes | None:
+        """Return an entry of the Redis tier, or None when Redis is unavailable."""
+        try:
+            data = await client.hget(key, variant)
+        except self.redis_error as exc:
+            logger.warning("Unable to read %s from Redis cache: %s", key, exc)
+            return None
+        if data:
+            self.stats.redis_hits += 1
+        return data or None
+
+    async def set(self, document: beanie.Document, variant: str = "") -> None:
+        """Cache a document fetched from the DB."""
+        key = self.get_key(document.id)
+        data = bson.encode(get_dict(document, to_db=True))
+        if client := self.get_redis():
+            try:
+                await client.pipeline(transaction=False).hset(key, variant, data).expire(key, self.redis_ttl).execute()
+            except self.redis_error as exc:
+                logger.warning("Unable to write %s to Redis cache: %s", key, exc)
+            return
+
+        self.entries[(key, variant)] = (time.monotonic() + self.ttl, data)
+        self.entries.move_to_end((key, variant))
+        self.variants.setdefault(key, set()).add(variant)
+        if len(self.entries) > self.maxsize:
+            self.discard(*next(iter(self.entries)))
+
+    @staticmethod
+    def load(document_model: type[DocT], data: bytes) -> DocT:
+        """Build a new document instance from a cached entry."""
+        document: DocT = document_model.model_validate(bson.decode(data))
+        return document
+
+    def discard(self, key: str, variant: str) -> None:
+        """Remove an entry from the process tier."""
+        self.entries.pop((key, variant), None)
+        if variants := self.variants.get(key):
+            variants.discard(variant)
+            if not variants:
+                del self.variants[key]
+
+    async def invalidate(self, *document_ids: typing.Any) -> None:
+        """Remove all the variants of documents."""
+        keys = [self.get_key(x) for x in document_ids]
+        if not keys:
+            return
+        if client := self.get_redis():
+            try:
+                await client.delete(*keys)
+            except self.redis_error as exc:
+                logger.warning("Unable to invalidate %s in Redis cache: %s", keys, exc)
+            return
+
+        for key in keys:
+            for variant in self.variants.pop(key, set()):
+                self.entries.pop((key, variant), None)
+
+
+merchant_cache = DocumentCache("merchant", redis_url=AppSettings.REDIS_URL)
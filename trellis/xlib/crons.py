@@ -6,31 +6,250 @@ These tasks can run even while the user is not online,
 not making any active HTTP requests, or not using the application.
 """
 
+import asyncio
+import random
+import statistics
+import time
+import typing
+from dataclasses import dataclass, field
+from datetime import UTC, datetime
 from typing import Any, ClassVar, Optional
 
+import beanie
+from beanie.odm.queries.find import FindMany
+
 from sap.worker.crons import CronResponse, CronStat, CronStorage, CronTask, TestStorage
 
 from AppMain.asgi import initialize_beanie
+from AppMain.settings import AppSettings
+
+from .metrics import task_duration
+from .rest import HttpPool
+
+ItemT = typing.TypeVar("ItemT")
+DocT = typing.TypeVar("DocT", bound=beanie.Document)
+LATENCY_SAMPLES = 1000  # latencies kept to compute the percentiles, whatever the number of items processed
+DAY_MS = 24 * 60 * 60 * 1000
+
+
+@dataclass
+class ProcessStats:
+    """Counters collected while processing items concurrently."""
+
+    processed: int = 0  # number of items processed successfully
+    failed: int = 0  # number of items that raised an exception
+    timed_out: int = 0  # number of items cancelled after exceeding the timeout
+    total: int = 0  # sum of the values returned for each item processed
+    duration: float = 0.0  # duration of the whole run in seconds
+    latencies: list[float] = field(default_factory=list)  # sample of the durations in seconds of the items processed
+    latency_max: float = 0.0
+
+    def add_latency(self, latency: float) -> None:
+        """Record the duration of an item processed, keeping a uniform sample of `LATENCY_SAMPLES` durations."""
+        self.latency_max = max(self.latency_max, latency)
+        if len(self.latencies) < LATENCY_SAMPLES:
+            self.latencies.append(latency)
+            return
+        index = random.randrange(self.processed)  # reservoir sampling
+        if index < LATENCY_SAMPLES:
+            self.latencies[index] = latency
+
+    def get_counters(self, item_name: str) -> dict[str, int]:
+        """Return throughput and latency counters, using `item_name` to name the item counters."""
+        latencies = sorted(self.latencies) or [0.0]
+        return {
+            f"{item_name}_failed": self.failed,
+            f"{item_name}_timed_out": self.timed_out,
+            f"{item_name}_per_minute": int(self.processed * 60 / self.duration) if self.duration else 0,
+            "duration_ms": int(self.duration * 1000),
+            "latency_p50_ms": int(statistics.median(latencies) * 1000),
+            "latency_p95_ms": int(latencies[int(0.95 * (len(latencies) - 1))] * 1000),
+            "latency_max_ms": int(self.latency_max * 1000),
+        }
 
 
 class TrellisCronTask(CronTask):
     """Subclass CronTask. Run results and stats are store on airtable."""
 
     storage_class: ClassVar[type[CronStorage]] = TestStorage
+    concurrency: ClassVar[int] = 10  # maximum number of items processed at the same time
+    item_timeout: ClassVar[float] = 120  # seconds after which processing a single item is cancelled
+    cursor_batch_size: ClassVar[int] = 100  # documents fetched per round trip when streaming a queryset
+    lease_duration: ClassVar[float] = 300  # seconds an item claimed by a worker is reserved, renewed while processed
+    stats_ttl: ClassVar[float] = AppSettings.CRON_STATS_TTL  # seconds the stats are cached, 0 to disable
+    stats_cache: ClassVar[dict[str, tuple[float, list[CronStat]]]] = {}  # expiry and stats, by task name
+    use_stats_cache: bool = True  # disabled for the stats recorded at the end of a run
 
     def get_queryset(self, *, batch_size: Optional[int] = None, **kwargs: Any) -> Any:
         """Fetch the list of elements to process."""
         raise NotImplementedError
 
     async def handle_process(self, *args: Any, **kwargs: Any) -> CronResponse:
-        """Initialize Beanie and run the task."""
-        await initialize_beanie()
-        return await super().handle_process(*args, **kwargs)
+        """Initialize Beanie and run the task with the shared HTTP pool open, recording its duration.
+
+        The stats recorded after the run are computed again, not taken from the cache.
+        """
+        self.use_stats_cache = False
+        with task_duration.time(self.name):
+            await initialize_beanie()
+            async with HttpPool.lifespan():
+                return await super().handle_process(*args, **kwargs)
 
     async def process(self, *, batch_size: int = 100, **kwargs: Any) -> Any:
         """Run the cron task and process elements."""
         raise NotImplementedError
 
     async def get_stats(self) -> list[CronStat]:
-        """Give stats about the number of elements left to process."""
+        """Give stats about the number of elements left to process, cached for `stats_ttl` seconds."""
+        expires, stats = self.stats_cache.get(self.name, (0.0, []))
+        if self.use_stats_cache and expires > time.monotonic():
+            return stats
+        stats = await self.compute_stats()
+        if self.stats_ttl:
+            self.stats_cache[self.name] = (time.monotonic() + self.stats_ttl, stats)
+        return stats
+
+    async def compute_stats(self) -> list[CronStat]:
+        """Compute stats about the number of elements left to process, see `aggregate_stats()`."""
         raise NotImplementedError
+
+    @staticmethod
+    async def aggregate_stats(
+        queryset: FindMany[Any],
+        counts: dict[str, typing.Mapping[str, Any]],
+        ages: dict[str, tuple[str, list[int]]] | None = None,
+        now: datetime | None = None,
+    ) -> list[CronStat]:
+        """Compute the stats of the documents of a queryset in a single `$facet` aggregation.
+
+        :counts: the number of documents matching each filter, ex: {"merchants_new": MerchantDoc.x == None}
+        :ages: a histogram of the age of a date field, with the lower bounds of its buckets in days,
+            ex: {"staleness": ("last_review_fetched", [0, 1, 7])} counts the documents with a date
+            in the last day as "staleness_0_1d", then "staleness_1_7d" and "staleness_7d_plus".
+            Documents without a date are not counted.
+        """
+        now = now or datetime.now(UTC)
+        facets: dict[str, list[dict[str, Any]]] = {
+            name: [{"$match": query}, {"$count": "count"}] for name, query in counts.items()
+        }
+        labels: dict[str, dict[Any, str]] = {}
+        for name, (field_name, boundaries) in (ages or {}).items():
+            labels[name] = {x * DAY_MS: f"{name}_{x}_{y}d" for x, y in zip(boundaries, boundaries[1:])}
+            labels[name]["plus"] = f"{name}_{boundaries[-1]}d_plus"
+            age = {"$max": [0, {"$subtract": [now, f"${field_name}"]}]}  # in milliseconds, dates in the future are new
+            facets[name] = [
+                {"$match": {field_name: {"$ne": None}}},
+                {
+                    "$bucket": {
+                        "groupBy": age,
+                        "boundaries": [x * DAY_MS for x in boundaries],
+                        "default": "plus",
+                        "output": {"count": {"$sum": 1}},
+                    }
+                },
+            ]
+
+        results = await queryset.aggregate([{"$facet": facets}]).to_list()
+        rows: dict[str, list[dict[str, Any]]] = results[0] if results else {}
+        stats = [CronStat(name=name, value=rows[name][0]["count"] if rows.get(name) else 0) for name in counts]
+        for name, bucket_labels in labels.items():
+            bucket_counts = {x["_id"]: x["count"] for x in rows.get(name, [])}
+            stats.extend(CronStat(name=label, value=bucket_counts.get(key, 0)) for key, label in bucket_labels.items())
+        return stats
+
+    async def stream(self, queryset: FindMany[DocT], *, batch_size: Optional[int] = None) -> typing.AsyncIterator[DocT]:
+        """Iterate the documents of a queryset lazily, fetching `cursor_batch_size` documents per round trip.
+
+        Unlike `to_list()`, a single batch of documents is held in memory whatever the limit of the queryset.
+        Use it with `process_concurrently()`, whose workers checkpoint the progress of each document,
+        ex: by stamping a field excluded by the queryset, so that the next run resumes an interrupted one.
+        """
+        queryset.pymongo_kwargs["batch_size"] = batch_size or self.cursor_batch_size
+        async for document in queryset:
+            yield document
+
+    async def process_concurrently(  # pylint: disable=too-many-arguments
+        self,
+        items: typing.Iterable[ItemT] | typing.AsyncIterable[ItemT],
+        worker: typing.Callable[[ItemT], typing.Awaitable[int]],
+        *,
+        concurrency: Optional[int] = None,
+        item_timeout: Optional[float] = None,
+        checkpoint: typing.Callable[[ItemT], typing.Awaitable[None]] | None = None,
+    ) -> ProcessStats:
+        """Run `worker` on each item with bounded concurrency.
+
+        A slow or failing item does not hold up nor abort the others:
+        it is cancelled after `item_timeout` seconds, or logged and counted as failed.
+        `checkpoint` is called after each item processed successfully, within the same timeout.
+        Items are pulled from an async iterable when a slot is free, and the memory used
+        does not grow with the number of items.
+        """
+        semaphore = asyncio.Semaphore(concurrency or self.concurrency)
+        item_timeout = item_timeout or self.item_timeout
+        iterator = items if isinstance(items, typing.AsyncIterable) else aiter_sync(items)
+        stats = ProcessStats()
+        tasks: set[asyncio.Task[None]] = set()
+
+        async def run(item: ItemT) -> int:
+            value = await worker(item)
+            if checkpoint is not None:
+                await checkpoint(item)
+            return value
+
+        async def consume(item: ItemT) -> None:
+            start = time.perf_counter()
+            try:
+                value = await asyncio.wait_for(run(item), timeout=item_timeout)
+            except asyncio.TimeoutError:
+                self.logger.warning("Processing timed out after %ss item=%s", item_timeout, item)
+                stats.timed_out += 1
+            except Exception as exc:  # pylint: disable=broad-except
+                self.logger.exception("Processing failed item=%s: %s", item, exc)
+                stats.failed += 1
+            else:
+                stats.total += value
+                stats.processed += 1
+                stats.add_latency(time.perf_counter() - start)
+            finally:
+                semaphore.release()
+
+        async def feed() -> None:
+            # The next item is only pulled once a slot is free, ex: a lease is only claimed when it can be processed
+            async for item in aiter_slots(iterator, semaphore):
+                task = asyncio.create_task(consume(item))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            await asyncio.gather(*tasks)
+
+        start_run = time.perf_counter()
+        try:
+            await feed()
+        finally:
+            # An interrupted run does not leave items running without checkpoint
+            for task in list(tasks):
+                task.cancel()
+        stats.duration = time.perf_counter() - start_run
+        return stats
+
+
+async def aiter_sync(items: typing.Iterable[ItemT]) -> typing.AsyncIterator[ItemT]:
+    """Wrap a regular iterable into an async iterator."""
+    for item in items:
+        yield item
+
+
+async def aiter_slots(items: typing.AsyncIterable[ItemT], semaphore: asyncio.Semaphore) -> typing.AsyncIterator[ItemT]:
+    """Yield the items of an async iterable, pulling each one after acquiring a slot of the semaphore.
+
+    The slot is released by the consumer of the item, or here when there is no item left.
+    """
+    iterator = aiter(items)
+    while True:  # pylint: disable=while-used
+        await semaphore.acquire()
+        try:
+            item = await anext(iterator)
+        except StopAsyncIteration:
+            semaphore.release()
+            return
+        yield item
@@ -0,0 +1,128 @@
+"""
+Database.
+
+Initialize Beanie once per process.
+
+`BeanieClient.init` pings MongoDB on each call, and opens a new connection and
+re-creates the indexes when the ping fails. It used to run before each request,
+lambda and cron execution. The guard below only initializes Beanie on the first call
+of each process, and reuses the indexes created by the parent in forked workers.
+The connection is still checked with a ping once per event loop, i.e. once per lambda
+or cron execution, and a new connection is opened, without the indexes, when it fails.
+
+The clients are opened by the guard, with the MongoDB `listeners` of the app, so that the
+profiling and readiness listeners only observe the commands and connections of the app.
+"""
+
+import asyncio
+import os
+import typing
+import weakref
+
+import beanie
+import pymongo.errors
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
+from pymongo import monitoring
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from sap.beanie.client import BeanieClient, MongoConnection
+from sap.settings import DatabaseParams
+
+from AppMain.settings import logger
+
+
+class BeanieGuard:
+    """Process-wide and fork-aware Beanie initialization."""
+
+    pid: typing.ClassVar[int | None] = None  # process in which Beanie has been initialized
+    indexed: typing.ClassVar[bool] = False  # if the indexes exist, created by this process or its parent
+    locks: typing.ClassVar[weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Lock]] = (
+        weakref.WeakKeyDictionary()
+    )
+    checked: typing.ClassVar[weakref.WeakSet[asyncio.AbstractEventLoop]] = weakref.WeakSet()  # loops pinged
+    listeners: typing.ClassVar[list[monitoring.CommandListener | monitoring.ConnectionPoolListener]] = []
+
+    @classmethod
+    def get_lock(cls) -> asyncio.Lock:
+        """Return a lock for the running loop, preventing concurrent initializations."""
+        loop = asyncio.get_running_loop()
+        lock = cls.locks.get(loop)
+        if lock is None:
+            lock = cls.locks[loop] = asyncio.Lock()
+        return lock
+
+    @classmethod
+    async def init(
+        cls, mongo_params: DatabaseParams, document_models: list[type[beanie.Document]], force: bool = False
+    ) -> None:
+        """Initialize Beanie if it has not been initialized yet in the current process.
+
+        :force bool: Use it to force a full initialization, including the indexes
+        """
+        loop = asyncio.get_running_loop()
+        if cls.pid == os.getpid() and loop in cls.checked and not force:
+            return
+
+        async with cls.get_lock():
+            forked = cls.pid != os.getpid()
+            if force or (forked and not cls.indexed):
+                database = cls.open(mongo_params)
+                await beanie.init_beanie(database, document_models=document_models, allow_index_dropping=True)  # type: ignore
+                cls.indexed = True
+            elif forked or (loop not in cls.checked and not await cls.ping()):
+                # Connections of the parent process can not be used after a fork, nor a lost connection
+                cls.connect(mongo_params, document_models)
+            cls.pid = os.getpid()
+            cls.checked.add(loop)
+
+    @classmethod
+    async def ping(cls) -> bool:
+        """Return whether the current connection answers."""
+        try:
+            await BeanieClient.connections["default"].database.command("ping")
+        except pymongo.errors.ConnectionFailure:
+            logger.warning("MongoDB connection lost, opening a new one")
+            return False
+        return True
+
+    @classmethod
+    def open(cls, mongo_params: DatabaseParams) -> AsyncIOMotorDatabase:
+        """Open a new connection, used as the default connection of `BeanieClient`."""
+        client: AsyncIOMotorClient = AsyncIOMotorClient(mongo_params.get_dns(), event_listeners=cls.listeners)
+        client.get_io_loop = asyncio.get_running_loop  # type: ignore
+        database: AsyncIOMotorDatabase = client[mongo_params.db]
+        BeanieClient.connections["default"] = MongoConnection(client=client, database=database)
+        return database
+
+    @classmethod
+    def connect(cls, mongo_params: DatabaseParams, document_models: list[type[beanie.Document]]) -> None:
+        """Open a new connection and bind the documents initialized by the parent process to it."""
+        database = cls.open(mongo_params)
+        for document_model in document_models:
+            document_model.set_database(database)
+            document_model.set_collection(database[document_model.get_collection_name()])
+
+
+class InitBeanieMiddleware:
+    """Middleware ensuring that Beanie is initialized before handling a request.
+
+    Beanie is initialized by the app lifespan, so this is a cheap check
+    unless the app is served without running its lifespan.
+    """
+
+    app: ASGIApp
+    mongo_params: DatabaseParams
+    document_models: list[type[beanie.Document]]
+
+    def __init__(
+        self, app: ASGIApp, mongo_params: DatabaseParams, document_models: list[type[beanie.Document]]
+    ) -> None:
+        """Initialize Middleware."""
+        self.app = app
+        self.mongo_params = mongo_params
+        self.document_models = document_models
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        """Run Middleware."""
+        await BeanieGuard.init(mongo_params=self.mongo_params, document_models=self.document_models)
+        await self.app(scope, receive, send)
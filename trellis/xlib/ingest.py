@@ -0,0 +1,177 @@
+"""
+Ingest.
+
+Acknowledge incoming events as soon as they are validated, and write them to the DB
+by batches in the background.
+
+Documents are put on a bounded in-process queue, drained by a consumer task using
+unordered `insert_many` requests. When the queue is full, producers wait for a short
+time and are then rejected, so that the sender can retry later. Queues are started and
+drained by `IngestQueue.lifespan()`, that wraps the FastAPI app lifespan. Queues created
+while it is running are started immediately.
+
+Queued documents have been acknowledged to their sender, so a batch is retried while
+the DB is unavailable, and the queue fills up until producers are rejected.
+"""
+
+import asyncio
+import typing
+from contextlib import asynccontextmanager
+
+import beanie
+from beanie import PydanticObjectId
+from pymongo.errors import BulkWriteError, PyMongoError
+
+from AppMain.settings import logger
+
+
+class IngestQueueFull(Exception):
+    """The queue has been full for longer than the producer accepts to wait."""
+
+
+class IngestQueue:  # pylint: disable=too-many-instance-attributes
+    """Bounded queue of documents inserted by batches."""
+
+    instances: typing.ClassVar[list["IngestQueue"]] = []  # queues started by `lifespan()`
+    users: typing.ClassVar[int] = 0  # number of active lifespans
+
+    document_model: type[beanie.Document]
+    maxsize: int  # maximum number of documents waiting to be inserted
+    batch_size: int  # maximum number of documents inserted in a single request
+    put_timeout: float  # seconds a producer waits for a free slot before being rejected
+    drain_timeout: float  # seconds given to the consumer to insert the remaining documents on shutdown
+    retry_delay: float  # seconds before retrying a batch, doubled on each attempt up to `retry_max_delay`
+    retry_max_delay: float
+    queue: asyncio.Queue[beanie.Document] | None
+    consumer: asyncio.Task[None] | None
+    inserted: int  # documents inserted by the consumer
+    rejected: int  # documents rejected because the queue was full
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        document_model: type[beanie.Document],
+        *,
+        maxsize: int = 10_000,
+        batch_size: int = 500,
+        put_timeout: float = 1,
+        drain_timeout: float = 10,
+        retry_delay: float = 0.5,
+        retry_max_delay: float = 10,
+    ) -> None:
+        """Initialize a stopped queue."""
+        self.document_model = document_model
+        self.maxsize = maxsize
+        self.batch_size = batch_size
+        self.put_timeout = put_timeout
+        self.drain_timeout = drain_timeout
+        self.retry_delay = retry_delay
+        self.retry_max_delay = retry_max_delay
+        self.queue = None
+        self.consumer = None
+        self.inserted = self.rejected = 0
+        self.instances.append(self)
+        if self.users:
+            # Queues of a lazily mounted trellis are created while the lifespan is running
+            self.start()
+
+    @property
+    def is_running(self) -> bool:
+        """Return True if the consumer is running in the current loop."""
+        return (
+            self.consumer is not None
+            and not self.consumer.done()
+            and self.consumer.get_loop() is asyncio.get_running_loop()
+        )
+
+    async def put(self, document: beanie.Document) -> None:
+        """Queue a document, waiting for a free slot if the queue is full.
+
+        Documents are inserted directly when the queue is not running, for example in a worker task.
+        """
+        if not self.is_running:
+            await document.insert()
+            return
+
+        assert self.queue
+        try:
+            await asyncio.wait_for(self.queue.put(document), timeout=self.put_timeout)
+        except asyncio.TimeoutError as exc:
+            self.rejected += 1
+            raise IngestQueueFull(f"{self.document_model.__name__} ingest queue is full") from exc
+
+    async def consume(self) -> None:
+        """Insert queued documents by batches, until the consumer is cancelled."""
+        assert self.queue
+        while True:  # pylint: disable=while-used
+            batch = [await self.queue.get()]
+            # Documents queued meanwhile are inserted in the same batch
+            batch.extend(self.queue.get_nowait() for _ in range(min(self.queue.qsize(), self.batch_size - 1)))
+            await self.insert(batch)
+            for _ in batch:
+                self.queue.task_done()
+
+    async def insert(self, batch: list[beanie.Document]) -> None:
+        """Insert a batch of documents, retrying it while the DB is unavailable."""
+        for document in batch:
+            # Ids are set before the first attempt, so that a retry does not insert a document twice
+            document.id = document.id or PydanticObjectId()
+        delay = self.retry_delay
+        while True:  # pylint: disable=while-used
+            try:
+                await self.document_model.insert_many(batch, ordered=False)
+            except BulkWriteError as exc:
+                self.insert_failed(batch, exc)
+                return
+            except PyMongoError as exc:
+                logger.warning("Ingest failed for a batch of %d documents, retry in %.1f s: %s", len(batch), delay, exc)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.retry_max_delay)
+            except Exception as exc:  # pylint: disable=broad-except
+                # Not a DB failure, a retry would fail the same way, the consumer keeps running
+                logger.exception("Ingest failed for a batch of %d documents: %s", len(batch), exc)
+                return
+            else:
+                self.inserted += len(batch)
+                return
+
+    def insert_failed(self, batch: list[beanie.Document], exc: BulkWriteError) -> None:
+        """Count the documents of a batch inserted despite write errors, and log the others.
+
+        Other documents of an unordered insert are still inserted when one of them fails.
+        Duplicate ids come from a previous attempt that inserted the document before failing.
+        """
+        errors = [x for x in exc.details["writeErrors"] if x.get("keyPattern") != {"_id": 1}]
+        if errors:
+            logger.error("Ingest failed for %d documents: %s", len(errors), errors[0].get("errmsg"))
+        self.inserted += len(batch) - len(errors)
+
+    def start(self) -> None:
+        """Start the consumer in the running loop."""
+        self.queue = asyncio.Queue(maxsize=self.maxsize)
+        self.consumer = asyncio.create_task(self.consume())
+
+    async def stop(self) -> None:
+        """Wait for the queued documents to be inserted and stop the consumer."""
+        assert self.queue and self.consumer
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout=self.drain_timeout)
+        except asyncio.TimeoutError:
+            logger.error("Ingest queue stopped with %d documents left", self.queue.qsize())
+        self.consumer.cancel()
+        await asyncio.gather(self.consumer, return_exceptions=True)
+        self.consumer = None
+
+    @classmethod
+    @asynccontextmanager
+    async def lifespan(cls) -> typing.AsyncGenerator[None, None]:
+        """Run the consumers of all queues while the context is active, and drain them on exit."""
+        cls.users += 1
+        if cls.users == 1:
+            for instance in cls.instances:
+                instance.start()
+        try:
+            yield
+        finally:
+            cls.users -= 1
+            if cls.users == 0:
+                await asyncio.gather(*[x.stop() for x in cls.instances if x.consumer is not None])
@@ -2,15 +2,122 @@
 Lambdas refers to async background tasks.
 
 They run code in response to events which are typically messages sent to a queue.
+
+Lambdas with a `batch_window` can buffer their signals for that many seconds, and process them together:
+the merchants of the batch are looked up in a single query, and each merchant's signals are given
+to `process_batch()`, while each signal still gets its own response.
+
+Batching is a worker mode, enabled with `APP_SETTINGS_LAMBDA_BATCHING`, for workers running several
+tasks at the same time with the `threads` pool of Celery, ex: `celery worker --pool threads --concurrency 20`.
+In this mode, the lambdas of a process run in a single event loop, running in a background thread,
+so that concurrent signals can be coalesced. Otherwise, each lambda is run by `LambdaTask.run()`
+and processes its signal alone, as the default `prefork` pool runs a single task at a time per process.
 """
 
+import asyncio
+import os
+import threading
 import typing
 
+from beanie.odm.operators.find.comparison import In
+
 from sap.worker import LambdaResponse, LambdaTask, SignalPacket
 
 from AppMain.asgi import initialize_beanie
+from AppMain.settings import AppSettings, logger
 
+from .metrics import task_duration
 from .models import MerchantT
+from .rest import HttpPool
+
+Signal = tuple[str, dict[str, typing.Any]]  # identifier of the merchant and kwargs of a signal
+SignalResult = LambdaResponse | Exception  # response of a signal, or the error raised while processing it
+
+
+class LambdaBatcher:
+    """Buffer signals for `window` seconds, and hand them to `handle` in a single call."""
+
+    loop: typing.ClassVar[asyncio.AbstractEventLoop | None] = None  # shared by the lambdas of the process
+    loop_pid: typing.ClassVar[int | None] = None
+    loop_lock: typing.ClassVar[threading.Lock] = threading.Lock()
+
+    handle: typing.Callable[[list[Signal]], typing.Awaitable[list[SignalResult]]]
+    window: float  # seconds a signal waits for other signals
+    max_size: int  # maximum number of signals handled together
+    pending: list[tuple[str, dict[str, typing.Any], asyncio.Future[LambdaResponse]]]
+    flusher: asyncio.Task[None] | None  # flushing the signals after the window
+    tasks: set[asyncio.Task[None]]  # flushes running, referenced until they are done
+
+    def __init__(
+        self,
+        handle: typing.Callable[[list[Signal]], typing.Awaitable[list[SignalResult]]],
+        *,
+        window: float,
+        max_size: int = 500,
+    ) -> None:
+        """Initialize an empty buffer."""
+        self.handle = handle
+        self.window = window
+        self.max_size = max_size
+        self.pending = []
+        self.flusher = None
+        self.tasks = set()
+
+    @classmethod
+    def get_loop(cls) -> asyncio.AbstractEventLoop:
+        """Return the event loop running the lambdas of the process, started on first use."""
+        with cls.loop_lock:
+            if cls.loop is None or cls.loop_pid != os.getpid():
+                # The thread of the loop does not survive a fork
+                cls.loop = asyncio.new_event_loop()
+                cls.loop_pid = os.getpid()
+                threading.Thread(target=cls.loop.run_forever, name="lambda-batcher", daemon=True).start()
+            return cls.loop
+
+    async def submit(self, identifier: str, kwargs: dict[str, typing.Any]) -> LambdaResponse:
+        """Buffer a signal, and return its response once its batch has been handled."""
+        if self.flusher is not None and self.flusher.get_loop() is not asyncio.get_running_loop():
+            # Signals of a previous loop can not be answered anymore
+            self.pending, self.flusher = [], None
+        future: asyncio.Future[LambdaResponse] = asyncio.get_running_loop().create_future()
+        self.pending.append((identifier, kwargs, future))
+        if len(self.pending) >= self.max_size:
+            self.start(self.flush())
+        elif self.flusher is None or self.flusher.done():
+            self.flusher = self.start(self.flush_later())
+        return await future
+
+    def start(self, coroutine: typing.Coroutine[typing.Any, typing.Any, None]) -> asyncio.Task[None]:
+        """Run a flush in the background."""
+        task = asyncio.create_task(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    async def flush_later(self) -> None:
+        """Handle the buffered signals after `window` seconds."""
+        await asyncio.sleep(self.window)
+        await self.flush()
+
+    async def flush(self) -> None:
+        """Handle the buffered signals, and answer each of them with its response or the error raised."""
+        batch, self.pending = self.pending, []
+        if not batch:
+            return
+        try:
+            responses = await self.handle([(identifier, kwargs) for identifier, kwargs, _ in batch])
+        except Exception as exc:  # pylint: disable=broad-except
+            for *_, future in batch:
+                if not future.done():
+                    future.set_exception(exc)
+        else:
+            for (*_, future), response in zip(batch, responses):
+                if future.done():
+                    continue
+                if isinstance(response, Exception):
+                    future.set_exception(response)
+                else:
+                    future.set_result(response)
 
 
 class TrellisLambdaTask(LambdaTask, typing.Generic[MerchantT]):
@@ -18,18 +125,73 @@ class TrellisLambdaTask(LambdaTask, typing.Generic[MerchantT]):
 
     merchant_model: typing.Type[MerchantT]
     packet: SignalPacket
+    batch_window: typing.ClassVar[float | None] = None  # seconds signals are buffered, None to process them alone
+    batch_size: typing.ClassVar[int] = 500  # maximum number of signals processed together
+    batcher: LambdaBatcher | None = None
+
+    def run(self, *args: typing.Any, **kwargs: typing.Any) -> typing.Any:
+        """Run the task, in the event loop shared by the lambdas of the process in the batching worker mode."""
+        if not AppSettings.LAMBDA_BATCHING:
+            return super().run(*args, **kwargs)
+        logger.debug("Running task=%s args=%s kwargs=%s in the shared loop", self.name, str(args), str(kwargs))
+        return asyncio.run_coroutine_threadsafe(self.handle_process(*args, **kwargs), LambdaBatcher.get_loop()).result()
 
     async def handle_process(self, *args: str, **kwargs: typing.Any) -> LambdaResponse:
-        """Authenticate the merchant associated to the identifier and run the lambda task."""
-        await initialize_beanie()
+        """Authenticate the merchant associated to the identifier and run the lambda task, recording its duration."""
         identifier: str = args[0]
-        model = self.merchant_model
-        merchant: MerchantT | None = await model.find_one(model.beans_card_id == identifier, model.is_active == True)
-        if not merchant:
-            return LambdaResponse(result=False, error=f"MERCHANT_NOT_FOUND {identifier}")
-        result: LambdaResponse = await self.process(merchant=merchant, **kwargs)
-        return result
+        if self.batch_window is None or not AppSettings.LAMBDA_BATCHING:
+            response = (await self.handle_batch([(identifier, kwargs)]))[0]
+            if isinstance(response, Exception):
+                raise response
+            return response
+        if self.batcher is None:
+            self.batcher = LambdaBatcher(self.handle_batch, window=self.batch_window, max_size=self.batch_size)
+        return await self.batcher.submit(identifier, kwargs)
+
+    async def handle_batch(self, signals: list[Signal]) -> list[SignalResult]:
+        """Authenticate the merchants of the signals in a single query, and process the signals of each merchant.
+
+        The error raised while processing the signals of a merchant is returned for each of these signals,
+        the signals of the other merchants are still processed.
+        """
+        with task_duration.time(self.name):
+            await initialize_beanie()
+            model = self.merchant_model
+            merchants = {
+                x.beans_card_id: x
+                async for x in model.find(
+                    In(model.beans_card_id, list({x for x, _ in signals})), model.is_active == True
+                )
+            }
+            responses: list[SignalResult] = [
+                LambdaResponse(result=False, error=f"MERCHANT_NOT_FOUND {identifier}") for identifier, _ in signals
+            ]
+            groups: dict[str, list[int]] = {}
+            for index, (identifier, _) in enumerate(signals):
+                if identifier in merchants:
+                    groups.setdefault(identifier, []).append(index)
+
+            async with HttpPool.lifespan():
+                for identifier, indexes in groups.items():
+                    results = await self.process_group(merchants[identifier], [signals[x][1] for x in indexes])
+                    for index, result in zip(indexes, results):
+                        responses[index] = result
+            return responses
+
+    async def process_group(self, merchant: MerchantT, kwargs_list: list[dict[str, typing.Any]]) -> list[SignalResult]:
+        """Process the signals of a merchant, and return the error raised for each of them if it fails."""
+        try:
+            return list(await self.process_batch(merchant, kwargs_list))
+        except Exception as exc:  # pylint: disable=broad-except
+            logger.exception("Lambda %s failed for merchant %s", self.name, merchant.beans_card_id)
+            return [exc] * len(kwargs_list)
 
     async def process(self, merchant: MerchantT, **kwargs: typing.Any) -> LambdaResponse:
         """Run the lambda task."""
         raise NotImplementedError
+
+    async def process_batch(
+        self, merchant: MerchantT, kwargs_list: list[dict[str, typing.Any]]
+    ) -> list[LambdaResponse]:
+        """Run the lambda task for each signal of a merchant, override it to process them together."""
+        return [await self.process(merchant=merchant, **kwargs) for kwargs in kwargs_list]
@@ -0,0 +1,171 @@
+"""
+Leases.
+
+Claim documents for a worker, so that several processes and hosts can share the same queue of documents.
+
+A worker claims a document by setting its `lease` in a single `find_one_and_update`, among the documents
+of a queryset without lease or with an expired lease. Other workers do not claim it until it is released,
+or until the lease expires when the worker stops without releasing it. The leases of the documents held
+by a worker are renewed by a heartbeat, so that a slow document is not claimed again while it is processed.
+
+Leases expire according to the clock of MongoDB (`$$NOW`), so that workers whose clocks drift
+apart do not steal each other's documents.
+"""
+
+import asyncio
+import os
+import socket
+import typing
+import uuid
+from datetime import datetime
+
+import beanie
+import pydantic
+from beanie.odm.queries.find import FindMany
+from beanie.odm.utils.parsing import parse_obj
+from pymongo import ReturnDocument
+from pymongo.errors import PyMongoError
+
+from AppMain.settings import logger
+
+DocT = typing.TypeVar("DocT", bound=beanie.Document)
+
+
+class Lease(pydantic.BaseModel):
+    """Reservation of a document by a worker."""
+
+    owner: str  # worker holding the lease, see `get_worker_id()`
+    expires: datetime  # date after which the document can be claimed by another worker, set by MongoDB
+
+
+def get_worker_id() -> str:
+    """Return a unique identifier of a worker, naming its host and process."""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+class LeaseClaimer(typing.Generic[DocT]):
+    """Claim the documents of a queryset one at a time, in its order and up to its limit.
+
+    The documents of the queryset must have a `lease: Lease | None` field. Iterating the claimer yields
+    each claimed document, until the queryset has no document left to claim. Documents are held until
+    they are released, and the leases still held are released when leaving the context manager.
+    ```
+    async with LeaseClaimer(MerchantDoc.find(...)) as claimer:
+        async for merchant in claimer:
+            ...
+            await claimer.release(merchant)
+    ```
+    """
+
+    queryset: FindMany[DocT]
+    owner: str
+    duration: float  # seconds of a lease, renewed every third of this duration
+    held: set[typing.Any]  # ids of the documents claimed and not released yet
+    heartbeat: asyncio.Task[None] | None
+    on_change: typing.Callable[..., typing.Awaitable[None]] | None  # called with the ids of the documents updated
+
+    def __init__(
+        self,
+        queryset: FindMany[DocT],
+        *,
+        duration: float = 300,
+        owner: str | None = None,
+        on_change: typing.Callable[..., typing.Awaitable[None]] | None = None,
+    ) -> None:
+        """Initialize a claimer, without holding any document.
+
+        Leases are written to the collection without beanie events, `on_change` can be used to invalidate
+        the caches of the documents, ex: `merchant_cache.invalidate`.
+        """
+        self.queryset = queryset
+        self.owner = owner or get_worker_id()
+        self.duration = duration
+        self.held = set()
+        self.heartbeat = None
+        self.on_change = on_change
+
+    async def __aenter__(self) -> typing.Self:
+        """Start renewing the leases held."""
+        self.heartbeat = asyncio.create_task(self.run_heartbeat())
+        return self
+
+    async def __aexit__(self, *args: typing.Any) -> None:
+        """Stop renewing the leases, and release the documents still held."""
+        if self.heartbeat is not None:
+            self.heartbeat.cancel()
+            await asyncio.gather(self.heartbeat, return_exceptions=True)
+            self.heartbeat = None
+        if not self.held:
+            return
+        await self.get_collection().update_many(
+            {"_id": {"$in": list(self.held)}, "lease.owner": self.owner}, {"$set": {"lease": None}}
+        )
+        await self.notify(*self.held)
+        self.held.clear()
+
+    async def __aiter__(self) -> typing.AsyncIterator[DocT]:
+        """Claim documents until the limit of the queryset is reached, or no document is left."""
+        limit, claimed = self.queryset.limit_number, 0
+        while not limit or claimed < limit:  # pylint: disable=while-used
+            document = await self.claim()
+            if document is None:
+                return
+            claimed += 1
+            yield document
+
+    def get_collection(self) -> typing.Any:
+        """Return the Motor collection of the documents."""
+        return self.queryset.document_model.get_motor_collection()
+
+    def get_expires(self) -> dict[str, typing.Any]:
+        """Return the expression of the expiry date of a lease taken now, for update pipelines."""
+        return {"$add": ["$$NOW", int(self.duration * 1000)]}
+
+    async def notify(self, *ids: typing.Any) -> None:
+        """Report the documents whose lease has been written."""
+        if self.on_change is not None and ids:
+            await self.on_change(*ids)
+
+    async def claim(self) -> DocT | None:
+        """Claim the first document of the queryset without a valid lease, or return None."""
+        available = {"$or": [{"lease": None}, {"$expr": {"$lte": ["$lease.expires", "$$NOW"]}}]}
+        raw = await self.get_collection().find_one_and_update(
+            {"$and": [self.queryset.get_filter_query(), available]},
+            [{"$set": {"lease": {"owner": {"$literal": self.owner}, "expires": self.get_expires()}}}],
+            sort=[(key, int(direction)) for key, direction in self.queryset.sort_expressions] or None,
+            return_document=ReturnDocument.AFTER,
+        )
+        if raw is None:
+            return None
+        self.held.add(raw["_id"])
+        await self.notify(raw["_id"])
+        return typing.cast(DocT, parse_obj(self.queryset.document_model, raw))
+
+    async def release(self, document: DocT) -> None:
+        """Release a document, unless its lease has expired and has been claimed by another worker."""
+        self.held.discard(document.id)
+        await self.get_collection().update_one(
+            {"_id": document.id, "lease.owner": self.owner}, {"$set": {"lease": None}}
+        )
+        await self.notify(document.id)
+
+    async def renew(self) -> None:
+        """Extend the leases of the documents held."""
+        if not self.held:
+            return
+        response = await self.get_collection().update_many(
+            {"_id": {"$in": list(self.held)}, "lease.owner": self.owner},
+            [{"$set": {"lease.expires": self.get_expires()}}],
+        )
+        if response.matched_count < len(self.held):
+            logger.warning("Lost %d leases of %s", len(self.held) - response.matched_count, self.owner)
+        await self.notify(*self.held)
+
+    async def run_heartbeat(self) -> None:
+        """Renew the leases periodically, until cancelled."""
+        while True:  # pylint: disable=while-used
+            await asyncio.sleep(self.duration / 3)
+            try:
+                await self.renew()
+            except PyMongoError as exc:
+                logger.warning("Unable to renew the leases of %s: %s", self.owner, exc)
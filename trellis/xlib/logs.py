@@ -0,0 +1,74 @@
+"""
+Logs.
+
+Write log files from a background thread.
+
+A `logging.FileHandler` writes to the disk in the thread emitting the record, which is
+the event loop when logging from a request. `QueuedFileHandler` only formats the record
+and puts it on a bounded queue, that a `QueueListener` thread writes to the file.
+When the queue is full, records below `overflow_level` are dropped and counted, and
+more severe records are written directly, so that errors are never lost.
+
+The handler is used in the `logging_setter()` dictConfig, as a handler factory:
+```python
+{"()": QueuedFileHandler, "filename": "/tmp/trellis.log", "formatter": "simple"}
+```
+"""
+
+import logging
+import logging.handlers
+import os
+import queue
+
+
+class QueuedFileHandler(logging.handlers.QueueHandler):
+    """File handler writing records from a background thread."""
+
+    target: logging.FileHandler
+    listener: logging.handlers.QueueListener | None
+    pid: int | None  # process in which the listener has been started
+    maxsize: int  # maximum number of records waiting to be written
+    overflow_level: int  # records at or above this level are written directly when the queue is full
+    dropped: int  # records dropped because the queue was full
+
+    def __init__(self, filename: str, maxsize: int = 10_000, overflow_level: int = logging.ERROR) -> None:
+        """Open the file and start the listener."""
+        super().__init__(queue.Queue(maxsize))
+        self.target = logging.FileHandler(filename)  # without formatter, records are formatted by the queue handler
+        self.listener = None
+        self.pid = None
+        self.maxsize = maxsize
+        self.overflow_level = overflow_level
+        self.dropped = 0
+        self.start()
+
+    def start(self) -> None:
+        """Start the listener thread, with a new queue."""
+        self.queue = queue.Queue(self.maxsize)
+        self.listener = logging.handlers.QueueListener(self.queue, self.target)
+        self.listener.start()
+        self.pid = os.getpid()
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        """Queue a record, or apply the overflow policy when the queue is full."""
+        if self.pid != os.getpid():
+            # Threads do not survive a fork, the child process starts its own listener
+            self.start()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            if record.levelno >= self.overflow_level:
+                self.target.handle(record)
+            else:
+                self.dropped += 1
+
+    def close(self) -> None:
+        """Write the queued records, and close the file.
+
+        Called by `logging.shutdown()` when the process exits.
+        """
+        if self.listener is not None and self.pid == os.getpid():
+            self.listener.stop()
+        self.listener = None
+        self.target.close()
+        super().close()
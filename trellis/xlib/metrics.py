@@ -0,0 +1,179 @@
+"""
+Metrics.
+
+Latency histograms exported in the Prometheus text format at `/metrics/`.
+
+Recording a value costs a bisection in the bucket bounds and a few increments, so that
+requests, MongoDB commands and tasks can be measured on the hot path:
+- `http_request_duration_seconds`: requests, by method, route template and status code
+- `mongodb_command_duration_seconds`: commands sent by Motor, by command name and outcome
+- `trellis_task_duration_seconds`: cron and lambda executions, by task and outcome
+
+Metrics are kept in the memory of each process. Tasks are measured in the process running them.
+"""
+
+import bisect
+import contextlib
+import threading
+import time
+import typing
+
+from pymongo import monitoring
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+LabelsT = tuple[str, ...]
+LABEL_ESCAPES = str.maketrans({"\\": "\\\\", '"': '\\"', "\n": "\\n"})
+
+
+class Histogram:
+    """Distribution of durations, by label values."""
+
+    instances: typing.ClassVar[list["Histogram"]] = []  # histograms exported by `export()`
+
+    name: str
+    description: str
+    labelnames: LabelsT
+    buckets: tuple[float, ...]  # upper bounds of the buckets, +Inf is implicit
+    values: dict[LabelsT, list[float]]  # count of each bucket, then the sum of the values
+    lock: threading.Lock  # MongoDB commands are recorded from Motor threads
+
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        labelnames: LabelsT,
+        buckets: tuple[float, ...] = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+    ) -> None:
+        """Initialize an empty histogram."""
+        self.name = name
+        self.description = description
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self.values = {}
+        self.lock = threading.Lock()
+        self.instances.append(self)
+
+    def observe(self, value: float, *labels: str) -> None:
+        """Record a value."""
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            values = self.values.get(labels)
+            if values is None:
+                values = self.values[labels] = [0.0] * (len(self.buckets) + 2)
+            values[index] += 1
+            values[-1] += value
+
+    @contextlib.contextmanager
+    def time(self, *labels: str) -> typing.Iterator[None]:
+        """Record the duration of the context, adding an outcome label: success or error."""
+        start = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            self.observe(time.perf_counter() - start, *labels, "error")
+            raise
+        self.observe(time.perf_counter() - start, *labels, "success")
+
+    @staticmethod
+    def format_labels(labels: typing.Iterable[tuple[str, str]]) -> str:
+        """Return labels in the Prometheus format, ex: {method="GET",route="/"}."""
+        return "{" + ",".join(f'{name}="{value.translate(LABEL_ESCAPES)}"' for name, value in labels) + "}"
+
+    def collect(self) -> typing.Iterator[str]:
+        """Return the lines of the histogram in the Prometheus text format."""
+        yield f"# HELP {self.name} {self.description}"
+        yield f"# TYPE {self.name} histogram"
+        with self.lock:
+            values = {labels: list(x) for labels, x in self.values.items()}
+        for labels, counts in sorted(values.items()):
+            names = list(zip(self.labelnames, labels))
+            cumulated = 0.0
+            for bound, count in zip([*self.buckets, float("inf")], counts):
+                cumulated += count
+                le = "+Inf" if bound == float("inf") else repr(float(bound))
+                yield f"{self.name}_bucket{self.format_labels([*names, ('le', le)])} {int(cumulated)}"
+            yield f"{self.name}_sum{self.format_labels(names)} {counts[-1]}"
+            yield f"{self.name}_count{self.format_labels(names)} {int(cumulated)}"
+
+    @classmethod
+    def export(cls) -> str:
+        """Return all histograms in the Prometheus text format."""
+        return "\n".join(line for histogram in cls.instances for line in histogram.collect()) + "\n"
+
+
+http_request_duration = Histogram(
+    "http_request_duration_seconds", "Duration of HTTP requests.", ("method", "route", "status")
+)
+mongodb_command_duration = Histogram(
+    "mongodb_command_duration_seconds",
+    "Duration of MongoDB commands.",
+    ("command", "outcome"),
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5),
+)
+task_duration = Histogram(
+    "trellis_task_duration_seconds",
+    "Duration of cron and lambda executions.",
+    ("task", "outcome"),
+    buckets=(0.1, 0.5, 1, 5, 10, 30, 60, 120, 300, 600, 1800),
+)
+
+
+class MetricsMiddleware:
+    """Middleware recording the duration of each HTTP request, by route template."""
+
+    app: ASGIApp
+
+    def __init__(self, app: ASGIApp) -> None:
+        """Initialize Middleware."""
+        self.app = app
+
+    @staticmethod
+    def get_route(scope: Scope) -> str:
+        """Return the template of the route that handled the request, including the prefix of its mounts.
+
+        Requests handled by a mounted app that is not a router, like the static files, use the mount prefix.
+        """
+        prefix = scope.get("root_path", "")[len(scope.get("app_root_path", "")) :]
+        if route := scope.get("route"):
+            return f"{prefix}{route.path}"
+        return f"{prefix}/{{path}}" if prefix else "unmatched"
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        """Run Middleware."""
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = "500"  # the request failed before sending a response
+
+        async def send_status(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = str(message["status"])
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_status)
+        finally:
+            # Routers add the matched route to the scope
+            http_request_duration.observe(time.perf_counter() - start, scope["method"], self.get_route(scope), status)
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    """Listener recording the duration of each MongoDB command."""
+
+    def started(self, event: monitoring.CommandStartedEvent) -> None:
+        """Ignore started commands, their duration is known once they end."""
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent) -> None:
+        """Record a successful command."""
+        mongodb_command_duration.observe(event.duration_micros / 1e6, event.command_name, "success")
+
+    def failed(self, event: monitoring.CommandFailedEvent) -> None:
+        """Record a failed command."""
+        mongodb_command_duration.observe(event.duration_micros / 1e6, event.command_name, "error")
+
+
+# Listeners are used by the clients created after their registration
+monitoring.register(MongoCommandListener())
@@ -7,12 +7,15 @@ Base models that can be sub-classed independently by each Trellis integration.
 import typing
 from datetime import datetime
 
+import beanie
 import pydantic
 
 from sap.beanie import Document
 from sap.fastapi.user import UserMixin
 from sap.pydantic import datetime_utcnow
 
+from .cache import merchant_cache
+
 
 class BaseMerchantDoc(UserMixin, Document):
     """Base class for all Merchant documents."""
@@ -36,6 +39,11 @@ class BaseMerchantDoc(UserMixin, Document):
         """Print object."""
         return self.beans_card_address
 
+    @beanie.after_event(beanie.Save, beanie.Replace, beanie.Update, beanie.SaveChanges, beanie.Delete)
+    async def invalidate_cache(self) -> None:
+        """Remove the merchant from the authentication cache after each change."""
+        await merchant_cache.invalidate(self.id)
+
     async def get_auth_key(self) -> str:
         """Return an auth_key allowing the user to authenticate. Useful for testing."""
         return self.beans_card_id
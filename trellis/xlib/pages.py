@@ -0,0 +1,120 @@
+"""
+Pages.
+
+Cache the pages rendered for a merchant, and answer conditional requests.
+
+Settings pages are often kept open inside the Beans dashboard iframe and reloaded,
+while neither the merchant nor the template has changed. Rendered pages are kept in
+an LRU keyed on the template, the merchant id and a hash of the merchant fields.
+Responses carry a strong ETag computed from the body, so that browsers revalidate
+them with `If-None-Match` and receive `304 Not Modified` without a body.
+Entries are not invalidated: a change of the merchant changes its key, and the pages
+rendered for its previous versions are evicted as the least recently used.
+"""
+
+import collections
+import hashlib
+import typing
+from dataclasses import asdict, dataclass
+
+import beanie
+import jinja2
+from fastapi import Request, Response, status
+from fastapi.responses import HTMLResponse
+
+from AppMain.settings import templates
+
+PageKey = tuple[jinja2.Template, typing.Any, str, str, tuple[tuple[str, typing.Hashable], ...]]
+
+
+@dataclass
+class PageStats:
+    """Counters of a `PageCache`."""
+
+    hits: int = 0  # pages served from the cache
+    misses: int = 0  # pages that had to be rendered
+    not_modified: int = 0  # requests answered with 304 Not Modified
+
+
+@dataclass(slots=True)
+class RenderedPage:
+    """Body and ETag of a rendered page."""
+
+    body: bytes
+    etag: str
+
+
+class PageCache:
+    """LRU of the pages rendered for each merchant."""
+
+    maxsize: int
+    entries: collections.OrderedDict[PageKey, RenderedPage]
+    stats: PageStats
+
+    headers: typing.ClassVar[dict[str, str]] = {"Cache-Control": "private, no-cache"}  # always revalidate
+
+    def __init__(self, *, maxsize: int = 1024) -> None:
+        """Initialize an empty cache."""
+        self.maxsize = maxsize
+        self.entries = collections.OrderedDict()
+        self.stats = PageStats()
+
+    def get_stats(self) -> dict[str, int]:
+        """Return the number of cached pages and the counters."""
+        return {"size": len(self.entries), **asdict(self.stats)}
+
+    @staticmethod
+    def get_version(merchant: beanie.Document) -> str:
+        """Return a hash of the merchant fields, that changes each time the merchant is modified."""
+        data = merchant.model_dump_json(exclude={"doc_meta"})  # doc_meta.updated changes on each validation
+        return hashlib.blake2b(data.encode(), digest_size=16).hexdigest()
+
+    @staticmethod
+    def get_etag(body: bytes) -> str:
+        """Return a strong ETag of the body."""
+        return f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+
+    @staticmethod
+    def is_not_modified(request: Request, etag: str) -> bool:
+        """Return True if the client already has the page with the given ETag."""
+        if_none_match = request.headers.get("if-none-match", "")
+        return if_none_match.strip() == "*" or etag in [x.strip() for x in if_none_match.split(",")]
+
+    def get_response(self, request: Request, page: RenderedPage) -> Response:
+        """Return the page, or an empty response if the client already has it."""
+        headers = {"ETag": page.etag, **self.headers}
+        if self.is_not_modified(request, page.etag):
+            self.stats.not_modified += 1
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+        return HTMLResponse(page.body, headers=headers)
+
+    def render(self, request: Request, name: str, merchant: beanie.Document, **context: typing.Hashable) -> Response:
+        """Render a template for a merchant, or reuse the page rendered last time.
+
+        Pages displaying flashed messages are not cached, as the messages are displayed once.
+        """
+        if request.session.get("_messages"):
+            return templates.TemplateResponse(name, context={"request": request, "merchant": merchant, **context})
+
+        key: PageKey = (
+            templates.get_template(name),  # a new template is loaded when the file changes
+            merchant.id,
+            self.get_version(merchant),
+            str(request.base_url),  # used by `url_for()`
+            tuple(sorted(context.items())),
+        )
+        page = self.entries.get(key)
+        if page is None:
+            self.stats.misses += 1
+            response = templates.TemplateResponse(name, context={"request": request, "merchant": merchant, **context})
+            page = RenderedPage(body=bytes(response.body), etag=self.get_etag(response.body))
+            self.entries[key] = page
+            if len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+        else:
+            self.stats.hits += 1
+            self.entries.move_to_end(key)
+        return self.get_response(request, page)
+
+
+page_cache = PageCache()
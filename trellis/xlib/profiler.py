@@ -0,0 +1,288 @@
+"""
+Profiler.
+
+Aggregate MongoDB commands by query shape, and log the slow ones with their explain summary.
+
+A shape is the command with its values replaced by `?`, so that `find_one(ReviewDoc.id == x)`
+calls share the same statistics whatever `x` is:
+```
+find reviews {"filter": {"_id": "?"}, "limit": "?"}
+```
+Each process keeps the count, total and max duration of each shape, and dumps them to a JSON
+file in `QUERY_PROFILE_DIR` every minute and on exit. Queries slower than `SLOW_QUERY_MS` are
+logged, explained once per shape from a background thread.
+
+The profiler is a listener of the clients opened by `BeanieGuard`, it is added to them by the app.
+
+Print the report of all processes:
+```shell
+python -m trellis.xlib.profiler --sort total --top 20
+```
+"""
+
+import argparse
+import atexit
+import json
+import os
+import pathlib
+import threading
+import time
+import typing
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+
+import pymongo
+from pymongo import monitoring
+from pymongo.errors import PyMongoError
+
+from AppMain.settings import AppSettings, logger
+
+# Fields of a command that are part of its shape, their values are replaced except in sorts and projections
+SHAPE_FIELDS = ("filter", "query", "sort", "projection", "key", "pipeline", "deletes", "updates", "limit")
+KEPT_FIELDS = frozenset(["sort", "projection", "key", "$sort", "$project"])
+# Commands that are not sent by the app, or that are already measured by another command
+IGNORED_COMMANDS = frozenset(
+    ["hello", "ismaster", "isMaster", "ping", "saslStart", "saslContinue", "endSessions", "buildInfo", "explain"]
+)
+EXPLAINABLE_COMMANDS = frozenset(["find", "aggregate", "count", "distinct", "delete", "update", "findAndModify"])
+# Fields added by the driver, that can not be explained
+DRIVER_FIELDS = frozenset(["lsid", "txnNumber", "autocommit", "startTransaction", "readConcern", "writeConcern"])
+
+
+@dataclass(slots=True)
+class QueryStats:
+    """Statistics of a query shape."""
+
+    count: int = 0
+    total_ms: float = 0
+    max_ms: float = 0
+    slow: int = 0  # queries slower than the threshold
+    explain: str = ""  # summary of the plan, for slow queries
+
+    def merge(self, other: "QueryStats") -> None:
+        """Add the statistics of another process."""
+        self.count += other.count
+        self.total_ms += other.total_ms
+        self.max_ms = max(self.max_ms, other.max_ms)
+        self.slow += other.slow
+        self.explain = self.explain or other.explain
+
+
+def normalize(value: typing.Any, replace: bool = True) -> typing.Any:
+    """Return a value with its values replaced by `?`, keeping the keys, operators and sorts."""
+    if isinstance(value, dict):
+        return {key: normalize(x, replace and key not in KEPT_FIELDS) for key, x in value.items()}
+    if isinstance(value, list) and value and all(isinstance(x, dict) for x in value):
+        return [normalize(x, replace) for x in value]
+    return "?" if replace else value
+
+
+def get_shape(command: typing.Mapping[str, typing.Any]) -> str:
+    """Return the shape of a command, ex: find reviews {"filter": {"merchant.$id": "?"}}.
+
+    Commands are named after their collection, except `getMore` whose value is the id of the cursor.
+    """
+    name = next(iter(command))
+    target = command["collection"] if name == "getMore" else command[name]
+    shape: dict[str, typing.Any] = {}
+    for field in SHAPE_FIELDS:
+        if field not in command:
+            continue
+        value = command[field]
+        if field in ("deletes", "updates"):
+            # Statements of a bulk write usually share their shape, only the first filter is kept
+            value = {"q": value[0].get("q", {})} if value else {}
+        shape[field] = normalize(value, field not in KEPT_FIELDS)
+    return f"{name} {target} {json.dumps(shape, default=str)}"
+
+
+def get_plan_stages(plan: dict[str, typing.Any]) -> list[str]:
+    """Return the stages of a plan, from the first one executed, ex: ["IXSCAN(merchant_1)", "FETCH"]."""
+    if not plan:
+        return []
+    stage = plan.get("stage", "?") + (f"({plan['indexName']})" if "indexName" in plan else "")
+    return [*get_plan_stages(plan.get("inputStage", {})), stage]
+
+
+def summarize_explain(result: dict[str, typing.Any]) -> str:
+    """Return a summary of the result of an explain command."""
+    if "stages" in result:
+        # Aggregations are explained as a pipeline, the query is run by the first stage
+        result = result["stages"][0].get("$cursor", {})
+    plan = result.get("queryPlanner", {}).get("winningPlan", {})
+    plan = plan.get("queryPlan", plan)  # slot-based execution engine
+    stats = result.get("executionStats", {})
+    return (
+        f"{' > '.join(get_plan_stages(plan)) or '?'}"
+        f", keys examined {stats.get('totalKeysExamined', '?')}"
+        f", docs examined {stats.get('totalDocsExamined', '?')}"
+        f", returned {stats.get('nReturned', '?')}"
+    )
+
+
+class QueryProfiler(monitoring.CommandListener):  # pylint: disable=too-many-instance-attributes
+    """Listener aggregating MongoDB commands by shape, and logging the slow ones."""
+
+    slow_ms: float  # queries slower than this are logged, 0 to disable
+    dump_dir: pathlib.Path | None
+    dump_interval: float  # seconds between two dumps
+    dns: str  # used to explain slow queries
+    stats: dict[str, QueryStats]
+    pending: dict[tuple[typing.Any, int], tuple[str, typing.Mapping[str, typing.Any]]]  # shape and command
+    pid: int | None  # process owning the statistics, None until the first command
+    dumped_at: float
+    lock: threading.Lock
+    executor: ThreadPoolExecutor
+    client: pymongo.MongoClient[dict[str, typing.Any]] | None
+
+    def __init__(
+        self, dns: str, slow_ms: float = 100, dump_dir: pathlib.Path | None = None, dump_interval: float = 60
+    ) -> None:
+        """Initialize an empty profiler."""
+        self.dns = dns
+        self.slow_ms = slow_ms
+        self.dump_dir = dump_dir
+        self.dump_interval = dump_interval
+        self.stats = {}
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="query_profiler")
+        self.client = None
+        self.pid = None
+        self.dumped_at = time.monotonic()
+
+    def reset(self) -> None:
+        """Start the statistics of the process, on its first command and after a fork.
+
+        The dump on exit is registered on the first command. After a fork, the executor and the client
+        of the parent process are dropped, as their thread and connections only exist in the parent.
+        """
+        if self.pid is None:
+            atexit.register(self.dump)  # inherited by forked processes
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.stats = {}
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="query_profiler")
+        self.client = None
+        self.dumped_at = time.monotonic()
+        self.pid = os.getpid()
+
+    def started(self, event: monitoring.CommandStartedEvent) -> None:
+        """Keep the shape of the command, until it ends."""
+        if event.command_name in IGNORED_COMMANDS:
+            return
+        if self.pid != os.getpid():
+            self.reset()
+        self.pending[(event.connection_id, event.request_id)] = (get_shape(event.command), event.command)
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent) -> None:
+        """Record a successful command."""
+        self.record(event)
+
+    def failed(self, event: monitoring.CommandFailedEvent) -> None:
+        """Record a failed command."""
+        self.record(event)
+
+    def record(self, event: monitoring.CommandSucceededEvent | monitoring.CommandFailedEvent) -> None:
+        """Add the duration of a command to the statistics of its shape."""
+        pending = self.pending.pop((event.connection_id, event.request_id), None)
+        if pending is None:
+            return
+        shape, command = pending
+        duration = event.duration_micros / 1000
+        is_slow = bool(self.slow_ms) and duration >= self.slow_ms
+        with self.lock:
+            stats = self.stats.get(shape)
+            if stats is None:
+                stats = self.stats[shape] = QueryStats()
+            stats.count += 1
+            stats.total_ms += duration
+            stats.max_ms = max(stats.max_ms, duration)
+            stats.slow += is_slow
+            explain = stats.explain
+            if is_slow and not explain and event.command_name in EXPLAINABLE_COMMANDS:
+                stats.explain = "explain pending"  # each shape is explained once
+        if is_slow and explain:
+            logger.warning("Slow query %.1f ms: %s | %s", duration, shape, explain)
+        elif is_slow and event.command_name in EXPLAINABLE_COMMANDS:
+            self.executor.submit(self.explain, event.database_name, command, shape, duration)
+        elif is_slow:
+            logger.warning("Slow query %.1f ms: %s", duration, shape)
+        if self.dump_dir and time.monotonic() - self.dumped_at > self.dump_interval:
+            self.dumped_at = time.monotonic()
+            self.executor.submit(self.dump)
+
+    def explain(self, database: str, command: typing.Mapping[str, typing.Any], shape: str, duration: float) -> None:
+        """Explain a slow query, and log it with the summary of its plan."""
+        if self.client is None:
+            self.client = pymongo.MongoClient(self.dns, serverSelectionTimeoutMS=5000)
+        command = {key: x for key, x in command.items() if not key.startswith("$") and key not in DRIVER_FIELDS}
+        try:
+            result = self.client[database].command({"explain": command, "verbosity": "executionStats"})
+        except PyMongoError as exc:
+            summary = f"explain failed: {exc}"
+        else:
+            summary = summarize_explain(result)
+        with self.lock:
+            self.stats[shape].explain = summary
+        logger.warning("Slow query %.1f ms: %s | %s", duration, shape, summary)
+
+    def dump(self) -> pathlib.Path | None:
+        """Write the statistics of this process to a JSON file, replacing the previous dump."""
+        if not self.dump_dir or not self.stats or self.pid not in (None, os.getpid()):
+            return None
+        with self.lock:
+            content = json.dumps({shape: asdict(x) for shape, x in self.stats.items()}, indent=1)
+        os.makedirs(self.dump_dir, exist_ok=True)
+        path = self.dump_dir / f"queries-{self.pid}.json"
+        path.with_suffix(".tmp").write_text(content, encoding="utf-8")
+        path.with_suffix(".tmp").replace(path)
+        return path
+
+    @staticmethod
+    def load(dump_dir: pathlib.Path) -> dict[str, QueryStats]:
+        """Return the statistics of all processes."""
+        stats: dict[str, QueryStats] = {}
+        for path in sorted(dump_dir.glob("queries-*.json")):
+            for shape, values in json.loads(path.read_text(encoding="utf-8")).items():
+                stats.setdefault(shape, QueryStats()).merge(QueryStats(**values))
+        return stats
+
+    @staticmethod
+    def report(stats: dict[str, QueryStats], sort: str = "total", top: int = 20) -> str:
+        """Return a table of the shapes with the highest total time, max time or count."""
+        keys: dict[str, typing.Callable[[QueryStats], float]] = {
+            "total": lambda x: x.total_ms,
+            "max": lambda x: x.max_ms,
+            "count": lambda x: x.count,
+        }
+        lines = [f"{'count':>8} {'total ms':>10} {'mean ms':>8} {'max ms':>8} {'slow':>6}  shape"]
+        for shape, x in sorted(stats.items(), key=lambda item: keys[sort](item[1]), reverse=True)[:top]:
+            lines.append(
+                f"{x.count:>8} {x.total_ms:>10.1f} {x.total_ms / x.count:>8.2f} {x.max_ms:>8.1f} {x.slow:>6}  {shape}"
+            )
+            if x.explain:
+                lines.append(f"{'':>45}  {x.explain}")
+        return "\n".join(lines)
+
+
+query_profiler = QueryProfiler(
+    dns=AppSettings.MONGO.get_dns(),
+    slow_ms=AppSettings.SLOW_QUERY_MS,
+    dump_dir=pathlib.Path(AppSettings.QUERY_PROFILE_DIR or os.path.join(AppSettings.LOG_DIR, "queries")),
+)
+
+
+def main() -> None:
+    """Print the report of the statistics dumped by all processes."""
+    parser = argparse.ArgumentParser(description="Print the MongoDB queries with the highest cost.")
+    parser.add_argument("--dir", type=pathlib.Path, default=query_profiler.dump_dir, help="folder of the dumps")
+    parser.add_argument("--sort", choices=["total", "max", "count"], default="total")
+    parser.add_argument("--top", type=int, default=20, help="number of shapes")
+    args = parser.parse_args()
+    print(QueryProfiler.report(QueryProfiler.load(args.dir), sort=args.sort, top=args.top))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+"""
+Readiness.
+
+Warm the MongoDB and HTTP connection pools on startup, and report whether the process is ready.
+
+Without warm-up, the first requests of a worker pay the TCP, TLS and authentication handshakes.
+`Readiness.lifespan()` opens `WARMUP_MONGO_CONNECTIONS` connections to MongoDB and sends
+`WARMUP_HTTP_CONNECTIONS` requests to each of the `WARMUP_HTTP_URLS` through the shared
+`HttpPool`, before the app accepts requests.
+
+The `/ready/` probe returns a state refreshed in the background every `interval` seconds.
+The state is read from the topology maintained by the MongoDB driver monitors and from the
+connection pool events, so that neither the probe nor the refresh sends commands to MongoDB.
+`pool_listener` is added by the app to the listeners of `BeanieGuard`, so that only the
+connections of the app client are counted.
+"""
+
+import asyncio
+import threading
+import time
+import typing
+from contextlib import asynccontextmanager
+
+import httpx
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import monitoring
+from pymongo.errors import PyMongoError
+from pymongo.topology_description import TopologyDescription
+
+from AppMain.settings import logger
+
+from .rest import HttpPool
+
+
+class PoolListener(monitoring.ConnectionPoolListener):
+    """Listener counting the MongoDB connections of the clients it is added to."""
+
+    opened: int  # connections established, including handshake and authentication
+    closed: int
+    checked_out: int  # connections currently used by an operation
+    lock: threading.Lock  # events are published from the threads of the driver
+
+    def __init__(self) -> None:
+        """Initialize the counters."""
+        self.opened = self.closed = self.checked_out = 0
+        self.lock = threading.Lock()
+
+    @property
+    def connections(self) -> int:
+        """Return the number of open connections."""
+        with self.lock:
+            return self.opened - self.closed
+
+    def connection_ready(self, event: monitoring.ConnectionReadyEvent) -> None:
+        """Count an established connection."""
+        with self.lock:
+            self.opened += 1
+
+    def connection_closed(self, event: monitoring.ConnectionClosedEvent) -> None:
+        """Count a closed connection."""
+        with self.lock:
+            self.closed += 1
+
+    def connection_checked_out(self, event: monitoring.ConnectionCheckedOutEvent) -> None:
+        """Count a connection used by an operation."""
+        with self.lock:
+            self.checked_out += 1
+
+    def connection_checked_in(self, event: monitoring.ConnectionCheckedInEvent) -> None:
+        """Count a connection returned to the pool."""
+        with self.lock:
+            self.checked_out -= 1
+
+    def pool_created(self, event: monitoring.PoolCreatedEvent) -> None:
+        """Ignore pool events."""
+
+    def pool_ready(self, event: monitoring.PoolReadyEvent) -> None:
+        """Ignore pool events."""
+
+    def pool_cleared(self, event: monitoring.PoolClearedEvent) -> None:
+        """Ignore pool events."""
+
+    def pool_closed(self, event: monitoring.PoolClosedEvent) -> None:
+        """Ignore pool events."""
+
+    def connection_created(self, event: monitoring.ConnectionCreatedEvent) -> None:
+        """Ignore connections until they are ready."""
+
+    def connection_check_out_started(self, event: monitoring.ConnectionCheckOutStartedEvent) -> None:
+        """Ignore check-out attempts."""
+
+    def connection_check_out_failed(self, event: monitoring.ConnectionCheckOutFailedEvent) -> None:
+        """Ignore failed check-outs."""
+
+
+pool_listener = PoolListener()
+
+
+class Readiness:
+    """Process-wide warm-up and readiness state."""
+
+    state: typing.ClassVar[dict[str, typing.Any]] = {"ready": False}  # returned by the `/ready/` probe
+    database: typing.ClassVar[AsyncIOMotorDatabase | None] = None
+    warmed_up: typing.ClassVar[bool] = False
+    http_warmed: typing.ClassVar[int] = 0  # origins that answered the warm-up requests
+    interval: typing.ClassVar[float] = 5  # seconds between two refreshes of the state
+    refresher: typing.ClassVar[asyncio.Task[None] | None] = None
+
+    @classmethod
+    async def warm_up_mongo(cls, database: AsyncIOMotorDatabase, connections: int) -> None:
+        """Open connections to MongoDB.
+
+        Concurrent commands use distinct connections, but the driver establishes at most two
+        connections at a time and reuses the ones that are ready, so a few rounds may be needed.
+        """
+        for _ in range(connections):
+            if pool_listener.connections >= connections:
+                return
+            await asyncio.gather(*[database.command("ping") for _ in range(connections)])
+
+    @classmethod
+    async def warm_up_http(cls, urls: list[str], connections: int) -> None:
+        """Open connections to the origins of the URLs, through the shared HTTP pool.
+
+        HTTP/2 origins multiplex concurrent requests on a single connection.
+        """
+        client = HttpPool.get_client()
+
+        async def warm_up_url(url: str) -> bool:
+            responses = await asyncio.gather(*[client.head(url) for _ in range(connections)], return_exceptions=True)
+            errors = [x for x in responses if isinstance(x, Exception)]
+            if errors:
+                logger.warning("Unable to warm up connections to %s: %s", url, errors[0])
+            return len(errors) < connections
+
+        cls.http_warmed = sum(await asyncio.gather(*[warm_up_url(x) for x in urls]))
+
+    @classmethod
+    async def warm_up(  # pylint: disable=too-many-arguments
+        cls,
+        database: AsyncIOMotorDatabase,
+        *,
+        mongo_connections: int,
+        http_urls: list[str],
+        http_connections: int,
+        timeout: float,
+    ) -> None:
+        """Warm the pools, giving up after `timeout` seconds so that startup is never blocked."""
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(
+                    cls.warm_up_mongo(database, mongo_connections), cls.warm_up_http(http_urls, http_connections)
+                ),
+                timeout=timeout,
+            )
+        except (asyncio.TimeoutError, PyMongoError, httpx.HTTPError) as exc:
+            logger.warning("Connection warm-up incomplete after %.1f s: %r", time.perf_counter() - start, exc)
+        cls.warmed_up = True
+
+    @classmethod
+    def check(cls) -> dict[str, typing.Any]:
+        """Return the state of the pools, without sending any command."""
+        topology: TopologyDescription | None = None
+        if cls.database is not None:
+            # Maintained by the monitors of the driver, missing from the Motor type hints
+            topology = typing.cast(TopologyDescription, cls.database.client.topology_description)
+        mongo_writable = topology is not None and topology.has_writable_server()
+        return {
+            "ready": cls.warmed_up and mongo_writable,
+            "warmed_up": cls.warmed_up,
+            "mongo": {
+                "writable": mongo_writable,
+                "topology": topology.topology_type_name if topology is not None else None,
+                "connections": pool_listener.connections,
+                "checked_out": pool_listener.checked_out,
+            },
+            "http": {"open": HttpPool.client is not None and not HttpPool.client.is_closed, "warmed": cls.http_warmed},
+        }
+
+    @classmethod
+    async def refresh(cls) -> None:
+        """Refresh the state periodically, until cancelled."""
+        while True:  # pylint: disable=while-used
+            await asyncio.sleep(cls.interval)
+            cls.state = cls.check()
+
+    @classmethod
+    @asynccontextmanager
+    async def lifespan(  # pylint: disable=too-many-arguments
+        cls,
+        database: AsyncIOMotorDatabase,
+        *,
+        mongo_connections: int = 4,
+        http_urls: list[str] | None = None,
+        http_connections: int = 2,
+        timeout: float = 10,
+    ) -> typing.AsyncGenerator[None, None]:
+        """Warm the pools, then refresh the state in the background while the context is active."""
+        cls.database = database
+        await cls.warm_up(
+            database,
+            mongo_connections=mongo_connections,
+            http_urls=http_urls or [],
+            http_connections=http_connections,
+            timeout=timeout,
+        )
+        cls.state = cls.check()
+        cls.refresher = asyncio.create_task(cls.refresh())
+        try:
+            yield
+        finally:
+            cls.refresher.cancel()
+            await asyncio.gather(cls.refresher, return_exceptions=True)
+            cls.refresher = None
+            cls.warmed_up = False
+            cls.state = {"ready": False}
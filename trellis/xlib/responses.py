@@ -0,0 +1,61 @@
+"""
+Responses.
+
+Fast JSON responses for routers returning trusted data, such as serializers built from the DB.
+
+By default, FastAPI validates the value returned by an endpoint against its response model,
+converts it to JSON compatible objects, then encodes it with the standard `json` module.
+Routers created with `route_class=FastJSONRoute` encode the returned value directly with
+the pydantic-core encoder. The response model is still used to document the endpoint.
+"""
+
+import functools
+import typing
+
+import pydantic_core
+from fastapi.routing import APIRoute
+from starlette.responses import JSONResponse, Response
+
+
+class FastJSONResponse(JSONResponse):
+    """JSON response encoded by pydantic-core.
+
+    The output is the same as `JSONResponse`: compact separators and UTF-8 characters.
+    """
+
+    def render(self, content: typing.Any) -> bytes:
+        """Encode the content."""
+        return pydantic_core.to_json(content)
+
+
+class FastJSONRoute(APIRoute):
+    """Route returning the endpoint value as a `FastJSONResponse`, without response model validation."""
+
+    def __init__(self, path: str, endpoint: typing.Callable[..., typing.Any], **kwargs: typing.Any) -> None:
+        """Wrap the endpoint so that it returns a response FastAPI sends as is."""
+        if not hasattr(endpoint, "fast_json_status_code"):  # routes are re-created when included in a router
+            endpoint = self.wrap_endpoint(endpoint, kwargs.get("status_code"))
+        super().__init__(path, endpoint, **kwargs)
+
+    @staticmethod
+    def wrap_endpoint(
+        endpoint: typing.Callable[..., typing.Awaitable[typing.Any]], status_code: int | None
+    ) -> typing.Callable[..., typing.Awaitable[Response]]:
+        """Return an endpoint with the same signature that encodes the value of `endpoint`."""
+
+        @functools.wraps(endpoint)
+        async def wrapper(*args: typing.Any, **kwargs: typing.Any) -> Response:
+            content = await endpoint(*args, **kwargs)
+            if isinstance(content, Response):
+                return content
+
+            response = FastJSONResponse(content, status_code=status_code or 200)
+            # Apply the headers and status code set on the `Response` parameter, as FastAPI does
+            for value in kwargs.values():
+                if isinstance(value, Response):
+                    response.headers.raw.extend(value.headers.raw)
+                    response.status_code = value.status_code or response.status_code
+            return response
+
+        setattr(wrapper, "fast_json_status_code", status_code)
+        return wrapper
@@ -0,0 +1,85 @@
+"""
+Rest.
+
+Shared HTTP connection pool used by the REST clients of all Trellis.
+
+Opening a new `httpx.AsyncClient` for each API client means a new TCP and TLS
+handshake for each request. The pool keeps connections alive and reuses them,
+across all clients of the process, for as long as the pool is open.
+"""
+
+import asyncio
+import typing
+from contextlib import asynccontextmanager
+
+import httpx
+
+
+class HttpPool:
+    """Process-wide pool of HTTP connections.
+
+    The pool is opened and closed by `lifespan()`, that wraps the FastAPI app lifespan
+    and each worker task execution. Nested lifespans share the same pool.
+    Outside of a lifespan, `connect()` opens a client closed with its context.
+    """
+
+    client: typing.ClassVar[httpx.AsyncClient | None] = None
+    loop: typing.ClassVar[asyncio.AbstractEventLoop | None] = None
+    users: typing.ClassVar[int] = 0  # number of active lifespans
+
+    http2: typing.ClassVar[bool] = True
+    limits: typing.ClassVar[httpx.Limits] = httpx.Limits(
+        max_connections=100, max_keepalive_connections=20, keepalive_expiry=30
+    )
+    timeout: typing.ClassVar[httpx.Timeout] = httpx.Timeout(30, connect=10)
+    transport: typing.ClassVar[httpx.AsyncBaseTransport | None] = None  # replace the network, used in tests
+
+    @classmethod
+    def open_client(cls) -> httpx.AsyncClient:
+        """Return a new client with the settings of the pool."""
+        return httpx.AsyncClient(http2=cls.http2, limits=cls.limits, timeout=cls.timeout, transport=cls.transport)
+
+    @classmethod
+    def get_client(cls) -> httpx.AsyncClient:
+        """Return the shared client, opening it if needed.
+
+        Connections are bound to the event loop they were opened with,
+        so a new client is opened when the running loop has changed.
+        """
+        if cls.users == 0:
+            raise RuntimeError("The shared HTTP pool is only available within HttpPool.lifespan()")
+        loop = asyncio.get_running_loop()
+        if cls.client is None or cls.client.is_closed or cls.loop is not loop:
+            cls.client = cls.open_client()
+            cls.loop = loop
+        return cls.client
+
+    @classmethod
+    @asynccontextmanager
+    async def connect(cls) -> typing.AsyncGenerator[httpx.AsyncClient, None]:
+        """Return the shared client within a lifespan, or a client closed with the context outside of it."""
+        if cls.users:
+            yield cls.get_client()
+            return
+        async with cls.open_client() as client:
+            yield client
+
+    @classmethod
+    async def close(cls) -> None:
+        """Close all connections of the pool."""
+        if cls.client is not None and cls.loop is asyncio.get_running_loop():
+            await cls.client.aclose()
+        cls.client = None
+        cls.loop = None
+
+    @classmethod
+    @asynccontextmanager
+    async def lifespan(cls) -> typing.AsyncGenerator[httpx.AsyncClient, None]:
+        """Keep the pool open while the context is active."""
+        cls.users += 1
+        try:
+            yield cls.get_client()
+        finally:
+            cls.users -= 1
+            if cls.users == 0:
+                await cls.close()
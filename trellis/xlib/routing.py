@@ -0,0 +1,45 @@
+"""
+Routing.
+
+Mount the router of a trellis without importing it.
+
+Importing the routes of a trellis imports its views, serializers and third-party SDKs,
+which delays the startup of each worker. A `LazyMount` imports its app on the first
+request matching its path, or when a URL is built from one of its route names,
+ex: `request.url_for("instagram:home")`. Requests to other mounts never import it.
+"""
+
+import typing
+from importlib import import_module
+
+from starlette.routing import BaseRoute, Mount
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+
+class LazyMount(Mount):
+    """Mount importing its app on first use."""
+
+    target: str  # import path of the app, ex: trellis.instagram.routes:router
+    loaded: ASGIApp | None
+
+    def __init__(self, path: str, target: str, name: str | None = None) -> None:
+        """Initialize the mount, without importing the app."""
+        super().__init__(path=path, app=self.handle_lazily, name=name)
+        self.target = target
+        self.loaded = None
+
+    def load(self) -> ASGIApp:
+        """Import the app, once."""
+        if self.loaded is None:
+            module_name, attribute = self.target.split(":")
+            self.loaded = typing.cast(ASGIApp, getattr(import_module(module_name), attribute))
+        return self.loaded
+
+    async def handle_lazily(self, scope: Scope, receive: Receive, send: Send) -> None:
+        """Handle a request with the imported app."""
+        await self.load()(scope, receive, send)
+
+    @property
+    def routes(self) -> list[BaseRoute]:
+        """Return the routes of the imported app, used to build URLs."""
+        return typing.cast(list[BaseRoute], getattr(self.load(), "routes", []))
@@ -0,0 +1,99 @@
+"""
+Throttle.
+
+Rate limiting helpers used to keep API requests under third party quotas.
+"""
+
+import asyncio
+import time
+import typing
+
+
+class RateLimiter:
+    """Token bucket rate limiter.
+
+    Tokens are refilled continuously at `rate` per second, up to `burst` tokens.
+    Each acquisition consumes one token.
+    """
+
+    rate: float  # number of tokens refilled per second
+    burst: float  # maximum number of tokens that can be accumulated
+    tokens: float
+    updated: float
+
+    def __init__(self, rate: float, burst: float) -> None:
+        """Initialize a full bucket."""
+        assert rate > 0 and burst >= 1
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    async def acquire(self) -> None:
+        """Consume a token, waiting for it to be refilled if the bucket is empty.
+
+        Tokens are reserved in order: the balance can go negative and each caller
+        waits for the time needed to refill its own token. The token of a cancelled caller is given back.
+        """
+        self.tokens = self.refill() - 1
+        if self.tokens >= 0:
+            return
+        try:
+            await asyncio.sleep(-self.tokens / self.rate)
+        except asyncio.CancelledError:
+            self.release()
+            raise
+
+    def refill(self) -> float:
+        """Add the tokens refilled since the last update, and return the balance."""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return self.tokens
+
+    def release(self) -> None:
+        """Give back a token acquired for a request that has not been sent."""
+        self.tokens = min(self.burst, self.tokens + 1)
+
+
+class RequestBudget:
+    """Combine a global rate limit with a rate limit per key (usually an access token).
+
+    The limiters of the keys are dropped once refilled, as a new limiter starts with a full bucket.
+    They are swept when the number of keys doubles, so that the sweeps cost O(1) per key.
+    """
+
+    global_limiter: RateLimiter
+    key_rate: float
+    key_burst: float
+    key_limiters: dict[str, RateLimiter]
+    sweep_size: int  # number of keys from which the refilled limiters are dropped
+
+    min_sweep_size: typing.ClassVar[int] = 1024
+
+    def __init__(self, *, global_rate: float, global_burst: float, key_rate: float, key_burst: float) -> None:
+        """Initialize the budget."""
+        self.global_limiter = RateLimiter(rate=global_rate, burst=global_burst)
+        self.key_rate = key_rate
+        self.key_burst = key_burst
+        self.key_limiters = {}
+        self.sweep_size = self.min_sweep_size
+
+    async def acquire(self, key: str) -> None:
+        """Wait until both the key budget and the global budget allow a new request."""
+        if key not in self.key_limiters:
+            if len(self.key_limiters) >= self.sweep_size:
+                self.sweep()
+            self.key_limiters[key] = RateLimiter(rate=self.key_rate, burst=self.key_burst)
+        limiter = self.key_limiters[key]
+        await limiter.acquire()
+        try:
+            await self.global_limiter.acquire()
+        except asyncio.CancelledError:
+            limiter.release()
+            raise
+
+    def sweep(self) -> None:
+        """Drop the limiters of the keys that have refilled their bucket."""
+        self.key_limiters = {key: x for key, x in self.key_limiters.items() if x.refill() < x.burst}
+        self.sweep_size = max(self.min_sweep_size, 2 * len(self.key_limiters))